@@ -1,45 +1,280 @@
-from flask import Flask, request, jsonify, render_template, Response
+from flask import Flask, request, jsonify, render_template, Response, g
+import os
 import json
+import math
+import functools
+import traceback
+from pathlib import Path
 
-from src.exception import RAQAMException
-from src.raqam import QuizGenerator
+from src.exception import RAQAMException, JobNotFoundException
+from src.instrumentation import METRICS
+from src.jobs import JobStore, JobQueue
+from src.pipeline import generate_output_data, iter_output_events, iter_result_events, build_output_data, sample_output_data, fill_question_bank
 from src.quiz_config import QuizConfig
+from src.question_bank import build_question_bank
+from src.result_cache import build_result_cache
+from src.scheduler import render_metrics
+from src.serving import ConcurrencyLimiter, load_dependencies
+from src.uploads import spool_stream, spool_copy, remove_files
 from src.utils import load_config, read_yaml, save_yaml
 
 app = Flask(__name__)
 
 config = load_config()
 
+result_cache = build_result_cache(**(config.get("result_cache") or {}))
+
+# Questions and flashcards pools sampled by requests in bank mode (no bank mode if None)
+question_bank = build_question_bank(**(config.get("question_bank") or {}))
+
+# Directory where uploaded files are spooled while they are processed (system temporary directory if None)
+uploads_path = (config.get("uploads") or {}).get("path")
+
+# Bounding generation requests in progress in this process, rejecting the others with a 503 error
+serving_config = config.get("serving") or {}
+limiter = ConcurrencyLimiter(max_concurrent_requests=serving_config.get("max_concurrent_requests", 64),
+                             retry_after=serving_config.get("retry_after", 5))
+
+# Endpoints running generations or receiving uploads, bounded by the limiter
+LIMITED_ENDPOINTS = {"generate_quiz", "submit_job"}
+
+# Loading dependencies and model clients before serving (in the master process when preloaded by gunicorn)
+if os.environ.get("RAQAM_WARM_UP") == "1":
+    load_dependencies(config["base_quiz_config"])
+
+def run_job(data, progress_callback):
+    """
+    Runs a queued quiz generation job
+
+    @param data: Input data of the job
+    @param progress_callback: Function called with the generation progress dictionnary when it changes
+    """
+    pdf_path = data.pop("pdf_path", None)
+    if pdf_path is not None:
+        # Pdf files are opened from the job files directory, without loading them in memory
+        data["pdf_file"] = [Path(path) for path in pdf_path] if isinstance(pdf_path, list) else Path(pdf_path)
+    quiz_config = QuizConfig(**config["base_quiz_config"])
+    quiz_config.parse_input_data(data)
+    # Queued jobs are scheduled after interactive requests
+    quiz_config.priority = "bulk"
+    if data.get("job_type") == "question_bank":
+        return fill_question_bank(quiz_config, question_bank, progress_callback=progress_callback)
+    return generate_output_data(quiz_config,
+                                generate_quiz=int(data["num_questions"]) > 0,
+                                generate_flashcards=bool(data.get("generate_flashcards")),
+                                result_cache=result_cache,
+                                progress_callback=progress_callback)
+
+jobs_config = config.get("jobs") or {}
+job_queue = JobQueue(store=JobStore(path=jobs_config.get("path", "/tmp/raqam/jobs.sqlite"),
+                                    files_path=jobs_config.get("files_path", "/tmp/raqam/job_files")),
+                     run_job=run_job,
+                     max_concurrent_jobs=jobs_config.get("max_concurrent_jobs", 2),
+                     poll_interval=jobs_config.get("poll_interval", 1.0),
+                     stale_after=jobs_config.get("stale_after", 600),
+                     max_attempts=jobs_config.get("max_attempts", 3))
+
+@app.before_request
+def start_job_workers():
+    # Starting job workers in the serving process (no-op once started or when draining)
+    if not limiter.draining:
+        job_queue.start()
+
+@app.before_request
+def acquire_concurrency_slot():
+    if request.endpoint in LIMITED_ENDPOINTS:
+        limiter.acquire()
+        g.concurrency_slot = True
+
+@app.after_request
+def release_concurrency_slot_on_close(response):
+    # Streamed responses keep their slot until the end of the stream
+    if g.pop("concurrency_slot", False):
+        response.call_on_close(limiter.release)
+    return response
+
+@app.teardown_request
+def release_concurrency_slot(error=None):
+    # Releasing the slot of requests that failed before a response was built
+    if g.pop("concurrency_slot", False):
+        limiter.release()
+
+def drain():
+    """
+    Stops taking generation requests and jobs before the process exits, requests in progress being
+    completed (called from the SIGTERM handler of serving workers, so it must not block)
+    """
+    limiter.drain()
+    # Job workers finish their current job without claiming new ones
+    job_queue.request_stop()
+
 @app.errorhandler(RAQAMException)
 def handle_api_error(error):
     response = jsonify({"error": error.error, "message": error.message, "stack_trace": error.stack_trace})
     response.status_code = error.status_code
+    if getattr(error, "retry_after", None) is not None:
+        response.headers["Retry-After"] = str(max(1, math.ceil(error.retry_after)))
     return response
 
+def spool_pdf_files():
+    """
+    Copies the uploaded pdf files to temporary files, block by block. Returns the path of the uploaded
+    pdf file, a list of paths when several pdf files are uploaded (None if no file), and the list of
+    spooled paths to remove once the request is done.
+    """
+    pdf_paths = []
+    try:
+        for pdf_file in request.files.getlist('pdf_file'):
+            pdf_paths.append(spool_stream(pdf_file.stream, directory=uploads_path))
+    except Exception:
+        remove_files(pdf_paths)
+        raise
+    if not pdf_paths:
+        return None, pdf_paths
+    return (pdf_paths[0] if len(pdf_paths) == 1 else pdf_paths), pdf_paths
+
+def submit_question_bank_job(data,
+                             pdf_file,
+                             tenant):
+    """
+    Queues a job building the question bank of the document of a request, on copies of its spooled
+    pdf files (still read by the request)
+
+    @param data: Input data of the request
+    @param pdf_file: Spooled pdf file path or list of paths of the request (None if no file)
+    @param tenant: Tenant of the request
+    """
+    if isinstance(pdf_file, list):
+        pdf_file = [spool_copy(path, directory=uploads_path) for path in pdf_file]
+    elif pdf_file is not None:
+        pdf_file = spool_copy(pdf_file, directory=uploads_path)
+    job_data = {key: value for key, value in data.items() if key != "pdf_file"}
+    return job_queue.submit(tenant=tenant, data={**job_data, "job_type": "question_bank"}, pdf_file=pdf_file)
+
+def get_stream_format(data):
+    """
+    Returns the streaming format requested by the client ("ndjson" or "sse"), None if not streaming
+
+    @param data: Input data of the request
+    """
+    stream = data.get("stream")
+    if stream in ["ndjson", "sse"]:
+        return stream
+    accept = request.headers.get("Accept", "")
+    if "text/event-stream" in accept:
+        return "sse"
+    if stream or "application/x-ndjson" in accept:
+        return "ndjson"
+    return None
+
+def format_events(events, stream_format):
+    """
+    Formats (event, data) pairs as NDJSON lines or Server-Sent Events. Errors raised during generation
+    are sent as a final "error" event since response status has already been sent.
+
+    @param events: Iterator of (event, data) pairs
+    @param stream_format: Streaming format ("ndjson" or "sse")
+    """
+    def format_event(event, event_data):
+        if stream_format == "sse":
+            return f"event: {event}\ndata: {json.dumps(event_data, separators=(',', ':'))}\n\n"
+        return json.dumps({"event": event, "data": event_data}, separators=(",", ":")) + "\n"
+    try:
+        for event, event_data in events:
+            yield format_event(event, event_data)
+    except RAQAMException as e:
+        yield format_event("error", {"error": e.error, "message": e.message, "stack_trace": e.stack_trace})
+    except Exception as e:
+        yield format_event("error", {"error": "InternalServerError", "message": str(e), "stack_trace": traceback.format_exc()})
+
 @app.route("/generate-quiz", methods=["POST"])
 def generate_quiz():
     # Isolating query parameters
-    pdf_file = request.files.get('pdf_file')
-    if pdf_file is not None:
-        pdf_file = pdf_file.read()
-    print(request.files)
-    data = json.load(request.files.get('data'))
-    print(data)
-    data["pdf_file"] = pdf_file
-    quiz_config = QuizConfig(**config["base_quiz_config"])
-    quiz_config.parse_input_data(data)
-    # Parsing document 
-    quiz_generator = QuizGenerator(**quiz_config.__dict__)
-    output_data = {}
-    if data["generate_flashcards"]:
-        flashcards = quiz_generator.generate_flashcards()
-        output_data = {**output_data, **flashcards.to_dict()}
-    if int(data["num_questions"]) > 0:
-        quiz = quiz_generator.generate_quiz()
-        output_data = {**output_data, **quiz.to_dict()}
-    quiz_context = quiz_generator.get_context()
-    output_data["quizContext"] = quiz_context
-    return Response(json.dumps(output_data, indent=4, sort_keys=False), mimetype="application/json")
+    pdf_file, pdf_paths = spool_pdf_files()
+    try:
+        print(request.files)
+        data = json.load(request.files.get('data'))
+        print(data)
+        data["pdf_file"] = pdf_file
+        quiz_config = QuizConfig(**config["base_quiz_config"])
+        quiz_config.parse_input_data(data)
+        generate_quiz = int(data["num_questions"]) > 0
+        generate_flashcards = bool(data["generate_flashcards"])
+        # Streaming generated items when requested by flag or Accept header
+        stream_format = get_stream_format(data)
+        bank_context = None
+        if data.get("mode") == "bank" and question_bank is not None:
+            # Sampling the quiz from the question bank of the document, built or topped up in background
+            tenant = request.headers.get("X-Tenant-Id") or data.get("tenant_id") or "default"
+            quiz, flashcards, quiz_context = sample_output_data(quiz_config, question_bank,
+                                                                generate_quiz=generate_quiz,
+                                                                generate_flashcards=generate_flashcards,
+                                                                build_callback=lambda: submit_question_bank_job(data, pdf_file, tenant))
+            if quiz is not None or flashcards is not None:
+                if stream_format is not None:
+                    mimetype = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+                    return Response(format_events(iter_result_events(quiz, flashcards, quiz_context), stream_format), mimetype=mimetype)
+                output_data = build_output_data(quiz, flashcards, quiz_context)
+                return Response(json.dumps(output_data, separators=(",", ":")), mimetype="application/json")
+            # Generating the quiz of this request until the bank of the document is built
+            bank_context = quiz_context["questionBank"]
+        if stream_format is not None:
+            events = iter_output_events(quiz_config,
+                                        generate_quiz=generate_quiz,
+                                        generate_flashcards=generate_flashcards,
+                                        result_cache=result_cache)
+            mimetype = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+            response = Response(format_events(events, stream_format), mimetype=mimetype)
+            # Spooled files are read until the end of the streamed response
+            response.call_on_close(functools.partial(remove_files, pdf_paths))
+            pdf_paths = []
+            return response
+        # Parsing document and generating quiz (or reusing result of an identical request)
+        output_data = generate_output_data(quiz_config,
+                                           generate_quiz=generate_quiz,
+                                           generate_flashcards=generate_flashcards,
+                                           result_cache=result_cache)
+        if bank_context is not None:
+            output_data["quizContext"]["questionBank"] = bank_context
+    finally:
+        remove_files(pdf_paths)
+    return Response(json.dumps(output_data, separators=(",", ":")), mimetype="application/json")
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    # Isolating query parameters
+    pdf_file, pdf_paths = spool_pdf_files()
+    try:
+        data = json.load(request.files.get('data'))
+        # Validating input data before queueing the job
+        quiz_config = QuizConfig(**config["base_quiz_config"])
+        quiz_config.parse_input_data({**data, "pdf_file": pdf_file})
+        tenant = request.headers.get("X-Tenant-Id") or data.get("tenant_id") or "default"
+        # Spooled files are moved to the job files directory
+        job_id = job_queue.submit(tenant=tenant, data=data, pdf_file=pdf_file)
+    finally:
+        remove_files(pdf_paths)
+    return Response(json.dumps({"jobId": job_id, "status": "queued"}), status=202, mimetype="application/json")
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_queue.store.get(job_id)
+    if job is None:
+        raise JobNotFoundException(job_id=job_id)
+    output_data = {key: job[key] for key in ["jobId", "status", "progress", "result", "error"]}
+    return Response(json.dumps(output_data, separators=(",", ":")), mimetype="application/json")
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Stage timings of the generations and model schedulers of this process, in Prometheus text format
+    return Response(METRICS.render() + render_metrics() + limiter.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/health", methods=["GET"])
+def health():
+    # Failing health checks while draining so that load balancers stop routing requests to this process
+    status_code = 503 if limiter.draining else 200
+    return Response(json.dumps({"status": "draining" if limiter.draining else "ok", "inFlight": limiter.in_flight}),
+                    status=status_code, mimetype="application/json")
 
 @app.route("/quiz-sandbox")
 def quiz_sandbox():
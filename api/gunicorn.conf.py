@@ -0,0 +1,60 @@
+"""
+Production serving of the Flask API with gunicorn: preforked workers sharing the configuration, the
+dependencies and the model clients loaded once by the master process (preload_app), gevent workers in
+which requests waiting on LLM calls, embeddings or uploads are greenlets instead of OS threads, and
+graceful drain on SIGTERM. Settings are read from the serving section of the configuration.
+
+Usage: gunicorn -c api/gunicorn.conf.py api.api:app
+"""
+import os
+import signal
+import multiprocessing
+
+from src.utils import load_config
+
+serving_config = load_config().get("serving") or {}
+
+worker_class = serving_config.get("worker_class", "gevent")
+if worker_class == "gevent":
+    # Patching blocking calls before the application is preloaded, so that the locks, threads and sockets
+    # it creates (ex: model clients, schedulers, generation thread pools) are cooperative
+    from gevent import monkey
+    monkey.patch_all()
+
+bind = serving_config.get("bind", "0.0.0.0:5050")
+workers = serving_config.get("workers") or multiprocessing.cpu_count()
+worker_connections = serving_config.get("worker_connections", 1000)
+timeout = serving_config.get("timeout", 300)
+graceful_timeout = serving_config.get("graceful_timeout", 120)
+keepalive = serving_config.get("keepalive", 5)
+preload_app = True
+
+# Loading dependencies and model clients in the master process, before workers are forked
+os.environ.setdefault("RAQAM_WARM_UP", "1")
+
+
+def post_worker_init(worker):
+    """
+    Drains the worker as soon as it receives SIGTERM: new generation requests get a 503 error and health
+    checks fail while gunicorn completes requests in progress (within graceful_timeout)
+
+    @param worker: gunicorn worker
+    """
+    from api.api import drain
+    handle_exit = worker.handle_exit
+
+    def handle_term(sig, frame):
+        drain()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+def worker_exit(server, worker):
+    """
+    Waits for the jobs run by the worker before it exits (unfinished jobs are queued again once stale)
+
+    @param server: gunicorn arbiter
+    @param worker: gunicorn worker
+    """
+    from api.api import job_queue
+    job_queue.stop(timeout=graceful_timeout)
@@ -1,14 +1,23 @@
+import os
 import json
-import base64
 import traceback
 
 from src.exception import RAQAMException
-from src.raqam import QuizGenerator
+from src.pipeline import generate_output_data
 from src.quiz_config import QuizConfig
+from src.result_cache import build_result_cache
+from src.serving import load_dependencies
+from src.uploads import spool_base64, remove_files
 from src.utils import load_config
 
 config = load_config()
 
+# Result cache is kept across warm invocations
+result_cache = build_result_cache(**(config.get("result_cache") or {}))
+
+# Directory where uploaded files are decoded while they are processed (/tmp is the only writable directory)
+uploads_path = (config.get("uploads") or {}).get("path")
+
 
 ALLOWED_ORIGINS = [
     "https://quiz-tonic.flutterflow.app",
@@ -29,10 +38,32 @@ def get_cors_headers(event):
     return headers
 
 
+def warm_up():
+    """
+    Loads lazily imported dependencies, model clients and tokenizers ahead of the first request. Meant
+    for provisioned containers where it runs during initialization (RAQAM_WARM_UP=1) or on a scheduled
+    {"warmup": true} event.
+    """
+    load_dependencies(config["base_quiz_config"])
+
+if os.environ.get("RAQAM_WARM_UP") == "1":
+    warm_up()
+
+
 def lambda_handler(event, context):
+    pdf_paths = []
     try:
         cors_headers = get_cors_headers(event)
 
+        # Handle warm-up events of provisioned containers
+        if event.get("warmup"):
+            warm_up()
+            return {
+                "statusCode": 200,
+                "headers": cors_headers,
+                "body": json.dumps({"warm": True})
+            }
+
         # Handle preflight CORS request
         if event.get("requestContext", {}).get("http", {}).get("method") == "OPTIONS":
             return {
@@ -41,34 +72,34 @@ def lambda_handler(event, context):
                 "body": ""
             }
 
-        # Parsing request body (API Gateway sends body as a string)
+        # Parsing request body (API Gateway sends body as a string), then releasing the raw body
         body = json.loads(event["body"])
+        event["body"] = None
         data = body.get("data")
 
         print({key: value for key, value in data.items() if key != "pdf_file"})
 
-        pdf_file = data.get("pdf_file")
-        if pdf_file:
-            pdf_file = base64.b64decode(pdf_file)
+        # Decoding base64 pdf files block by block into temporary files, each encoded string being
+        # released once decoded
+        pdf_file = data.pop("pdf_file", None)
+        if isinstance(pdf_file, list):
+            pdf_file = [content for content in pdf_file if content]
+            for i in range(len(pdf_file)):
+                pdf_file[i] = spool_base64(pdf_file[i], directory=uploads_path)
+                pdf_paths.append(pdf_file[i])
+        elif pdf_file:
+            pdf_file = spool_base64(pdf_file, directory=uploads_path)
+            pdf_paths.append(pdf_file)
 
         data["pdf_file"] = pdf_file
 
         quiz_config = QuizConfig(**config["base_quiz_config"])
         quiz_config.parse_input_data(data)
 
-        quiz_generator = QuizGenerator(**quiz_config.__dict__)
-        output_data = {}
-
-        if data.get("generate_flashcards"):
-            flashcards = quiz_generator.generate_flashcards()
-            output_data.update(flashcards.to_dict())
-
-        if int(data.get("num_questions", 0)) > 0:
-            quiz = quiz_generator.generate_quiz()
-            output_data.update(quiz.to_dict())
-
-        quiz_context = quiz_generator.get_context()
-        output_data["quizContext"] = quiz_context
+        output_data = generate_output_data(quiz_config,
+                                           generate_quiz=int(data.get("num_questions", 0)) > 0,
+                                           generate_flashcards=bool(data.get("generate_flashcards")),
+                                           result_cache=result_cache)
 
         return {
             "statusCode": 200,
@@ -76,7 +107,7 @@ def lambda_handler(event, context):
                 **cors_headers,
                 "Content-Type": "application/json"
             },
-            "body": json.dumps(output_data, indent=4, sort_keys=False)
+            "body": json.dumps(output_data, separators=(",", ":"))
         }
 
     except RAQAMException as e:
@@ -93,4 +124,7 @@ def lambda_handler(event, context):
             "statusCode": 500,
             "headers": cors_headers,
             "body": json.dumps({"error": "InternalServerError", "message": str(e)})
-        }
\ No newline at end of file
+        }
+
+    finally:
+        remove_files(pdf_paths)
\ No newline at end of file
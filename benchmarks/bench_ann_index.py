@@ -0,0 +1,70 @@
+"""
+Reports build time, query latency and recall@k against the exact flat index of the FAISS index
+strategies of VectorStore, on synthetic clustered unit-norm vectors.
+
+Usage: python -m benchmarks.bench_ann_index [--vectors 100000] [--dimension 1536] [--queries 200] [--k 10] [--metric ip]
+"""
+import time
+import argparse
+
+import numpy as np
+import faiss
+
+from src.vector_store import VectorStore
+
+
+def generate_vectors(nb_vectors, dimension, nb_clusters=256, seed=0):
+    """
+    Generates unit-norm vectors sampled around random cluster centers (similar to text embeddings)
+
+    @param nb_vectors: Number of vectors to generate
+    @param dimension: Dimension of the vectors
+    @param nb_clusters: Number of clusters
+    @param seed: Random seed
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((nb_clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, nb_clusters, nb_vectors)] + 0.5 * rng.standard_normal((nb_vectors, dimension)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def main():
+    parser = argparse.ArgumentParser(description="ANN index benchmark")
+    parser.add_argument("--vectors", type=int, default=100000, help="Number of indexed vectors")
+    parser.add_argument("--dimension", type=int, default=1536, help="Dimension of vectors")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--k", type=int, default=10, help="Number of neighbors to retrieve")
+    parser.add_argument("--metric", default="ip", choices=["l2", "ip"], help="Search metric")
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256], help="HNSW efSearch values")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64], help="IVF nprobe values")
+    args = parser.parse_args()
+
+    vectors = generate_vectors(args.vectors + args.queries, args.dimension)
+    vectors, queries = vectors[:args.vectors], vectors[args.vectors:]
+
+    # Ground truth from the exact flat index
+    flat_index = VectorStore(embedding_model=None, embedding_batch_size=1, index_strategy="flat", index_metric=args.metric).build_index(vectors)
+    flat_index.add(vectors)
+    _, ground_truth = flat_index.search(queries, args.k)
+
+    configurations = [("flat", {})]
+    configurations += [("hnsw", {"hnsw_ef_search": ef_search}) for ef_search in args.ef_search]
+    configurations += [("ivfpq", {"ivf_nprobe": nprobe}) for nprobe in args.nprobe]
+    print(f"{args.vectors} vectors of dimension {args.dimension}, {args.queries} queries, metric {args.metric}")
+    print(f"{'index':<22} {'build (s)':>10} {'query (ms)':>11} {'recall@' + str(args.k):>10}")
+    for strategy, params in configurations:
+        vector_store = VectorStore(embedding_model=None, embedding_batch_size=1, index_strategy=strategy,
+                                   index_metric=args.metric, **params)
+        start = time.perf_counter()
+        index = vector_store.build_index(vectors)
+        index.add(vectors)
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        _, neighbors = index.search(queries, args.k)
+        query_time = (time.perf_counter() - start) / args.queries
+        recall = np.mean([len(set(found) & set(expected)) / args.k for found, expected in zip(neighbors, ground_truth)])
+        name = strategy + "".join(f" {key.split('_')[-1]}={value}" for key, value in params.items())
+        print(f"{name:<22} {build_time:10.2f} {query_time * 1000:11.3f} {recall:10.3f}")
+
+if __name__ == "__main__":
+    main()
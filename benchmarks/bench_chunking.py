@@ -0,0 +1,64 @@
+"""
+Compares the former reduce-based list concatenation of Document chunks with the streaming chunker on
+a synthetic multi-thousand page input.
+
+Usage: python -m benchmarks.bench_chunking [--pages 5000] [--page-length 3000] [--chunk-size 2000] [--chunk-overlap 100]
+"""
+import time
+import random
+import string
+import argparse
+from functools import reduce
+
+from src.document import Document
+
+
+def generate_pages(nb_pages, page_length, seed=0):
+    """
+    Generates synthetic pages made of random words and sentences
+
+    @param nb_pages: Number of pages to generate
+    @param page_length: Approximate number of characters per page
+    @param seed: Random seed
+    """
+    rng = random.Random(seed)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(5000)]
+    pages = []
+    for _ in range(nb_pages):
+        page_words = []
+        length = 0
+        while length < page_length:
+            word = rng.choice(words)
+            page_words.append(word + ("." if rng.random() < 0.08 else ""))
+            length += len(word) + 1
+        pages.append(" ".join(page_words))
+    return pages
+
+def main():
+    parser = argparse.ArgumentParser(description="Document chunking benchmark")
+    parser.add_argument("--pages", type=int, default=5000, help="Number of synthetic pages")
+    parser.add_argument("--page-length", type=int, default=3000, help="Number of characters per page")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="Size of chunks")
+    parser.add_argument("--chunk-overlap", type=int, default=100, help="Overlap of chunks")
+    args = parser.parse_args()
+
+    pages = generate_pages(args.pages, args.page_length)
+    document = Document(text_data=pages[:1], chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+
+    # Former implementation: quadratic list concatenation of the chunks of each page
+    start = time.perf_counter()
+    reduce(lambda x, y: x+y, [document.split_text_into_chunks(text) for text in pages])
+    reduce_time = time.perf_counter() - start
+
+    # Streaming chunker with chunk metadata, fed by an iterator of pages
+    start = time.perf_counter()
+    document = Document(text_data=iter(pages), chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    document.split_all()
+    streaming_time = time.perf_counter() - start
+
+    print(f"{args.pages} pages, {len(document.chunks)} chunks")
+    print(f"{'reduce_concatenation':<22} {reduce_time:8.3f} s")
+    print(f"{'streaming_chunker':<22} {streaming_time:8.3f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Measures the cold-start import time of the Lambda entry point with python -X importtime and checks it
+against a budget. Also checks that source-specific and retrieval-specific dependencies (PDF, HTML
+parsing, FAISS) are not imported at cold start, so that text-only requests never load them, and that
+the OpenAI client is only imported when the model clients are built.
+
+Usage: python -m benchmarks.bench_import_time [--module api.lambda_function] [--budget-ms 1500] [--top 15]
+Exits with status 1 when the budget is exceeded or a lazily loaded dependency is imported.
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+# httpx and requests are not listed: langchain_core, needed by every request, imports them
+LAZY_MODULES = ["faiss", "pymupdf", "pymupdf4llm", "bs4", "src.pdf", "src.web_page", "src.vector_store", "src.embedding_cache",
+                "langchain_openai", "openai"]
+
+
+def measure_import_time(module):
+    """
+    Imports a module in a fresh interpreter with -X importtime and returns the cumulative import time
+    (in microseconds) of every imported module
+
+    @param module: Name of the module to import
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             capture_output=True, text=True, env={**os.environ, "RAQAM_WARM_UP": "0"})
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{process.stderr}")
+    import_times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented, top-level name is stripped
+        import_times[name.strip()] = int(cumulative)
+    return import_times
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import time benchmark")
+    parser.add_argument("--module", default="api.lambda_function", help="Entry point module to import")
+    parser.add_argument("--budget-ms", type=float, default=1500, help="Maximum cumulative import time in milliseconds")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest modules to report")
+    args = parser.parse_args()
+
+    import_times = measure_import_time(args.module)
+    total_ms = import_times[args.module] / 1000
+    print(f"Cumulative import time of {args.module}: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"Slowest modules (cumulative):")
+    for name, cumulative in sorted(import_times.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {cumulative / 1000:9.1f} ms  {name}")
+
+    eagerly_imported = [module for module in LAZY_MODULES if module in import_times]
+    if eagerly_imported:
+        print(f"Lazily loaded dependencies imported at cold start: {', '.join(eagerly_imported)}")
+    if total_ms > args.budget_ms or eagerly_imported:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
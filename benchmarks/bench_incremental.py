@@ -0,0 +1,76 @@
+"""
+Generates quiz and flashcards on a synthetic document, then on a revised version where a few pages
+were edited, with document states enabled and the fake LLM and embedding backends of src.fakes.
+Compares the LLM calls, embedding tokens and wall time of the full generation and of the incremental
+regeneration of the revised version.
+
+Usage: python -m benchmarks.bench_incremental [--pages 100] [--edited-pages 3] [--llm-latency 0.2]
+"""
+import time
+import random
+import argparse
+import tempfile
+
+from benchmarks.bench_chunking import generate_pages
+from src.fakes import FakeChatModel, FakeEmbeddings
+from src.raqam import QuizGenerator
+from src.templates import question_prompt_template, flashcards_prompt_template, retrieval_query
+from src.utils import load_config
+
+
+def run(pages, quiz_config, chat_model, embedding_model, document_state_path, num_questions):
+    """
+    Generates quiz and flashcards on the pages and returns the wall time and the quiz context
+
+    @param pages: Texts of the pages
+    @param quiz_config: Base quiz configuration
+    @param chat_model: Fake chat model
+    @param embedding_model: Fake embeddings model
+    @param document_state_path: Root directory of the document states
+    @param num_questions: Number of questions of the quiz
+    """
+    start = time.perf_counter()
+    quiz_generator = QuizGenerator(llm=chat_model,
+                                   embedding_model=embedding_model,
+                                   embedding_batch_size=quiz_config["embedding_batch_size"],
+                                   min_text_length=0,
+                                   chunk_size=quiz_config["chunk_size"],
+                                   chunk_overlap=quiz_config["chunk_overlap"],
+                                   question_prompt_template=question_prompt_template,
+                                   flashcards_prompt_template=flashcards_prompt_template,
+                                   retrieval_query=retrieval_query,
+                                   retrieval_strategy=quiz_config.get("retrieval_strategy", "query"),
+                                   num_questions=num_questions,
+                                   num_choices=4,
+                                   text_content="\n\n".join(pages),
+                                   document_state_path=document_state_path,
+                                   document_id="course")
+    quiz_generator.generate_quiz_and_flashcards()
+    return time.perf_counter() - start, quiz_generator.get_context()
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental regeneration benchmark")
+    parser.add_argument("--pages", type=int, default=100, help="Number of synthetic pages")
+    parser.add_argument("--page-length", type=int, default=3000, help="Number of characters per page")
+    parser.add_argument("--edited-pages", type=int, default=3, help="Number of pages edited in the revised version")
+    parser.add_argument("--num-questions", type=int, default=20, help="Number of questions of the quiz")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Latency of fake LLM calls in seconds")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Latency of fake embedding requests in seconds")
+    args = parser.parse_args()
+
+    quiz_config = load_config()["base_quiz_config"]
+    chat_model = FakeChatModel(model_name="fake:" + quiz_config["model_name"], latency=args.llm_latency)
+    embedding_model = FakeEmbeddings(model="fake:" + quiz_config["embdeddings_model_name"], latency=args.embedding_latency)
+    pages = generate_pages(args.pages, args.page_length)
+    revised_pages = list(pages)
+    for page in random.Random(0).sample(range(args.pages), args.edited_pages):
+        revised_pages[page] = revised_pages[page].replace(".", ", revised.", 3)
+
+    with tempfile.TemporaryDirectory() as document_state_path:
+        for version, version_pages in [("original", pages), ("revised", revised_pages)]:
+            seconds, quiz_context = run(version_pages, quiz_config, chat_model, embedding_model, document_state_path, args.num_questions)
+            print(f"{version:<10} {seconds:7.2f} s llm calls {quiz_context['packing']['llmRequests']:5d} "
+                  f"embedding tokens {quiz_context['tokens']['embeddings']:8d} incremental {quiz_context['incremental']}")
+
+if __name__ == "__main__":
+    main()
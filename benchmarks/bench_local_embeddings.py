@@ -0,0 +1,129 @@
+"""
+Compares embeddings backends selectable by embdeddings_model_name (ex: OpenAI text-embedding-3-small
+and a local CPU model run by src.local_embeddings): throughput of concurrent requests embedding their
+document chunks through VectorStore, effective batch size of local models, cost, and retrieval quality
+as recall@k of chunks searched with one of their sentences.
+
+Usage: python -m benchmarks.bench_local_embeddings [--models text-embedding-3-small local:sentence-transformers/all-MiniLM-L6-v2]
+       [--text-file document.txt] [--pages 50] [--clients 8] [--queries 200] [--k 5]
+"""
+import time
+import random
+import argparse
+import concurrent.futures
+
+import numpy as np
+import faiss
+
+from benchmarks.bench_chunking import generate_pages
+from src.clients import get_embedding_model
+from src.document import Document
+from src.raqam import get_model_costs
+from src.scheduler import get_scheduler
+from src.tokens import estimate_tokens
+from src.utils import load_config
+from src.vector_store import VectorStore
+
+
+def load_documents(args, quiz_config):
+    """
+    Returns the chunks of the documents embedded by each client: chunks of the text file split between
+    clients, or of synthetic pages generated for each client
+
+    @param args: Benchmark arguments
+    @param quiz_config: Base quiz configuration
+    """
+    if args.text_file:
+        with open(args.text_file) as file:
+            chunks = Document(text_data=[file.read()], chunk_size=quiz_config["chunk_size"], chunk_overlap=quiz_config["chunk_overlap"]).text_chunks
+        return [chunks[i::args.clients] for i in range(args.clients)]
+    return [Document(text_data=generate_pages(args.pages, 3000, seed=seed), chunk_size=quiz_config["chunk_size"],
+                     chunk_overlap=quiz_config["chunk_overlap"]).text_chunks for seed in range(args.clients)]
+
+def build_queries(chunks, nb_queries, seed=0):
+    """
+    Returns (query, chunk index) pairs, each query being the longest sentence of a randomly drawn chunk
+
+    @param chunks: Text chunks
+    @param nb_queries: Number of queries
+    @param seed: Random seed
+    """
+    rng = random.Random(seed)
+    queries = []
+    for index in rng.sample(range(len(chunks)), min(nb_queries, len(chunks))):
+        queries.append((max(chunks[index].split("."), key=len).strip(), index))
+    return queries
+
+def bench_model(model_name, documents, queries, args, quiz_config):
+    """
+    Embeds the documents from concurrent clients then searches the queries, returns the statistics of
+    the model
+
+    @param model_name: Name of the embeddings model
+    @param documents: Chunks of the document of each client
+    @param queries: (query, chunk index) pairs searched in the chunks of all documents
+    @param args: Benchmark arguments
+    @param quiz_config: Base quiz configuration
+    """
+    settings = {"max_batch_size": args.max_batch_size, "max_wait": args.max_wait} if model_name.startswith("local:") else {}
+    embedding_model = get_embedding_model(model_name, **settings)
+    scheduler = get_scheduler(model_name, max_concurrency=quiz_config["scheduler_max_concurrency"])
+    # Loading the model ahead of the timed run
+    embedding_model.embed_query("hello world")
+    nb_batches, nb_texts = getattr(embedding_model, "nb_batches", 0), getattr(embedding_model, "nb_texts", 0)
+
+    def embed_document(chunks):
+        vector_store = VectorStore(embedding_model=embedding_model, embedding_batch_size=quiz_config["embedding_batch_size"], scheduler=scheduler)
+        return vector_store.embed_chunks(chunks)
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(documents)) as executor:
+        embeddings = list(executor.map(embed_document, documents))
+    embedding_time = time.perf_counter() - start
+    nb_chunks = sum(len(chunks) for chunks in documents)
+    nb_tokens = sum(estimate_tokens(chunk) for chunks in documents for chunk in chunks)
+
+    embeddings = np.concatenate(embeddings)
+    faiss.normalize_L2(embeddings)
+    index = faiss.IndexFlatIP(embeddings.shape[1])
+    index.add(embeddings)
+    query_embeddings = np.array(embedding_model.embed_documents([query for query, _ in queries]), dtype=np.float32)
+    faiss.normalize_L2(query_embeddings)
+    _, neighbors = index.search(query_embeddings, args.k)
+    ranks = [list(found).index(expected) if expected in found else None for found, (_, expected) in zip(neighbors, queries)]
+    batches = getattr(embedding_model, "nb_batches", 0) - nb_batches
+    return {
+        "chunks_per_second": nb_chunks / embedding_time,
+        "embedding_time": embedding_time,
+        "mean_batch_size": (getattr(embedding_model, "nb_texts", 0) - nb_texts) / batches if batches else None,
+        "cost": nb_tokens / 1e6 * get_model_costs(model_name)["input"],
+        "recall_at_1": np.mean([rank == 0 for rank in ranks]),
+        "recall_at_k": np.mean([rank is not None for rank in ranks])
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Embeddings backends benchmark")
+    parser.add_argument("--models", nargs="+", default=["text-embedding-3-small", "local:sentence-transformers/all-MiniLM-L6-v2"],
+                        help="Embeddings models to compare (fake: and local: prefixes select offline backends)")
+    parser.add_argument("--text-file", default=None, help="Text document split between clients (synthetic pages if None)")
+    parser.add_argument("--pages", type=int, default=50, help="Number of synthetic pages per client")
+    parser.add_argument("--clients", type=int, default=8, help="Number of concurrent requests")
+    parser.add_argument("--queries", type=int, default=200, help="Number of retrieval queries")
+    parser.add_argument("--k", type=int, default=5, help="Number of retrieved chunks per query")
+    parser.add_argument("--max-batch-size", type=int, default=64, help="Maximum batch size of local models")
+    parser.add_argument("--max-wait", type=float, default=0.005, help="Batching delay of local models in seconds")
+    args = parser.parse_args()
+
+    quiz_config = load_config()["base_quiz_config"]
+    documents = load_documents(args, quiz_config)
+    queries = build_queries([chunk for chunks in documents for chunk in chunks], args.queries)
+    print(f"{args.clients} concurrent requests, {sum(len(chunks) for chunks in documents)} chunks, {len(queries)} queries")
+    print(f"{'model':<48} {'chunks/s':>9} {'time (s)':>9} {'batch':>6} {'cost ($)':>9} {'recall@1':>9} {'recall@' + str(args.k):>9}")
+    for model_name in args.models:
+        stats = bench_model(model_name, documents, queries, args, quiz_config)
+        batch = f"{stats['mean_batch_size']:6.1f}" if stats["mean_batch_size"] else f"{'-':>6}"
+        print(f"{model_name:<48} {stats['chunks_per_second']:9.1f} {stats['embedding_time']:9.2f} {batch} {stats['cost']:9.5f} "
+              f"{stats['recall_at_1']:9.3f} {stats['recall_at_k']:9.3f}")
+
+if __name__ == "__main__":
+    main()
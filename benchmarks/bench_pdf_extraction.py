@@ -0,0 +1,52 @@
+"""
+Compares PDF text extraction throughput of the former single call to pymupdf4llm.to_markdown with the
+parallel page-range extraction of PDFDocument (markdown and plain text modes).
+
+Usage: python -m benchmarks.bench_pdf_extraction path/to/document.pdf [--workers 4] [--repeat 3]
+"""
+import time
+import argparse
+
+import pymupdf
+import pymupdf4llm
+
+from src.pdf import PDFDocument
+
+
+def time_extraction(extract, repeat):
+    """
+    Returns the best wall time of repeat runs of an extraction function and its output
+
+    @param extract: Extraction function to run
+    @param repeat: Number of runs
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = extract()
+        timings.append(time.perf_counter() - start)
+    return min(timings), output
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF extraction benchmark")
+    parser.add_argument("pdf_path", help="Path to the pdf file to extract")
+    parser.add_argument("--workers", type=int, default=None, help="Number of extraction processes (all cores by default)")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per extraction mode")
+    args = parser.parse_args()
+
+    with open(args.pdf_path, "rb") as file:
+        pdf_file = file.read()
+    nb_pages = pymupdf.open(stream=pdf_file, filetype="pdf").page_count
+
+    modes = {
+        "single_markdown": lambda: pymupdf4llm.to_markdown(doc=pymupdf.open(stream=pdf_file, filetype="pdf"), show_progress=False),
+        "parallel_markdown": lambda: PDFDocument(pdf_file=pdf_file, num_workers=args.workers, markdown=True).extract_pages(),
+        "parallel_plain_text": lambda: PDFDocument(pdf_file=pdf_file, num_workers=args.workers, markdown=False).extract_pages()
+    }
+    print(f"{nb_pages} pages")
+    for mode, extract in modes.items():
+        elapsed, _ = time_extraction(extract, args.repeat)
+        print(f"{mode:<22} {elapsed:8.3f} s {nb_pages / elapsed:10.1f} pages/s")
+
+if __name__ == "__main__":
+    main()
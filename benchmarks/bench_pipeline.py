@@ -0,0 +1,230 @@
+"""
+Offline benchmark suite of the generation pipeline overhead, using the fake LLM and embedding backends
+of src.fakes (no OpenAI request). Covers Document chunking, VectorStore build/search/save/load, token
+counting, Quiz merging/randomization and end-to-end QuizGenerator runs over synthetic inputs of
+several page counts. Results are written as JSON so that they can be compared between commits.
+
+Usage: python -m benchmarks.bench_pipeline [--pages 1 10 100 1000] [--output bench_pipeline.json] [--compare baseline.json]
+"""
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+
+from benchmarks.bench_chunking import generate_pages
+from src.document import Document
+from src.fakes import FakeChatModel, FakeEmbeddings
+from src.quiz import Quiz
+from src.raqam import QuizGenerator
+from src.templates import question_prompt_template, flashcards_prompt_template, retrieval_query, retrieval_queries
+from src.templates import packed_question_prompt_template, packed_flashcards_prompt_template
+from src.tokens import count_tokens, count_tokens_many, get_encoding
+from src.utils import load_config
+from src.vector_store import VectorStore
+
+
+def measure(func, repeat=1):
+    """
+    Runs a function repeat times and returns its best wall time in seconds with its last result
+
+    @param func: Function to measure
+    @param repeat: Number of runs
+    """
+    best_time, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+    return best_time, result
+
+def bench_chunking(pages, quiz_config):
+    """
+    Measures the chunking of pages into a Document, returns the results and the document
+
+    @param pages: Texts of the pages
+    @param quiz_config: Base quiz configuration
+    """
+    def split_document():
+        document = Document(text_data=iter(pages), chunk_size=quiz_config["chunk_size"], chunk_overlap=quiz_config["chunk_overlap"])
+        document.split_all()
+        return document
+
+    seconds, document = measure(split_document)
+    return {"seconds": seconds, "nbChunks": len(document.chunks)}, document
+
+def bench_vector_store(document, quiz_config, embedding_model):
+    """
+    Measures the build, searches, save and load of a VectorStore of the document chunks
+
+    @param document: Chunked Document
+    @param quiz_config: Base quiz configuration
+    @param embedding_model: Fake embeddings model
+    """
+    results = {}
+    vector_store = VectorStore(embedding_model=embedding_model,
+                               embedding_batch_size=quiz_config["embedding_batch_size"],
+                               index_strategy=quiz_config.get("index_strategy", "auto"),
+                               index_metric=quiz_config.get("index_metric", "l2"))
+    results["buildSeconds"], _ = measure(lambda: vector_store.add_embedded_chunks(document.text_chunks))
+    results["searchSeconds"], _ = measure(lambda: vector_store.find_relevant_chunks(retrieval_query, k=10), repeat=5)
+    results["multiQuerySeconds"], _ = measure(lambda: vector_store.find_relevant_chunks_multi(retrieval_queries, k=10), repeat=5)
+    results["mmrSeconds"], _ = measure(lambda: vector_store.select_covering_chunks(k=10, strategy="mmr"), repeat=5)
+    with tempfile.TemporaryDirectory() as path:
+        vector_store.local_vector_store_path = path
+        namespace = vector_store.get_namespace(document.text_chunks)
+        results["saveSeconds"], _ = measure(lambda: vector_store.save_vector_store(namespace))
+        results["loadSeconds"], _ = measure(lambda: VectorStore(embedding_model=embedding_model,
+                                                                embedding_batch_size=quiz_config["embedding_batch_size"],
+                                                                local_vector_store_path=path).load_vector_store(namespace))
+    return results
+
+def bench_tokens(document, model_name):
+    """
+    Measures token counting of the document chunks, one by one and in batch (skipped when the tokenizer
+    cannot be downloaded, the rest of the suite running offline)
+
+    @param document: Chunked Document
+    @param model_name: Name of the model of the tokenizer
+    """
+    try:
+        get_encoding(model_name)
+    except Exception as e:
+        print(f"Skipping token counting benchmark, tokenizer of {model_name} not available: {type(e).__name__}")
+        return {"skipped": True}
+    results = {}
+    results["countTokensSeconds"], _ = measure(lambda: [count_tokens(chunk, model_name) for chunk in document.text_chunks])
+    results["countTokensManySeconds"], _ = measure(lambda: count_tokens_many(document.text_chunks, model_name))
+    return results
+
+def bench_quiz(document, chat_model):
+    """
+    Measures the merging and randomization of quiz parts generated on each chunk of the document
+
+    @param document: Chunked Document
+    @param chat_model: Fake chat model
+    """
+    # Generating one quiz part per chunk, as without vector store
+    quiz_llm = chat_model.with_structured_output(schema=Quiz, include_raw=True)
+    parts = [quiz_llm.invoke(question_prompt_template.format(num_questions=1, content=chunk))["parsed"] for chunk in document.text_chunks]
+    results = {}
+    results["concatSeconds"], quiz = measure(lambda: Quiz.concat(parts), repeat=3)
+    results["randomizeSeconds"], _ = measure(lambda: quiz.randomize(), repeat=3)
+    return results
+
+def bench_end_to_end(pages, quiz_config, chat_model, embedding_model, num_questions):
+    """
+    Measures a QuizGenerator run generating quiz and flashcards on the pages
+
+    @param pages: Texts of the pages
+    @param quiz_config: Base quiz configuration
+    @param chat_model: Fake chat model
+    @param embedding_model: Fake embeddings model
+    @param num_questions: Number of questions of the quiz
+    """
+    def run():
+        quiz_generator = QuizGenerator(llm=chat_model,
+                                       embedding_model=embedding_model,
+                                       embedding_batch_size=quiz_config["embedding_batch_size"],
+                                       min_text_length=0,
+                                       chunk_size=quiz_config["chunk_size"],
+                                       chunk_overlap=quiz_config["chunk_overlap"],
+                                       question_prompt_template=question_prompt_template,
+                                       flashcards_prompt_template=flashcards_prompt_template,
+                                       retrieval_query=retrieval_query,
+                                       retrieval_queries=retrieval_queries,
+                                       retrieval_strategy=quiz_config.get("retrieval_strategy", "query"),
+                                       packed_question_prompt_template=packed_question_prompt_template,
+                                       packed_flashcards_prompt_template=packed_flashcards_prompt_template,
+                                       packing_max_tokens=quiz_config.get("packing_max_tokens", 0),
+                                       num_questions=num_questions,
+                                       num_choices=4,
+                                       text_content="\n\n".join(pages))
+        quiz, flashcards = quiz_generator.generate_quiz_and_flashcards()
+        return quiz_generator.get_context()
+    seconds, quiz_context = measure(run)
+    return {"seconds": seconds, "tokens": quiz_context["tokens"], "packing": quiz_context["packing"]}
+
+def get_commit():
+    """
+    Returns the current git commit hash, None outside a git repository
+    """
+    process = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+    return process.stdout.strip() if process.returncode == 0 else None
+
+def flatten(results, prefix=""):
+    """
+    Flattens nested numeric results into {"benchmark.metric": value} pairs
+
+    @param results: Nested dictionnary of results
+    @param prefix: Prefix of the keys
+    """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix=f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def compare(results, baseline_path):
+    """
+    Prints the relative change of timings against a baseline result file
+
+    @param results: Results of this run
+    @param baseline_path: Path of the JSON results of the baseline run
+    """
+    with open(baseline_path, "r") as file:
+        baseline = json.load(file)
+    current, previous = flatten(results["results"]), flatten(baseline["results"])
+    print(f"Comparison with {baseline_path} (commit {baseline.get('commit')})")
+    for key in sorted(current):
+        if key in previous and key.lower().endswith("seconds") and previous[key] > 0:
+            print(f"{key:<60} {previous[key]:10.4f} s -> {current[key]:10.4f} s ({100 * (current[key] / previous[key] - 1):+7.1f} %)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark suite")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100, 1000], help="Numbers of synthetic pages")
+    parser.add_argument("--page-length", type=int, default=3000, help="Number of characters per page")
+    parser.add_argument("--num-questions", type=int, default=10, help="Number of questions of end-to-end runs")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Latency of fake LLM calls in seconds")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="Latency of fake embedding requests in seconds")
+    parser.add_argument("--output", default="bench_pipeline.json", help="Path of the JSON results")
+    parser.add_argument("--compare", default=None, help="Path of baseline JSON results to compare with")
+    args = parser.parse_args()
+
+    quiz_config = load_config()["base_quiz_config"]
+    chat_model = FakeChatModel(model_name="fake:" + quiz_config["model_name"], latency=args.llm_latency)
+    embedding_model = FakeEmbeddings(model="fake:" + quiz_config["embdeddings_model_name"], latency=args.embedding_latency)
+    results = {}
+    for nb_pages in args.pages:
+        print(f"Benchmarking {nb_pages} pages")
+        pages = generate_pages(nb_pages, args.page_length)
+        chunking_results, document = bench_chunking(pages, quiz_config)
+        results[f"pages_{nb_pages}"] = {
+            "chunking": chunking_results,
+            "vectorStore": bench_vector_store(document, quiz_config, embedding_model),
+            "tokens": bench_tokens(document, quiz_config["model_name"]),
+            "quiz": bench_quiz(document, chat_model),
+            "endToEnd": bench_end_to_end(pages, quiz_config, chat_model, embedding_model, args.num_questions)
+        }
+    output = {
+        "commit": get_commit(),
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "arguments": vars(args),
+        "results": results
+    }
+    with open(args.output, "w") as file:
+        json.dump(output, file, indent=4)
+    print(json.dumps(results, indent=4))
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(output, args.compare)
+
+if __name__ == "__main__":
+    main()
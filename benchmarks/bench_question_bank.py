@@ -0,0 +1,114 @@
+"""
+Serves repeated quiz requests on the same document with the fake LLM and embedding backends of
+src.fakes, generating each quiz from scratch as before, then sampling it from the question bank of the
+document (built once, topped up in a background thread when it runs low). Compares the latencies and
+LLM calls of both modes and reports the chunk coverage of sampled quizzes.
+
+Usage: python -m benchmarks.bench_question_bank [--pages 50] [--requests 500] [--num-questions 10] [--llm-latency 0.2]
+"""
+import os
+import time
+import argparse
+import tempfile
+import threading
+import statistics
+
+from benchmarks.bench_chunking import generate_pages
+from src.pipeline import generate_output_data, sample_output_data, fill_question_bank
+from src.question_bank import QuestionBank, build_question_bank_key
+from src.quiz_config import QuizConfig
+from src.utils import load_config
+
+
+def build_quiz_config(text_content, num_questions):
+    """
+    Returns a QuizConfig using the fake backends, parsed on a request of the document
+
+    @param text_content: Text of the document
+    @param num_questions: Number of questions of the quiz
+    """
+    base_quiz_config = load_config()["base_quiz_config"]
+    quiz_config = QuizConfig(**{**base_quiz_config,
+                                "model_name": "fake:" + base_quiz_config["model_name"],
+                                "embdeddings_model_name": "fake:" + base_quiz_config["embdeddings_model_name"],
+                                "min_text_length": 0,
+                                "embedding_cache_path": None,
+                                "web_cache_path": None,
+                                "rate_limits_path": None,
+                                "document_state_path": None})
+    quiz_config.parse_input_data({"text_content": text_content, "num_questions": num_questions, "num_choices": 4})
+    return quiz_config
+
+def percentile(values, fraction):
+    """
+    Returns a percentile of values
+
+    @param values: Measured values
+    @param fraction: Fraction of the percentile (ex: 0.99)
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Question bank benchmark")
+    parser.add_argument("--pages", type=int, default=50, help="Number of synthetic pages")
+    parser.add_argument("--page-length", type=int, default=3000, help="Number of characters per page")
+    parser.add_argument("--requests", type=int, default=500, help="Number of quiz requests sampled from the bank")
+    parser.add_argument("--generated-requests", type=int, default=5, help="Number of quiz requests generated from scratch")
+    parser.add_argument("--num-questions", type=int, default=10, help="Number of questions per quiz")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Latency of fake LLM calls in seconds")
+    args = parser.parse_args()
+
+    # Fake chat model clients read their latency when they are built
+    os.environ["RAQAM_FAKE_LATENCY"] = str(args.llm_latency)
+    text_content = "\n\n".join(generate_pages(args.pages, args.page_length))
+    config = load_config().get("question_bank") or {}
+
+    latencies, llm_calls = [], []
+    for _ in range(args.generated_requests):
+        quiz_config = build_quiz_config(text_content, args.num_questions)
+        start = time.perf_counter()
+        output_data = generate_output_data(quiz_config, generate_quiz=True, generate_flashcards=False)
+        latencies.append(time.perf_counter() - start)
+        llm_calls.append(output_data["quizContext"]["packing"]["llmRequests"])
+    print(f"{'generated':<10} p50 {statistics.median(latencies) * 1000:9.2f} ms p99 {percentile(latencies, 0.99) * 1000:9.2f} ms "
+          f"llm calls per request {statistics.mean(llm_calls):6.2f}")
+
+    with tempfile.TemporaryDirectory() as path:
+        question_bank = QuestionBank(path=os.path.join(path, "question_bank.sqlite"),
+                                     **{key: value for key, value in config.items() if key != "path"})
+        quiz_config = build_quiz_config(text_content, args.num_questions)
+        start = time.perf_counter()
+        build = fill_question_bank(quiz_config, question_bank)
+        print(f"Bank built in {time.perf_counter() - start:.2f} s with {build['questionBank']['addedQuestions']} questions "
+              f"({build['quizContext']['packing']['llmRequests']} llm calls)")
+
+        top_ups = []
+
+        def top_up():
+            # Background build of the job queue, run in a thread here
+            thread = threading.Thread(target=fill_question_bank, args=(build_quiz_config(text_content, args.num_questions), question_bank))
+            thread.start()
+            top_ups.append(thread)
+
+        latencies, tokens, coverages, covered_chunks = [], [], [], set()
+        for _ in range(args.requests):
+            quiz_config = build_quiz_config(text_content, args.num_questions)
+            start = time.perf_counter()
+            quiz, _, quiz_context = sample_output_data(quiz_config, question_bank, generate_quiz=True, generate_flashcards=False,
+                                                       build_callback=top_up)
+            latencies.append(time.perf_counter() - start)
+            tokens.append(quiz_context["tokens"]["total"])
+            chunks = set(question.chunk_index for question in quiz.questions)
+            coverages.append(len(chunks) / len(quiz.questions))
+            covered_chunks.update(chunks)
+        for thread in top_ups:
+            thread.join()
+        chunk_counts = question_bank.get_chunk_counts(build_question_bank_key(quiz_config))
+        print(f"{'sampled':<10} p50 {statistics.median(latencies) * 1000:9.2f} ms p99 {percentile(latencies, 0.99) * 1000:9.2f} ms "
+              f"tokens per request {statistics.mean(tokens):6.2f}")
+        print(f"Distinct chunks per quiz {statistics.mean(coverages) * 100:.1f} %, chunks served {len(covered_chunks)}/{len(chunk_counts)}, "
+              f"top-ups {len(top_ups)}, banked questions {sum(chunk_counts.values())}")
+
+if __name__ == "__main__":
+    main()
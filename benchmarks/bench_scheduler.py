@@ -0,0 +1,112 @@
+"""
+Sends a burst of interactive and bulk requests to a simulated provider enforcing a requests per minute
+limit (answering 429 above it) and compares direct calls from a thread pool, as done before, with calls
+going through RequestScheduler (adaptive concurrency and retries only, then with the requests budget).
+
+Usage: python -m benchmarks.bench_scheduler [--requests 300] [--rpm 1200] [--latency 0.05] [--threads 64]
+"""
+import time
+import argparse
+import threading
+import statistics
+import concurrent.futures
+
+from src.scheduler import RequestScheduler
+
+
+class SimulatedRateLimitError(Exception):
+    def __init__(self):
+        """
+        429 error of the simulated provider (status code read by the scheduler as on OpenAI errors)
+        """
+        super().__init__("Rate limit reached")
+        self.status_code = 429
+
+
+class SimulatedProvider():
+    def __init__(self,
+                 rpm,
+                 latency):
+        """
+        Provider allowing a burst of one second of requests then rpm requests per minute
+
+        @param rpm: Requests per minute allowed by the provider
+        @param latency: Latency of a request in seconds
+        """
+        self.rate = rpm / 60
+        self.capacity = max(1.0, self.rate)
+        self.available = self.capacity
+        self.updated_at = time.perf_counter()
+        self.latency = latency
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+
+    def call(self,
+             prompt):
+        """
+        Answers a request after the latency, or raises a 429 error when the limit is reached
+
+        @param prompt: Prompt of the request
+        """
+        with self.lock:
+            now = time.perf_counter()
+            self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.available < 1:
+                self.rate_limited += 1
+                raise SimulatedRateLimitError()
+            self.available -= 1
+        time.sleep(self.latency)
+        return prompt
+
+def run_burst(args, call):
+    """
+    Sends the requests from a thread pool, alternating interactive and bulk requests. Returns the number
+    of failed requests, the wall time and the latencies of each lane.
+
+    @param args: Benchmark arguments
+    @param call: Function sending a request with its priority
+    """
+    latencies = {"interactive": [], "bulk": []}
+    failures = 0
+    start = time.perf_counter()
+
+    def send(i):
+        priority = "interactive" if i % 2 == 0 else "bulk"
+        call(f"request {i}", priority)
+        return priority, time.perf_counter() - start
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
+        for future in [executor.submit(send, i) for i in range(args.requests)]:
+            try:
+                priority, latency = future.result()
+                latencies[priority].append(latency)
+            except SimulatedRateLimitError:
+                failures += 1
+    return failures, time.perf_counter() - start, latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Request scheduler benchmark")
+    parser.add_argument("--requests", type=int, default=300, help="Number of requests of the burst")
+    parser.add_argument("--rpm", type=int, default=1200, help="Requests per minute allowed by the simulated provider")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latency of a request in seconds")
+    parser.add_argument("--threads", type=int, default=64, help="Number of threads sending requests")
+    args = parser.parse_args()
+
+    modes = {
+        "direct": lambda provider: lambda prompt, priority: provider.call(prompt),
+        "scheduler": lambda provider: (lambda scheduler: lambda prompt, priority: scheduler.run(provider.call, prompt, priority=priority))(
+            RequestScheduler(name="simulated", max_concurrency=args.threads, base_delay=0.1, max_delay=2.0, max_retries=10)),
+        "scheduler_budget": lambda provider: (lambda scheduler: lambda prompt, priority: scheduler.run(provider.call, prompt, priority=priority))(
+            RequestScheduler(name="simulated", rpm=args.rpm, max_concurrency=args.threads, base_delay=0.1, max_delay=2.0, max_retries=10))
+    }
+    print(f"{args.requests} requests, provider limit {args.rpm} rpm, latency {args.latency} s")
+    for mode, build_call in modes.items():
+        provider = SimulatedProvider(rpm=args.rpm, latency=args.latency)
+        failures, wall_time, latencies = run_burst(args, build_call(provider))
+        lanes = " ".join(f"{lane} p50 {statistics.median(values):6.2f} s" if values else f"{lane} p50    n/a"
+                         for lane, values in latencies.items())
+        print(f"{mode:<18} failed {failures:4d} 429s {provider.rate_limited:5d} wall {wall_time:6.2f} s {lanes}")
+
+if __name__ == "__main__":
+    main()
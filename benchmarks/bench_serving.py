@@ -0,0 +1,185 @@
+"""
+Load test of the Flask API served by gunicorn (api/gunicorn.conf.py) and by the Flask development
+server, with the fake LLM and embedding backends of src.fakes. Sends quiz generation requests from
+concurrent clients and reports latency percentiles, throughput and 503 rejections, then checks that
+requests in progress complete when the gunicorn server is stopped with SIGTERM (graceful drain).
+
+Usage: python -m benchmarks.bench_serving [--servers gunicorn dev] [--concurrency 64] [--requests 640] [--llm-latency 0.5]
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+import statistics
+import concurrent.futures
+
+import httpx
+import yaml
+
+from benchmarks.bench_chunking import generate_pages
+from src.utils import load_config
+
+
+def write_config(path, args, port):
+    """
+    Writes the configuration of the served API: fake model backends, no caches and the serving settings
+    of the load test
+
+    @param path: Directory of the configuration and database files
+    @param args: Load test arguments
+    @param port: Port of the server
+    """
+    config = load_config()
+    base_quiz_config = config["base_quiz_config"]
+    config["base_quiz_config"] = {**base_quiz_config,
+                                  "model_name": "fake:" + base_quiz_config["model_name"],
+                                  "embdeddings_model_name": "fake:" + base_quiz_config["embdeddings_model_name"],
+                                  "min_text_length": 0,
+                                  "embedding_cache_path": None,
+                                  "web_cache_path": None,
+                                  "document_state_path": None,
+                                  "rate_limits_path": None,
+                                  "llm_rpm": None,
+                                  "llm_tpm": None,
+                                  "embeddings_rpm": None,
+                                  "embeddings_tpm": None}
+    config["result_cache"] = {**(config.get("result_cache") or {}), "backend": None}
+    config["question_bank"] = {"path": None}
+    config["jobs"] = {**(config.get("jobs") or {}), "path": os.path.join(path, "jobs.sqlite"), "files_path": os.path.join(path, "job_files")}
+    config["uploads"] = {"path": os.path.join(path, "uploads")}
+    config["serving"] = {**(config.get("serving") or {}),
+                         "bind": f"127.0.0.1:{port}",
+                         "workers": args.workers,
+                         "max_concurrent_requests": args.max_concurrent_requests,
+                         "graceful_timeout": 30}
+    config_path = os.path.join(path, "config.yaml")
+    with open(config_path, "w") as file:
+        yaml.dump(config, file, default_flow_style=False, sort_keys=False)
+    return config_path
+
+def start_server(server, config_path, args, port):
+    """
+    Starts the server in a subprocess and waits for its health check
+
+    @param server: "gunicorn" or "dev" (Flask development server)
+    @param config_path: Path of the configuration file
+    @param args: Load test arguments
+    @param port: Port of the server
+    """
+    env = {**os.environ, "RAQAM_CONFIG": config_path, "RAQAM_FAKE_LATENCY": str(args.llm_latency)}
+    if server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-c", "api/gunicorn.conf.py", "api.api:app"]
+    else:
+        command = [sys.executable, "-c", f"from api.api import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{server} server did not start")
+
+def send_request(client, url, text_content, num_questions):
+    """
+    Sends a quiz generation request, returns its status code and latency
+
+    @param client: httpx client
+    @param url: URL of the server
+    @param text_content: Text of the document
+    @param num_questions: Number of questions of the quiz
+    """
+    data = {"text_content": text_content, "num_questions": num_questions, "num_choices": 4, "generate_flashcards": False}
+    start = time.perf_counter()
+    response = client.post(f"{url}/generate-quiz", files={"data": ("data.json", json.dumps(data), "application/json")})
+    return response.status_code, time.perf_counter() - start
+
+def run_load(url, args, text_content):
+    """
+    Sends the requests from concurrent clients, returns the statistics of the run
+
+    @param url: URL of the server
+    @param args: Load test arguments
+    @param text_content: Text of the document
+    """
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    with httpx.Client(limits=limits, timeout=300) as client:
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(lambda _: send_request(client, url, text_content, args.num_questions), range(args.requests)))
+        wall_time = time.perf_counter() - start
+    latencies = sorted(latency for status_code, latency in results if status_code == 200)
+    return {
+        "ok": len(latencies),
+        "rejected": sum(1 for status_code, _ in results if status_code == 503),
+        "errors": sum(1 for status_code, _ in results if status_code not in [200, 503]),
+        "p50": statistics.median(latencies) if latencies else None,
+        "p99": latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] if latencies else None,
+        "throughput": len(latencies) / wall_time
+    }
+
+def check_drain(process, url, args, text_content):
+    """
+    Starts requests, stops the server with SIGTERM while they are in progress and returns the number of
+    requests in progress that completed
+
+    @param process: Server process
+    @param url: URL of the server
+    @param args: Load test arguments
+    @param text_content: Text of the document
+    """
+    with httpx.Client(timeout=300) as client:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.drain_requests) as executor:
+            futures = [executor.submit(send_request, client, url, text_content, args.num_questions) for _ in range(args.drain_requests)]
+            time.sleep(args.llm_latency / 2)
+            process.send_signal(signal.SIGTERM)
+            results = [future.result() for future in futures]
+    process.wait(timeout=60)
+    return sum(1 for status_code, _ in results if status_code == 200)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serving load test")
+    parser.add_argument("--servers", nargs="+", default=["gunicorn", "dev"], choices=["gunicorn", "dev"], help="Servers to load test")
+    parser.add_argument("--concurrency", type=int, default=64, help="Number of concurrent clients")
+    parser.add_argument("--requests", type=int, default=640, help="Number of requests")
+    parser.add_argument("--pages", type=int, default=2, help="Number of synthetic pages of each request document")
+    parser.add_argument("--num-questions", type=int, default=5, help="Number of questions per quiz")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Latency of fake LLM calls in seconds")
+    parser.add_argument("--workers", type=int, default=2, help="Number of gunicorn workers")
+    parser.add_argument("--max-concurrent-requests", type=int, default=64, help="Maximum requests in progress per worker")
+    parser.add_argument("--drain-requests", type=int, default=16, help="Number of requests in progress when the server is stopped")
+    parser.add_argument("--port", type=int, default=5099, help="Port of the servers")
+    args = parser.parse_args()
+
+    text_content = "\n\n".join(generate_pages(args.pages, 3000))
+    url = f"http://127.0.0.1:{args.port}"
+    print(f"{args.requests} requests from {args.concurrency} clients, fake LLM latency {args.llm_latency} s")
+    for server in args.servers:
+        with tempfile.TemporaryDirectory() as path:
+            process = start_server(server, write_config(path, args, args.port), args, args.port)
+            try:
+                stats = run_load(url, args, text_content)
+                print(f"{server:<9} ok {stats['ok']:5d} 503 {stats['rejected']:5d} errors {stats['errors']:3d} "
+                      f"p50 {stats['p50']:6.2f} s p99 {stats['p99']:6.2f} s throughput {stats['throughput']:7.2f} req/s")
+                if server == "gunicorn":
+                    completed = check_drain(process, url, args, text_content)
+                    print(f"{server:<9} drain: {completed}/{args.drain_requests} requests in progress completed after SIGTERM")
+            finally:
+                if process.poll() is None:
+                    # Stopping gunicorn with SIGTERM so that its workers exit with it
+                    process.terminate()
+                    try:
+                        process.wait(timeout=60)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+                        process.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Measures the peak memory of receiving and extracting an uploaded pdf file, comparing the former
+in-memory upload paths (Flask upload read into bytes, Lambda base64 body decoded into bytes) with the
+spooled paths (upload copied block by block to a temporary file, PDFDocument opened by path). Each
+mode runs in its own process and reports its peak RSS increase as a number of copies of the document.
+
+Usage: python -m benchmarks.bench_upload_memory [--size-mb 100] [--pages 50] [--max-copies 1.5]
+"""
+import os
+import sys
+import json
+import base64
+import argparse
+import tempfile
+import subprocess
+
+import pymupdf
+
+from src.pdf import PDFDocument
+from src.uploads import spool_stream, spool_base64, remove_files
+
+MODES = ["former_api", "spooled_api", "former_lambda", "spooled_lambda"]
+
+
+def generate_pdf(path, size_mb, nb_pages):
+    """
+    Writes a pdf file of text pages inflated to the requested size with an incompressible attachment
+
+    @param path: Path of the pdf file
+    @param size_mb: Approximate size of the file in MB
+    @param nb_pages: Number of text pages
+    """
+    pdf_file = pymupdf.open()
+    for i in range(nb_pages):
+        page = pdf_file.new_page()
+        page.insert_text((72, 72), f"Page {i}\n" + "Lorem ipsum dolor sit amet, consectetur adipiscing elit.\n" * 40)
+    pdf_file.embfile_add("payload.bin", os.urandom(int(size_mb * 1024 * 1024)))
+    pdf_file.save(path)
+
+def reset_peak_rss():
+    """
+    Resets the peak resident set size of the process to its current size (Linux only), so that the
+    peak inherited from the parent process or reached during setup is not measured
+    """
+    with open("/proc/self/clear_refs", "w") as file:
+        file.write("5")
+
+def get_rss_mb(field="VmRSS"):
+    """
+    Returns the current (VmRSS) or peak (VmHWM) resident set size of the process in MB (Linux only)
+
+    @param field: Field of /proc/self/status to read
+    """
+    with open("/proc/self/status", "r") as file:
+        for line in file:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+
+def run_mode(mode, pdf_path):
+    """
+    Receives and extracts the pdf file as the given upload path would, returns the peak RSS increase in MB
+
+    @param mode: Upload path to measure (one of MODES)
+    @param pdf_path: Path of the pdf file
+    """
+    if mode.endswith("lambda"):
+        # The request body is already in memory when the handler is invoked
+        with open(pdf_path, "rb") as file:
+            event = {"body": json.dumps({"data": {"pdf_file": base64.b64encode(file.read()).decode("ascii")}})}
+    reset_peak_rss()
+    start_rss = get_rss_mb()
+    spooled_paths = []
+    if mode == "former_api":
+        with open(pdf_path, "rb") as file:
+            pdf_file = file.read()
+    elif mode == "spooled_api":
+        with open(pdf_path, "rb") as file:
+            pdf_file = spool_stream(file)
+        spooled_paths.append(pdf_file)
+    elif mode == "former_lambda":
+        data = json.loads(event["body"])["data"]
+        pdf_file = base64.b64decode(data["pdf_file"])
+    else:
+        data = json.loads(event["body"])["data"]
+        event["body"] = None
+        pdf_file = spool_base64(data.pop("pdf_file"))
+        spooled_paths.append(pdf_file)
+    PDFDocument(pdf_file=pdf_file, num_workers=1, markdown=False).extract_pages()
+    remove_files(spooled_paths)
+    return get_rss_mb("VmHWM") - start_rss
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload peak memory benchmark")
+    parser.add_argument("--size-mb", type=float, default=100, help="Size of the synthetic pdf file in MB")
+    parser.add_argument("--pages", type=int, default=50, help="Number of text pages of the synthetic pdf file")
+    parser.add_argument("--max-copies", type=float, default=1.5, help="Maximum copies of the document allowed for spooled modes")
+    parser.add_argument("--mode", choices=MODES, default=None, help="Runs a single mode on --pdf-path (used by subprocesses)")
+    parser.add_argument("--pdf-path", default=None, help="Path of the pdf file of a single mode run")
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        print(run_mode(args.mode, args.pdf_path))
+        return
+
+    with tempfile.TemporaryDirectory() as path:
+        pdf_path = os.path.join(path, "document.pdf")
+        generate_pdf(pdf_path, args.size_mb, args.pages)
+        size_mb = os.path.getsize(pdf_path) / (1024 * 1024)
+        print(f"Pdf file of {size_mb:.1f} MB")
+        failures = []
+        for mode in MODES:
+            process = subprocess.run([sys.executable, "-m", "benchmarks.bench_upload_memory", "--mode", mode, "--pdf-path", pdf_path],
+                                     capture_output=True, text=True, check=True)
+            peak_mb = float(process.stdout.strip().splitlines()[-1])
+            copies = peak_mb / size_mb
+            print(f"{mode:<16} peak RSS +{peak_mb:8.1f} MB {copies:6.2f} copies")
+            if mode.startswith("spooled") and copies > args.max_copies:
+                failures.append(mode)
+    if failures:
+        print(f"Peak memory above {args.max_copies} copies of the document: {', '.join(failures)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Serves a synthetic deeply nested web page from a local HTTP server and compares the former bare
+requests.get + html.parser + quadratic largest div extraction with the pooled, cached and bounded
+WebPage fetcher (cold fetch, then conditional revalidation answered 304 Not Modified).
+
+Usage: python -m benchmarks.bench_web_fetching [--depth 300] [--paragraphs 2000] [--runs 5]
+"""
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from bs4 import BeautifulSoup
+
+from src.web_page import WebPage, HTML_PARSER
+
+
+def generate_page(depth, nb_paragraphs):
+    """
+    Generates a web page without main content tags made of nested divs containing paragraphs
+
+    @param depth: Number of nested divs
+    @param nb_paragraphs: Number of paragraphs spread over the nested divs
+    """
+    paragraphs_per_div = max(1, nb_paragraphs // depth)
+    paragraph = "<p>" + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4 + "</p>"
+    return ("<html><body>" + ("<div>" + paragraph * paragraphs_per_div) * depth + "</div>" * depth + "</body></html>").encode("utf-8")
+
+def serve_page(page):
+    """
+    Starts a local HTTP server serving a page with an ETag, returns the server and the number of full responses sent
+
+    @param page: Bytes of the page to serve
+    """
+    etag = '"' + hashlib.sha256(page).hexdigest() + '"'
+    full_responses = [0]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            full_responses[0] += 1
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(page)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, full_responses
+
+def extract_text_former(url):
+    """
+    Former extraction: bare request, pure-Python parser and get_text on every div
+
+    @param url: URL of the web page
+    """
+    r = requests.get(url, headers={"User-Agent": "Mozilla/5.0"})
+    soup = BeautifulSoup(r.content, "html.parser")
+    divs = soup.find_all("div")
+    main_content = max(divs, key=lambda d: len(d.get_text()), default=None)
+    return main_content.get_text(separator="\n", strip=True) if main_content else ""
+
+def main():
+    parser = argparse.ArgumentParser(description="Web page fetching benchmark")
+    parser.add_argument("--depth", type=int, default=300, help="Number of nested divs")
+    parser.add_argument("--paragraphs", type=int, default=2000, help="Number of paragraphs")
+    parser.add_argument("--runs", type=int, default=5, help="Number of extractions per implementation")
+    args = parser.parse_args()
+
+    page = generate_page(args.depth, args.paragraphs)
+    server, full_responses = serve_page(page)
+    url = f"http://127.0.0.1:{server.server_address[1]}/page.html"
+    print(f"Page of {len(page)} bytes, {args.depth} nested divs, parser {HTML_PARSER}")
+
+    start = time.perf_counter()
+    for _ in range(args.runs):
+        former_text = extract_text_former(url)
+    former_time = (time.perf_counter() - start) / args.runs
+
+    with tempfile.TemporaryDirectory() as cache_path:
+        full_responses[0] = 0
+        start = time.perf_counter()
+        text = WebPage(url=url, cache_path=cache_path).extract_text()
+        cold_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(args.runs):
+            text = WebPage(url=url, cache_path=cache_path).extract_text()
+        cached_time = (time.perf_counter() - start) / args.runs
+        print(f"Full responses sent for {args.runs + 1} fetches: {full_responses[0]}")
+    server.shutdown()
+
+    print(f"Same extracted text: {former_text == text}")
+    print(f"{'former_extraction':<22} {former_time:8.3f} s")
+    print(f"{'web_page_cold':<22} {cold_time:8.3f} s")
+    print(f"{'web_page_revalidated':<22} {cached_time:8.3f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+import mmap
+
+import numpy as np
+from langchain_core.documents import Document as LangchainDocument
+
+
+class ChunkStore():
+    def __init__(self,
+                 path,
+                 read_only=True):
+        """
+        Append-only store of text chunks used as docstore of persisted vector stores. Chunk texts are
+        concatenated in UTF-8 in texts.bin and the end byte offset of each chunk is stored in offsets.bin
+        (int64). Both files are memory-mapped, so opening a store costs no copy nor deserialization and
+        several processes can read the same store at the same time.
+
+        @param path: Directory of the chunk store
+        @param read_only: Whether the store is only read (chunks can't be appended)
+        """
+        self.path = path
+        self.read_only = read_only
+        self.texts_path = os.path.join(path, "texts.bin")
+        self.offsets_path = os.path.join(path, "offsets.bin")
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+            for file_path in [self.texts_path, self.offsets_path]:
+                open(file_path, "ab").close()
+        self.texts = None
+        self.offsets = np.zeros(0, dtype=np.int64)
+        self.open()
+
+    def open(self):
+        """
+        Memory-maps the texts and offsets files (again after an append)
+        """
+        if os.path.getsize(self.offsets_path) > 0:
+            self.offsets = np.memmap(self.offsets_path, dtype=np.int64, mode="r")
+        if os.path.getsize(self.texts_path) > 0:
+            with open(self.texts_path, "rb") as file:
+                self.texts = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self,
+               texts):
+        """
+        Appends chunk texts at the end of the store
+
+        @param texts: Texts of the chunks to append
+        """
+        if self.read_only:
+            raise PermissionError(f"Chunk store {self.path} is opened read-only")
+        encoded_texts = [text.encode("utf-8") for text in texts]
+        end = int(self.offsets[-1]) if len(self.offsets) > 0 else 0
+        offsets = end + np.cumsum([len(encoded_text) for encoded_text in encoded_texts], dtype=np.int64)
+        with open(self.texts_path, "ab") as file:
+            file.write(b"".join(encoded_texts))
+        with open(self.offsets_path, "ab") as file:
+            file.write(offsets.tobytes())
+        self.open()
+
+    def get(self,
+            row):
+        """
+        Returns the text of a chunk
+
+        @param row: Position of the chunk in the store
+        """
+        start = int(self.offsets[row - 1]) if row > 0 else 0
+        return self.texts[start:int(self.offsets[row])].decode("utf-8") if self.texts is not None else ""
+
+    def search(self,
+               search):
+        """
+        Returns the langchain document of a chunk (docstore interface of langchain FAISS vector store)
+
+        @param search: Position of the chunk in the store
+        """
+        return LangchainDocument(page_content=self.get(int(search)))
@@ -0,0 +1,117 @@
+import os
+import threading
+
+from src.instrumentation import record_retryable_response
+
+# Dimension of known embedding models, avoiding a probe request to find it
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536
+}
+
+# Prefix of model names served by the offline fake backends of src.fakes (ex: "fake:gpt-4o-mini")
+FAKE_MODEL_PREFIX = "fake:"
+
+# Prefix of embeddings model names run locally on CPU by src.local_embeddings (ex: "local:sentence-transformers/all-MiniLM-L6-v2")
+LOCAL_MODEL_PREFIX = "local:"
+
+_clients = {}
+_probed_dimensions = {}
+_clients_lock = threading.Lock()
+
+
+def build_http_client():
+    """
+    Builds a HTTP client keeping connections alive so that they are reused across requests, and counting
+    retried responses in the current instrumentation span
+    """
+    # Importing the HTTP client only when a model client is built (fake backends do not need it)
+    import httpx
+    return httpx.Client(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+                        event_hooks={"response": [record_retryable_response]})
+
+def get_client(kind,
+               model_name,
+               build_client,
+               **settings):
+    """
+    Returns the process-wide client of a model, building it on first use for these settings
+
+    @param kind: Kind of client ("llm" or "embeddings")
+    @param model_name: Name of the model
+    @param build_client: Function building the client from model name and settings
+    @param settings: Settings of the client
+    """
+    key = (kind, model_name, tuple(sorted(settings.items())))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = build_client(model_name, **settings)
+        return _clients[key]
+
+def get_llm(model_name,
+            **settings):
+    """
+    Returns the process-wide chat model client for a model name and settings. Model names starting with
+    "fake:" are served offline by FakeChatModel, its latency being read from RAQAM_FAKE_LATENCY. Retries
+    are left to the request scheduler of the model (src.scheduler).
+
+    @param model_name: Name of the LLM
+    @param settings: Additional settings of ChatOpenAI (ex: temperature)
+    """
+    if model_name.startswith(FAKE_MODEL_PREFIX):
+        from src.fakes import FakeChatModel
+        return get_client("llm", model_name,
+                          lambda model_name, **settings: FakeChatModel(model_name=model_name,
+                                                                       latency=float(os.environ.get("RAQAM_FAKE_LATENCY", 0)),
+                                                                       **settings),
+                          **settings)
+    from langchain_openai import ChatOpenAI
+    return get_client("llm", model_name,
+                      lambda model_name, **settings: ChatOpenAI(model=model_name, http_client=build_http_client(), **{"max_retries": 0, **settings}),
+                      **settings)
+
+def get_embedding_model(model_name,
+                        **settings):
+    """
+    Returns the process-wide embeddings model client for a model name and settings. Model names starting
+    with "fake:" are served offline by FakeEmbeddings, model names starting with "local:" are run on CPU
+    by LocalEmbeddings.
+
+    @param model_name: Name of the embeddings model
+    @param settings: Additional settings of OpenAIEmbeddings (or LocalEmbeddings for local models)
+    """
+    if model_name.startswith(FAKE_MODEL_PREFIX):
+        from src.fakes import FakeEmbeddings
+        return get_client("embeddings", model_name,
+                          lambda model_name, **settings: FakeEmbeddings(model=model_name, **settings),
+                          **settings)
+    if model_name.startswith(LOCAL_MODEL_PREFIX):
+        from src.local_embeddings import LocalEmbeddings
+        return get_client("embeddings", model_name,
+                          lambda model_name, **settings: LocalEmbeddings(model=model_name, **settings),
+                          **settings)
+    from langchain_openai import OpenAIEmbeddings
+    return get_client("embeddings", model_name,
+                      lambda model_name, **settings: OpenAIEmbeddings(model=model_name, http_client=build_http_client(), **{"max_retries": 0, **settings}),
+                      **settings)
+
+def get_embedding_dimension(embedding_model):
+    """
+    Returns the dimension of the vectors of an embeddings model, from the known dimensions table or
+    from a probe request for unknown models (once per model and process, unless first probes overlap)
+
+    @param embedding_model: Embeddings model
+    """
+    if getattr(embedding_model, "dimensions", None):
+        return embedding_model.dimensions
+    model_name = embedding_model.model
+    if model_name in EMBEDDING_DIMENSIONS:
+        return EMBEDDING_DIMENSIONS[model_name]
+    if model_name not in _probed_dimensions:
+        # Probing outside of the clients lock so that a slow probe does not block building other clients
+        # (concurrent first probes of a model all get the dimension stored first)
+        dimension = len(embedding_model.embed_query("hello world"))
+        with _clients_lock:
+            _probed_dimensions.setdefault(model_name, dimension)
+    return _probed_dimensions[model_name]
@@ -0,0 +1,32 @@
+import concurrent.futures
+
+
+def iter_completed(func,
+                   items,
+                   max_concurrency):
+    """
+    Applies func on every item with at most max_concurrency calls in flight and yields (index, result)
+    pairs as soon as each call completes. Items may be an iterator (ex: batches of chunks of a document
+    still being extracted), items being taken from it only when a call can start. On the first failure,
+    calls that have not started yet are cancelled, running calls are awaited and the exception is raised.
+
+    @param func: Function to apply on each item
+    @param items: Items (or iterator of items) on which to apply the function
+    @param max_concurrency: Maximum number of calls running at the same time
+    """
+    max_concurrency = max(1, max_concurrency)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency)
+    futures = {}
+    try:
+        for index, item in enumerate(items):
+            if len(futures) >= max_concurrency:
+                # Waiting for a call to complete before starting the next one
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield futures.pop(future), future.result()
+            futures[executor.submit(func, item)] = index
+        for future in concurrent.futures.as_completed(list(futures)):
+            yield futures.pop(future), future.result()
+    finally:
+        # Cancelling pending calls (no-op when every call already succeeded)
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -1,34 +1,116 @@
 import traceback
+import threading
+from typing import NamedTuple, Optional
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-
-from functools import reduce
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from src.exception import DocumentParsingException
 
+class Chunk(NamedTuple):
+    """
+    Chunk of text with its source metadata
+    """
+    text: str
+    source: Optional[str]
+    page: int
+    start: int
+    end: int
+
 class Document():
     def __init__(self,
-                 text_data: list[str],
+                 text_data,
                  chunk_size: int=500,
-                 chunk_overlap: int=50):
+                 chunk_overlap: int=50,
+                 source: Optional[str]=None):
         """
         A document that is defined by its text content. Input data may be a list of texts in the
-        case where a pre-split can be performed on original text.
+        case where a pre-split can be performed on original text (ex: pages of a pdf). It can also be
+        an iterator of texts: text data is chunked lazily, so that chunks can be streamed (and embedded)
+        while texts are still being extracted. A document merging several sources is defined by
+        (source, text) pairs instead of texts.
 
-        @param text_data: List of texts to feed as input for text document
+        @param text_data: List or iterator of texts (or of (source, text) pairs) to feed as input for text document
+        @param chunk_size: Size of chunk for text treatment
+        @param chunk_overlap: Number of characters for chunk overlap
+        @param source: Name of the source of the texts, saved in chunks metadata
         """
         # Defining class attributes
-        self.text_data = text_data
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.content_length = sum([len(text) for text in text_data])
+        self.source = source
+        self.content_length = 0
+        self.source_lengths = {}
         # Defining text splitter to use
         self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-        # Splitting input text data into chunks of text
-        try:
-            self.text_chunks = self.split_text_data_into_chunks(text_data=text_data)
-        except Exception as e:
-            raise DocumentParsingException(stack_trace=traceback.format_exc())
+        # Splitting input text data into chunks of text as they are consumed (chunks split so far are kept)
+        self.chunk_iterator = self.iter_chunks(text_data=self.count_content_length(text_data))
+        self.split_chunks = []
+        self.split_texts = []
+        self.split_done = False
+        self.parsing_error = None
+        self.chunks_lock = threading.Lock()
+
+    def stream_chunks(self):
+        """
+        Yields the chunks of the document, splitting text data (and extracting lazily extracted texts) only
+        as far as needed. Chunks already split are yielded first, several streams can be consumed at once.
+        """
+        index = 0
+        while True:
+            with self.chunks_lock:
+                if self.parsing_error is not None:
+                    raise self.parsing_error
+                if index == len(self.split_chunks):
+                    try:
+                        chunk = next(self.chunk_iterator, None)
+                    except Exception:
+                        self.parsing_error = DocumentParsingException(stack_trace=traceback.format_exc())
+                        raise self.parsing_error
+                    if chunk is None:
+                        self.split_done = True
+                        return
+                    self.split_chunks.append(chunk)
+                    self.split_texts.append(chunk.text)
+                chunk = self.split_chunks[index]
+            index += 1
+            yield chunk
+
+    @property
+    def chunks(self):
+        """
+        Chunks of the document (splits the whole text data)
+        """
+        self.split_all()
+        return self.split_chunks
+
+    @property
+    def text_chunks(self):
+        """
+        Texts of the chunks of the document (splits the whole text data)
+        """
+        self.split_all()
+        return self.split_texts
+
+    def split_all(self):
+        """
+        Splits the remaining text data into chunks
+        """
+        if not self.split_done:
+            for _ in self.stream_chunks():
+                pass
+
+    def count_content_length(self,
+                             text_data):
+        """
+        Yields texts of text data while adding their length to the document and source content lengths
+
+        @param text_data: List or iterator of texts (or of (source, text) pairs)
+        """
+        for text in text_data:
+            source, page_text = text if isinstance(text, tuple) else (self.source, text)
+            self.content_length += len(page_text)
+            self.source_lengths[source] = self.source_lengths.get(source, 0) + len(page_text)
+            yield text
 
     def split_text_into_chunks(self,
                                text):
@@ -40,12 +122,44 @@ class Document():
         """
         return self.text_splitter.split_text(text)
 
-    def split_text_data_into_chunks(self,
-                                    text_data):
+    def iter_text_chunks_with_offsets(self,
+                                      text):
         """
-        Splits text data into chunks of text. If text data is initially splitted (len(text_data) > 0) then
-        splits the text for each original part.
+        Yields (chunk, start, end) tuples for the chunks of a text, start and end being the character
+        span of the chunk in the text
 
-        @param text_data: List of texts to split  
+        @param text: Str text to split into chunks
+        """
+        start = 0
+        previous_chunk_length = 0
+        for chunk in self.split_text_into_chunks(text):
+            # Searching chunk after the overlap with previous chunk (same as langchain add_start_index)
+            offset = start + previous_chunk_length - self.chunk_overlap
+            start = text.find(chunk, max(0, offset))
+            previous_chunk_length = len(chunk)
+            yield chunk, start, start + len(chunk)
+
+    def iter_chunks(self,
+                    text_data):
+        """
+        Lazily splits text data into chunks of text with their metadata. Each text of text data (ex: each
+        page of a pdf) is split on its own, its page number being its 1-based position among the texts
+        of its source.
+
+        @param text_data: List or iterator of texts (or of (source, text) pairs) to split
+        """
+        pages = {}
+        for text in text_data:
+            source, text = text if isinstance(text, tuple) else (self.source, text)
+            pages[source] = pages.get(source, 0) + 1
+            for chunk, start, end in self.iter_text_chunks_with_offsets(text):
+                yield Chunk(text=chunk, source=source, page=pages[source], start=start, end=end)
+
+    def get_source_chunk_indices(self):
+        """
+        Returns a dictionnary of the indices of the chunks of each source, sources being in document order
         """
-        return reduce(lambda x,y: x+y, [self.split_text_into_chunks(text) for text in text_data])
+        source_chunk_indices = {}
+        for index, chunk in enumerate(self.chunks):
+            source_chunk_indices.setdefault(chunk.source, []).append(index)
+        return source_chunk_indices
@@ -0,0 +1,220 @@
+import os
+import json
+import uuid
+import fcntl
+import hashlib
+import threading
+
+import numpy as np
+
+
+def hash_settings(settings):
+    """
+    Returns the sha256 hex digest of JSON serializable settings
+
+    @param settings: Settings to hash
+    """
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class DocumentState():
+    def __init__(self,
+                 path,
+                 document_id,
+                 embedding_settings,
+                 generation_settings):
+        """
+        Persisted state of the last generation on a document: the hashes of its chunks, their embeddings
+        and the questions and flashcards generated from each chunk. A new version of the document is
+        diffed against it by chunk hash so that only added or changed chunks are embedded and sent to the
+        LLM. Embeddings (resp. questions and flashcards) are only reused when the embedding (resp.
+        generation) settings did not change.
+
+        @param path: Root directory of the document states (one sub-directory per document)
+        @param document_id: Id of the document, stable across its versions
+        @param embedding_settings: Settings the embeddings depend on (ex: embedding model name)
+        @param generation_settings: Settings the questions and flashcards depend on (ex: model name, prompt templates)
+        """
+        self.document_id = document_id
+        self.path = os.path.join(path, hashlib.sha256(document_id.encode("utf-8")).hexdigest())
+        self.state_path = os.path.join(self.path, "state.json")
+        self.lock_path = os.path.join(self.path, ".lock")
+        self.embedding_settings = hash_settings(embedding_settings)
+        self.generation_settings = hash_settings(generation_settings)
+        self.lock = threading.Lock()
+        # Previous version of the document
+        self.chunk_hashes = []
+        self.embeddings = None
+        self.questions = {}
+        self.flashcards = {}
+        self.quiz_name = None
+        # Items generated on this version, by chunk hash
+        self.new_questions = {}
+        self.new_flashcards = {}
+        self.stats = {"chunks": 0, "unchangedChunks": 0, "addedChunks": 0, "removedChunks": 0,
+                      "reusedEmbeddings": 0, "reusedQuestions": 0, "reusedFlashcards": 0}
+        self.load()
+
+    @staticmethod
+    def hash_chunk(text):
+        """
+        Returns the sha256 hex digest of a text chunk
+
+        @param text: Text of the chunk
+        """
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def load(self):
+        """
+        Loads the state of the previous version of the document if it exists
+        """
+        if not os.path.exists(self.state_path):
+            return
+        with open(self.state_path, "r") as file:
+            state = json.load(file)
+        self.chunk_hashes = state["chunks"]
+        if state.get("embeddingSettings") == self.embedding_settings and state.get("vectors"):
+            try:
+                self.embeddings = np.load(os.path.join(self.path, state["vectors"]), mmap_mode="r")
+            except FileNotFoundError:
+                # Vectors removed by a concurrent save of a newer version, the chunks are embedded again
+                self.embeddings = None
+        if state.get("generationSettings") == self.generation_settings:
+            self.questions = state["questions"]
+            self.flashcards = state["flashcards"]
+            self.quiz_name = state.get("quizName")
+
+    def diff(self,
+             chunk_hashes):
+        """
+        Diffs the chunks of the new version against the previous version and returns the diff statistics
+
+        @param chunk_hashes: Hashes of the chunks of the new version
+        """
+        previous_hashes = set(self.chunk_hashes)
+        new_hashes = set(chunk_hashes)
+        self.stats["chunks"] = len(chunk_hashes)
+        self.stats["unchangedChunks"] = sum(1 for chunk_hash in chunk_hashes if chunk_hash in previous_hashes)
+        self.stats["addedChunks"] = len(chunk_hashes) - self.stats["unchangedChunks"]
+        self.stats["removedChunks"] = len(previous_hashes - new_hashes)
+        return self.stats
+
+    def get_embeddings(self,
+                       chunk_hashes):
+        """
+        Returns the stored embeddings of the unchanged chunks as a {position in chunk_hashes: embedding} dictionnary
+
+        @param chunk_hashes: Hashes of the chunks of the new version
+        """
+        if self.embeddings is None:
+            return {}
+        rows = {chunk_hash: row for row, chunk_hash in enumerate(self.chunk_hashes)}
+        embeddings = {i: np.array(self.embeddings[rows[chunk_hash]]) for i, chunk_hash in enumerate(chunk_hashes) if chunk_hash in rows}
+        with self.lock:
+            self.stats["reusedEmbeddings"] = len(embeddings)
+        return embeddings
+
+    def get_questions(self,
+                      chunk_hash,
+                      num_questions):
+        """
+        Returns num_questions stored questions generated from a chunk, None if not enough were stored
+
+        @param chunk_hash: Hash of the chunk
+        @param num_questions: Number of questions requested on the chunk
+        """
+        questions = self.questions.get(chunk_hash)
+        if questions is None or len(questions) < num_questions:
+            return None
+        with self.lock:
+            self.stats["reusedQuestions"] += num_questions
+        return questions[:num_questions]
+
+    def get_flashcards(self,
+                       chunk_hash):
+        """
+        Returns the stored flashcards generated from a chunk, None if the chunk has no stored flashcards
+
+        @param chunk_hash: Hash of the chunk
+        """
+        flashcards = self.flashcards.get(chunk_hash)
+        if flashcards is None:
+            return None
+        with self.lock:
+            self.stats["reusedFlashcards"] += len(flashcards)
+        return flashcards
+
+    def add_questions(self,
+                      chunk_hash,
+                      questions,
+                      quiz_name=None):
+        """
+        Records the questions generated from a chunk of the new version
+
+        @param chunk_hash: Hash of the chunk
+        @param questions: Generated questions as dictionnaries
+        @param quiz_name: Name of the quiz generated with the questions
+        """
+        with self.lock:
+            self.new_questions[chunk_hash] = self.new_questions.get(chunk_hash, []) + questions
+            if quiz_name is not None and self.quiz_name is None:
+                self.quiz_name = quiz_name
+
+    def add_flashcards(self,
+                       chunk_hash,
+                       flashcards):
+        """
+        Records the flashcards generated from a chunk of the new version
+
+        @param chunk_hash: Hash of the chunk
+        @param flashcards: Generated flashcards as dictionnaries
+        """
+        with self.lock:
+            self.new_flashcards[chunk_hash] = self.new_flashcards.get(chunk_hash, []) + flashcards
+
+    def save(self,
+             chunk_hashes,
+             embeddings=None):
+        """
+        Saves the state of the new version: its chunks, their embeddings, the items generated from them
+        and the stored items of unchanged chunks that were not used this time. The state file is replaced
+        atomically and the vectors file of the previous version is removed. Saves of the document are
+        serialized across processes by a lock on its directory, so that a save never removes the vectors
+        file of the state written by a concurrent save.
+
+        @param chunk_hashes: Hashes of the chunks of the new version
+        @param embeddings: Embeddings of the chunks (in chunk order), None if the chunks were not embedded
+        """
+        os.makedirs(self.path, exist_ok=True)
+        new_hashes = set(chunk_hashes)
+        with self.lock:
+            questions = {chunk_hash: items for chunk_hash, items in {**self.questions, **self.new_questions}.items() if chunk_hash in new_hashes}
+            flashcards = {chunk_hash: items for chunk_hash, items in {**self.flashcards, **self.new_flashcards}.items() if chunk_hash in new_hashes}
+            quiz_name = self.quiz_name
+        with open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                vectors = None
+                if embeddings is not None and len(embeddings) == len(chunk_hashes):
+                    vectors = f"vectors-{uuid.uuid4().hex}.npy"
+                    np.save(os.path.join(self.path, vectors), np.asarray(embeddings, dtype=np.float32))
+                tmp_state_path = f"{self.state_path}.{uuid.uuid4().hex}.tmp"
+                with open(tmp_state_path, "w") as file:
+                    json.dump({"documentId": self.document_id,
+                               "embeddingSettings": self.embedding_settings,
+                               "generationSettings": self.generation_settings,
+                               "chunks": chunk_hashes,
+                               "vectors": vectors,
+                               "questions": questions,
+                               "flashcards": flashcards,
+                               "quizName": quiz_name}, file)
+                os.replace(tmp_state_path, self.state_path)
+                # Removing vectors files of previous versions
+                for file_name in os.listdir(self.path):
+                    if file_name.startswith("vectors-") and file_name != vectors:
+                        try:
+                            os.remove(os.path.join(self.path, file_name))
+                        except FileNotFoundError:
+                            pass
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,265 @@
+import os
+import re
+import json
+import uuid
+import fcntl
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(path,
+                        model_name,
+                        max_entries):
+    """
+    Returns the process-wide embedding cache for an embedding model, opening it on first use.
+
+    @param path: Root directory of the embedding caches
+    @param model_name: Name of the embedding model whose vectors are cached
+    @param max_entries: Maximum number of vectors kept in cache
+    """
+    with _caches_lock:
+        key = (os.path.abspath(path), model_name)
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(path=path, model_name=model_name, max_entries=max_entries)
+        return _caches[key]
+
+
+class EmbeddingCache():
+    def __init__(self,
+                 path,
+                 model_name,
+                 max_entries=100000):
+        """
+        Persistent content-addressed cache of embeddings for one embedding model. Vectors are stored in a
+        memory-mapped float32 matrix (vectors.npy) and the rows of the matrix are indexed by chunk key in
+        an index file (index.json) ordered from least to most recently used. Index updates are appended to
+        a journal replayed on load, and the index file is only rewritten (compacting the journal) once the
+        journal outgrows it or the vectors file grows, so that storing vectors does not cost the size of
+        the cache. When max_entries is reached, the least recently used vector is evicted and its row is
+        reused. Cache hits are written to the index with the next vectors stored by the process, so recency
+        only accounts for the reads of other processes once they stored vectors too.
+
+        @param path: Root directory of the embedding caches (one sub-directory per model)
+        @param model_name: Name of the embedding model whose vectors are cached
+        @param max_entries: Maximum number of vectors kept in cache
+        """
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.path = os.path.join(path, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+        self.index_path = os.path.join(self.path, "index.json")
+        self.vectors_path = os.path.join(self.path, "vectors.npy")
+        self.lock_path = os.path.join(self.path, ".lock")
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        # Loading cache index and vectors if they exist
+        self.entries = OrderedDict()
+        self.vectors = None
+        self.index_mtime = None
+        # Journal of the index updates since it was last written, and number of bytes and updates replayed
+        self.journal_path = None
+        self.journal_offset = 0
+        self.journal_size = 0
+        # Keys read since the index was last written, moved to the end of the index on next write
+        self.touched_keys = OrderedDict()
+        self.load()
+
+    @staticmethod
+    def make_key(text,
+                 chunk_size,
+                 chunk_overlap):
+        """
+        Builds the cache key of a text chunk from its content and the chunking settings that produced it
+
+        @param text: Text chunk to embed
+        @param chunk_size: Size of chunk used to split the document
+        @param chunk_overlap: Number of characters for chunk overlap
+        """
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{chunk_size}:{chunk_overlap}:{text_hash}"
+
+    @contextmanager
+    def file_lock(self,
+                  exclusive=True):
+        """
+        Holds a lock on the cache directory so that several processes can share it: exclusive to write
+        vectors, shared to read them while no other process evicts and reuses their rows
+
+        @param exclusive: Whether to take an exclusive or a shared lock
+        """
+        with open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self):
+        """
+        Loads index and memory-mapped vectors from disk if the index was rewritten since last load, then
+        replays the updates appended to its journal since last load
+        """
+        if not os.path.exists(self.index_path) or not os.path.exists(self.vectors_path):
+            return
+        index_mtime = os.stat(self.index_path).st_mtime_ns
+        if index_mtime != self.index_mtime:
+            with open(self.index_path, "r") as file:
+                index = json.load(file)
+            self.entries = OrderedDict(index["entries"])
+            self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+            self.index_mtime = index_mtime
+            self.journal_path = os.path.join(self.path, index["journal"]) if index.get("journal") else None
+            self.journal_offset = 0
+            self.journal_size = 0
+        if self.journal_path is None or not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "rb") as file:
+            file.seek(self.journal_offset)
+            data = file.read()
+        # Only replaying complete lines (the last one may still be written by another process)
+        data = data[:data.rfind(b"\n") + 1]
+        self.journal_offset += len(data)
+        for line in data.splitlines():
+            try:
+                updates = json.loads(line)
+            except ValueError:
+                continue
+            self.replay(updates)
+            self.journal_size += len(updates)
+
+    def replay(self,
+               updates):
+        """
+        Applies index updates: ["touch", key] moves a key to the most recently used end, ["evict", key]
+        removes it and ["put", key, row] stores it at the most recently used end
+
+        @param updates: Index updates in order
+        """
+        for update in updates:
+            if update[0] == "put":
+                self.entries[update[1]] = update[2]
+                self.entries.move_to_end(update[1])
+            elif update[0] == "evict":
+                self.entries.pop(update[1], None)
+            elif update[1] in self.entries:
+                self.entries.move_to_end(update[1])
+
+    def save(self,
+             updates,
+             compact=False):
+        """
+        Flushes vectors and appends index updates to the journal, or atomically writes the index file with
+        a new empty journal when compacting or when the journal outgrows the index
+
+        @param updates: Index updates applied since last load (see replay)
+        @param compact: Whether to write the index file
+        """
+        self.vectors.flush()
+        self.journal_size += len(updates)
+        if compact or self.journal_path is None or self.journal_size > max(len(self.entries), 1024):
+            journal = f"journal-{uuid.uuid4().hex}.jsonl"
+            tmp_index_path = f"{self.index_path}.tmp"
+            with open(tmp_index_path, "w") as file:
+                json.dump({"entries": list(self.entries.items()), "journal": journal}, file)
+            os.replace(tmp_index_path, self.index_path)
+            self.index_mtime = os.stat(self.index_path).st_mtime_ns
+            self.journal_path = os.path.join(self.path, journal)
+            self.journal_offset = 0
+            self.journal_size = 0
+            # Removing journals compacted in the index file
+            for file_name in os.listdir(self.path):
+                if file_name.startswith("journal-") and file_name != journal:
+                    os.remove(os.path.join(self.path, file_name))
+            return
+        line = (json.dumps(updates) + "\n").encode("utf-8")
+        with open(self.journal_path, "ab") as file:
+            file.write(line)
+        self.journal_offset += len(line)
+
+    def get_many(self,
+                 keys):
+        """
+        Returns the cached vector of every key (None for cache misses)
+
+        @param keys: Keys of the text chunks to look up
+        """
+        with self.lock, self.file_lock(exclusive=False):
+            self.load()
+            vectors = []
+            for key in keys:
+                row = self.entries.get(key)
+                if row is None:
+                    vectors.append(None)
+                else:
+                    self.entries.move_to_end(key)
+                    self.touched_keys[key] = None
+                    self.touched_keys.move_to_end(key)
+                    vectors.append(np.array(self.vectors[row]))
+            return vectors
+
+    def put_many(self,
+                 keys,
+                 vectors):
+        """
+        Stores vectors in cache, evicting least recently used vectors when the cache is full
+
+        @param keys: Keys of the embedded text chunks
+        @param vectors: Embeddings of the text chunks
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            return
+        with self.lock, self.file_lock():
+            self.load()
+            # Writing the cache hits of this process to the index before evicting least recently used vectors
+            updates = [["touch", key] for key in self.touched_keys if key in self.entries]
+            self.touched_keys.clear()
+            self.replay(updates)
+            grown = self.ensure_capacity(nb_rows=min(len(self.entries) + len(keys), self.max_entries),
+                                         dimension=vectors.shape[1])
+            for key, vector in zip(keys, vectors):
+                if key in self.entries:
+                    row = self.entries[key]
+                    self.entries.move_to_end(key)
+                elif len(self.entries) >= self.max_entries:
+                    # Evicting least recently used vector and reusing its row
+                    evicted_key, row = self.entries.popitem(last=False)
+                    updates.append(["evict", evicted_key])
+                    self.entries[key] = row
+                else:
+                    row = len(self.entries)
+                    self.entries[key] = row
+                updates.append(["put", key, row])
+                self.vectors[row] = vector
+            # Other processes must reload the vectors file once it was replaced
+            self.save(updates, compact=grown)
+
+    def ensure_capacity(self,
+                        nb_rows,
+                        dimension):
+        """
+        Grows the memory-mapped vectors file (doubling its capacity) so that it can hold nb_rows vectors,
+        returns whether it was replaced
+
+        @param nb_rows: Number of rows that must fit in the vectors file
+        @param dimension: Dimension of the embeddings
+        """
+        capacity = 0 if self.vectors is None else self.vectors.shape[0]
+        if nb_rows <= capacity:
+            return False
+        new_capacity = min(max(nb_rows, 2 * capacity, 1024), self.max_entries)
+        tmp_vectors_path = f"{self.vectors_path}.tmp.npy"
+        vectors = np.lib.format.open_memmap(tmp_vectors_path, mode="w+", dtype=np.float32, shape=(new_capacity, dimension))
+        if self.vectors is not None:
+            vectors[:capacity] = self.vectors
+        vectors.flush()
+        del vectors
+        os.replace(tmp_vectors_path, self.vectors_path)
+        self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+        return True
@@ -43,4 +43,24 @@ class WebPageException(RAQAMException):
     def __init__(self, message):
         super().__init__(error="WebPageException", 
                          status_code=403,
-                         message=message)         
+                         message=message)
+
+class JobNotFoundException(RAQAMException):
+    def __init__(self, job_id):
+        super().__init__(error="JobNotFoundException", 
+                         status_code=404,
+                         message=f"No job found with id {job_id}")
+
+class ServiceUnavailableException(RAQAMException):
+    def __init__(self, retry_after, draining=False):
+        super().__init__(error="ServiceUnavailableException", 
+                         status_code=503,
+                         message="Server is shutting down, retry on another instance" if draining else "Too many requests in progress, retry later")
+        self.retry_after = retry_after
+
+
+class GenerationCancelledException(RAQAMException):
+    def __init__(self):
+        super().__init__(error="GenerationCancelledException", 
+                         status_code=500,
+                         message="Generation cancelled after a previous failure")
\ No newline at end of file
@@ -0,0 +1,163 @@
+import re
+import time
+import zlib
+import random
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage
+
+from src.quiz import Quiz, MCQuestion, FlashCards, FlashCard
+from src.tokens import estimate_tokens
+
+
+class FakeStructuredOutput():
+    def __init__(self,
+                 chat_model,
+                 schema):
+        """
+        Structured output runnable of FakeChatModel, returning the same {"raw", "parsed", "parsing_error"}
+        output as langchain with_structured_output(schema, include_raw=True)
+
+        @param chat_model: FakeChatModel generating the outputs
+        @param schema: Quiz or FlashCards schema of the outputs
+        """
+        self.chat_model = chat_model
+        self.schema = schema
+
+    def invoke(self,
+               prompt):
+        """
+        Returns a valid structured output generated from the prompt content after the configured latency
+
+        @param prompt: Formatted prompt
+        """
+        self.chat_model.sleep()
+        rng = random.Random(zlib.crc32(prompt.encode("utf-8")) + self.chat_model.seed)
+        words = re.findall(r"\w+", prompt.split("Content:", 1)[-1]) or ["content"]
+        nb_sections = len(re.findall(r"^\[Section \d+\]$", prompt, flags=re.MULTILINE))
+        if self.schema is Quiz:
+            match = re.search(r"generate (\d+) detailed", prompt)
+            parsed = Quiz(quiz_name=" ".join(rng.choices(words, k=3)),
+                          questions=[self.build_question(rng, words, nb_sections) for _ in range(int(match.group(1)) if match else 1)])
+        else:
+            match = re.search(r"(\d+) flashcards in total", prompt)
+            parsed = FlashCards(flashcards=[self.build_flashcard(rng, words, nb_sections) for _ in range(int(match.group(1)) if match else 4)])
+        output_tokens = estimate_tokens(parsed.json())
+        raw = AIMessage(content="", usage_metadata={"input_tokens": estimate_tokens(prompt), "output_tokens": output_tokens,
+                                                    "total_tokens": estimate_tokens(prompt) + output_tokens})
+        return {"raw": raw, "parsed": parsed, "parsing_error": None}
+
+    def build_question(self,
+                       rng,
+                       words,
+                       nb_sections):
+        """
+        Builds a multiple choice question made of words of the content
+
+        @param rng: Random generator of the call
+        @param words: Words of the prompt content
+        @param nb_sections: Number of sections of a packed content (0 if not packed)
+        """
+        return MCQuestion(question=" ".join(rng.choices(words, k=12)) + " ?",
+                          choices=[" ".join(rng.choices(words, k=4)) for _ in range(4)],
+                          answer_index=rng.randrange(4),
+                          explanation=" ".join(rng.choices(words, k=20)),
+                          chunk_index=rng.randint(1, nb_sections) if nb_sections else None)
+
+    def build_flashcard(self,
+                        rng,
+                        words,
+                        nb_sections):
+        """
+        Builds a flashcard made of words of the content
+
+        @param rng: Random generator of the call
+        @param words: Words of the prompt content
+        @param nb_sections: Number of sections of a packed content (0 if not packed)
+        """
+        return FlashCard(front=" ".join(rng.choices(words, k=3)),
+                         back=" ".join(rng.choices(words, k=20)),
+                         chunk_index=rng.randint(1, nb_sections) if nb_sections else None)
+
+
+class FakeChatModel():
+    def __init__(self,
+                 model_name="fake:gpt-4o-mini",
+                 latency=0.0,
+                 latency_jitter=0.0,
+                 seed=0):
+        """
+        Offline drop-in replacement of ChatOpenAI for benchmarks and load tests: structured outputs are
+        valid Quiz / FlashCards built from the words of the prompt content, with reported token usage.
+
+        @param model_name: Name of the model (costs are the ones of the model name without "fake:" prefix)
+        @param latency: Number of seconds waited by each call
+        @param latency_jitter: Maximum number of seconds randomly added to the latency of each call
+        @param seed: Random seed of generated outputs
+        """
+        self.model_name = model_name
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.seed = seed
+
+    def sleep(self):
+        """
+        Waits the latency of a call
+        """
+        latency = self.latency + random.uniform(0, self.latency_jitter)
+        if latency > 0:
+            time.sleep(latency)
+
+    def with_structured_output(self,
+                               schema,
+                               include_raw=True):
+        """
+        Returns the structured output runnable for a schema
+
+        @param schema: Quiz or FlashCards schema
+        @param include_raw: Kept for compatibility, raw message is always included
+        """
+        return FakeStructuredOutput(chat_model=self, schema=schema)
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self,
+                 model="fake:text-embedding-3-small",
+                 dimensions=1536,
+                 latency=0.0):
+        """
+        Offline drop-in replacement of OpenAIEmbeddings: deterministic unit-norm vectors hashing the words
+        of texts (texts sharing words have close vectors).
+
+        @param model: Name of the model
+        @param dimensions: Dimension of the vectors
+        @param latency: Number of seconds waited by each embedding request
+        """
+        self.model = model
+        self.dimensions = dimensions
+        self.latency = latency
+
+    def embed_text(self,
+                   text):
+        """
+        Returns the hashed vector of a text
+
+        @param text: Text to embed
+        """
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            word_hash = zlib.crc32(word.encode("utf-8"))
+            vector[word_hash % self.dimensions] += 1.0 if word_hash & (1 << 31) else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def embed_documents(self,
+                        texts):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return [self.embed_text(text) for text in texts]
+
+    def embed_query(self,
+                    text):
+        return self.embed_documents([text])[0]
@@ -0,0 +1,246 @@
+import os
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:
+    # Peak RSS is not available on Windows
+    resource = None
+
+# HTTP status codes of responses retried by the request scheduler
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# Upper bounds (in seconds) of the buckets of stage duration histograms
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+# Tracing python allocations has an overhead, it is only enabled on demand
+if os.environ.get("RAQAM_TRACEMALLOC") == "1":
+    tracemalloc.start()
+
+# Stack of the spans opened by each thread, so that retries are added to the current span
+_spans = threading.local()
+# Spans of every thread measuring traced memory, with the peak of traced memory reached while they are open
+_memory_spans = []
+_memory_spans_lock = threading.Lock()
+# Spans are shared with worker threads (see with_current_spans), their retries are counted under a lock
+_retries_lock = threading.Lock()
+
+
+def get_peak_rss_mb():
+    """
+    Returns the peak resident set size of the process in MB (None if not available)
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def start_memory_span():
+    """
+    Starts measuring the peak of traced python allocations for a span, returns its memory record (None if
+    tracemalloc is not tracing). The peak of tracemalloc is reset, the peak reached so far being kept by
+    the spans already open (of any thread).
+    """
+    if not tracemalloc.is_tracing():
+        return None
+    with _memory_spans_lock:
+        current, peak = tracemalloc.get_traced_memory()
+        for memory_span in _memory_spans:
+            memory_span["peak"] = max(memory_span["peak"], peak)
+        tracemalloc.reset_peak()
+        memory_span = {"start": current, "peak": current}
+        _memory_spans.append(memory_span)
+        return memory_span
+
+def stop_memory_span(memory_span):
+    """
+    Stops measuring a span, returns the peak of traced python allocations while it was open above their
+    size at its start, in MB (allocations of other threads included)
+
+    @param memory_span: Memory record returned by start_memory_span (None if tracemalloc was not tracing)
+    """
+    if memory_span is None or not tracemalloc.is_tracing():
+        return None
+    with _memory_spans_lock:
+        _, peak = tracemalloc.get_traced_memory()
+        memory_span["peak"] = max(memory_span["peak"], peak)
+        _memory_spans.remove(memory_span)
+    return (memory_span["peak"] - memory_span["start"]) / (1024 * 1024)
+
+def record_retry():
+    """
+    Adds a retry to the innermost span opened by the current thread, or by the thread it works for (if any)
+    """
+    stack = getattr(_spans, "stack", None)
+    if stack:
+        with _retries_lock:
+            stack[-1]["retries"] += 1
+
+def with_current_spans(func):
+    """
+    Returns a function calling func with the spans opened by the current thread, so that retries of calls
+    run by worker threads (ex: embedding batches) are added to the current span of this thread
+
+    @param func: Function called by worker threads
+    """
+    stack = list(getattr(_spans, "stack", []))
+
+    def call(*args, **kwargs):
+        previous_stack = getattr(_spans, "stack", None)
+        _spans.stack = list(stack)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _spans.stack = previous_stack if previous_stack is not None else []
+    return call
+
+def record_retryable_response(response):
+    """
+    httpx response hook counting responses that the request scheduler retries
+
+    @param response: httpx response
+    """
+    if response.status_code in RETRYABLE_STATUS_CODES:
+        record_retry()
+
+def span(timings,
+         name):
+    """
+    Returns the span context of a stage when timings are recorded, a no-op context otherwise
+
+    @param timings: Timings recording the span (None if not recorded)
+    @param name: Name of the stage
+    """
+    return timings.span(name) if timings is not None else nullcontext()
+
+
+class Timings():
+    def __init__(self,
+                 metrics=None):
+        """
+        Records the wall time, CPU time (of the thread opening the span), peak memory and retries of the
+        stages of a quiz generation. The peak of traced python allocations is measured over each span,
+        the peak RSS is the high-water mark of the process when the span ends.
+
+        @param metrics: Metrics where stage records are aggregated (process-wide metrics if None)
+        """
+        self.metrics = metrics if metrics is not None else METRICS
+        self.records = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self,
+             name):
+        """
+        Context recording a stage
+
+        @param name: Name of the stage
+        """
+        record = {"retries": 0}
+        if not hasattr(_spans, "stack"):
+            _spans.stack = []
+        _spans.stack.append(record)
+        memory_span = start_memory_span()
+        start_wall, start_cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield record
+        finally:
+            _spans.stack.pop()
+            record["wallSeconds"] = time.perf_counter() - start_wall
+            record["cpuSeconds"] = time.thread_time() - start_cpu
+            record["processPeakRssMb"] = get_peak_rss_mb()
+            record["tracemallocPeakMb"] = stop_memory_span(memory_span)
+            with self.lock:
+                self.records.setdefault(name, []).append(record)
+            self.metrics.observe(name, record)
+
+    def summary(self):
+        """
+        Returns the records aggregated by stage, as a JSON serializable dictionnary
+        """
+        def max_value(records, key):
+            values = [record[key] for record in records if record[key] is not None]
+            return round(max(values), 3) if values else None
+
+        with self.lock:
+            records = {name: list(stage_records) for name, stage_records in self.records.items()}
+        return {
+            name: {
+                "count": len(stage_records),
+                "wallSeconds": round(sum(record["wallSeconds"] for record in stage_records), 6),
+                "maxWallSeconds": round(max(record["wallSeconds"] for record in stage_records), 6),
+                "cpuSeconds": round(sum(record["cpuSeconds"] for record in stage_records), 6),
+                "retries": sum(record["retries"] for record in stage_records),
+                "processPeakRssMb": max_value(stage_records, "processPeakRssMb"),
+                "tracemallocPeakMb": max_value(stage_records, "tracemallocPeakMb")
+            }
+            for name, stage_records in records.items()
+        }
+
+
+class Metrics():
+    def __init__(self,
+                 buckets=DURATION_BUCKETS):
+        """
+        Process-wide aggregation of stage records into histograms, rendered in Prometheus text format
+
+        @param buckets: Upper bounds (in seconds) of the duration histogram buckets
+        """
+        self.buckets = buckets
+        self.histograms = {}
+        self.retries = {}
+        self.lock = threading.Lock()
+
+    def observe(self,
+                name,
+                record):
+        """
+        Adds a stage record to the wall time and CPU time histograms of the stage
+
+        @param name: Name of the stage
+        @param record: Record of the stage span
+        """
+        with self.lock:
+            for metric in ["wallSeconds", "cpuSeconds"]:
+                histogram = self.histograms.setdefault((metric, name), {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+                for i, bucket in enumerate(self.buckets):
+                    if record[metric] <= bucket:
+                        histogram["counts"][i] += 1
+                histogram["sum"] += record[metric]
+                histogram["count"] += 1
+            self.retries[name] = self.retries.get(name, 0) + record["retries"]
+
+    def render(self):
+        """
+        Returns the metrics in Prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            for metric, metric_name, description in [("wallSeconds", "raqam_stage_duration_seconds", "Wall time of quiz generation stages"),
+                                                     ("cpuSeconds", "raqam_stage_cpu_seconds", "CPU time of quiz generation stages")]:
+                lines.append(f"# HELP {metric_name} {description}")
+                lines.append(f"# TYPE {metric_name} histogram")
+                for (histogram_metric, name), histogram in sorted(self.histograms.items()):
+                    if histogram_metric != metric:
+                        continue
+                    for bucket, count in zip(self.buckets, histogram["counts"]):
+                        lines.append(f'{metric_name}_bucket{{stage="{name}",le="{bucket}"}} {count}')
+                    lines.append(f'{metric_name}_bucket{{stage="{name}",le="+Inf"}} {histogram["count"]}')
+                    lines.append(f'{metric_name}_sum{{stage="{name}"}} {histogram["sum"]}')
+                    lines.append(f'{metric_name}_count{{stage="{name}"}} {histogram["count"]}')
+            lines.append("# HELP raqam_stage_retries_total Retried HTTP requests of quiz generation stages")
+            lines.append("# TYPE raqam_stage_retries_total counter")
+            for name, retries in sorted(self.retries.items()):
+                lines.append(f'raqam_stage_retries_total{{stage="{name}"}} {retries}')
+        peak_rss_mb = get_peak_rss_mb()
+        if peak_rss_mb is not None:
+            lines.append("# HELP raqam_peak_rss_bytes Peak resident set size of the process")
+            lines.append("# TYPE raqam_peak_rss_bytes gauge")
+            lines.append(f"raqam_peak_rss_bytes {int(peak_rss_mb * 1024 * 1024)}")
+        return "\n".join(lines) + "\n"
+
+
+# Metrics of every quiz generation of the process
+METRICS = Metrics()
@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import threading
+import traceback
+from contextlib import contextmanager
+
+from src.exception import RAQAMException
+
+
+class JobStore():
+    def __init__(self,
+                 path,
+                 files_path):
+        """
+        SQLite persistence of quiz generation jobs, shared by every worker using the same database so
+        that jobs survive a worker restart.
+
+        @param path: Path of the SQLite database file
+        @param files_path: Directory where uploaded files of jobs are stored
+        """
+        self.path = path
+        self.files_path = files_path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.makedirs(files_path, exist_ok=True)
+        with self.connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    tenant TEXT,
+                    status TEXT,
+                    created_at REAL,
+                    updated_at REAL,
+                    started_at REAL,
+                    input TEXT,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            # Adding the attempts counter to databases created before it existed
+            columns = [row["name"] for row in connection.execute("PRAGMA table_info(jobs)")]
+            if "attempts" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, tenant, created_at)")
+
+    @contextmanager
+    def connect(self):
+        """
+        Opens a new connection to the database (one per call to stay thread-safe) and commits on exit
+        """
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            yield connection
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def create(self,
+               tenant,
+               data,
+               pdf_file=None):
+        """
+        Stores a new queued job and returns its id
+
+        @param tenant: Tenant submitting the job
+        @param data: JSON serializable input data of the job
+        @param pdf_file: Uploaded pdf file or list of uploaded pdf files (if any), as bytes or as paths of
+        spooled files (moved to the job files directory)
+        """
+        job_id = uuid.uuid4().hex
+        data = dict(data)
+        if isinstance(pdf_file, list):
+            data["pdf_path"] = [os.path.join(self.files_path, f"{job_id}_{i}.pdf") for i in range(len(pdf_file))]
+            for path, content in zip(data["pdf_path"], pdf_file):
+                self.store_file(path, content)
+        elif pdf_file is not None:
+            data["pdf_path"] = os.path.join(self.files_path, f"{job_id}.pdf")
+            self.store_file(data["pdf_path"], pdf_file)
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute("INSERT INTO jobs (id, tenant, status, created_at, updated_at, input, progress) VALUES (?, ?, 'queued', ?, ?, ?, '{}')",
+                               (job_id, tenant, now, now, json.dumps(data)))
+        return job_id
+
+    def store_file(self,
+                   path,
+                   content):
+        """
+        Stores an uploaded file of a job, moving spooled files instead of copying them through memory
+
+        @param path: Path where to store the file
+        @param content: Bytes or path of the uploaded file
+        """
+        if isinstance(content, os.PathLike):
+            shutil.move(content, path)
+        else:
+            with open(path, "wb") as file:
+                file.write(content)
+
+    def get(self,
+            job_id):
+        """
+        Returns a job as a dictionnary, None if it does not exist
+
+        @param job_id: Id of the job
+        """
+        with self.connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "jobId": row["id"],
+            "tenant": row["tenant"],
+            "status": row["status"],
+            "createdAt": row["created_at"],
+            "updatedAt": row["updated_at"],
+            "input": json.loads(row["input"]),
+            "progress": json.loads(row["progress"]),
+            "result": json.loads(row["result"]) if row["result"] is not None else None,
+            "error": json.loads(row["error"]) if row["error"] is not None else None,
+            "attempts": row["attempts"]
+        }
+
+    def claim_next(self):
+        """
+        Marks the next queued job as running and returns it (None if no job is queued). Tenants are
+        served fairly: jobs of the tenant with the fewest running jobs come first, then jobs of the least
+        recently served tenant, then the oldest jobs.
+        """
+        with self.connect() as connection:
+            row = connection.execute("""
+                SELECT id FROM jobs AS queued
+                WHERE status = 'queued'
+                ORDER BY (SELECT COUNT(*) FROM jobs AS running WHERE running.tenant = queued.tenant AND running.status = 'running'),
+                         (SELECT MAX(started_at) FROM jobs AS served WHERE served.tenant = queued.tenant),
+                         created_at
+                LIMIT 1
+            """).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            connection.execute("UPDATE jobs SET status = 'running', updated_at = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                               (now, now, row["id"]))
+        return self.get(row["id"])
+
+    def update_progress(self,
+                        job_id,
+                        progress):
+        """
+        Saves the progress of a running job (also used as heartbeat of the job)
+
+        @param job_id: Id of the job
+        @param progress: JSON serializable progress of the job
+        """
+        with self.connect() as connection:
+            connection.execute("UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?", (json.dumps(progress), time.time(), job_id))
+
+    def touch(self,
+              job_id):
+        """
+        Refreshes the heartbeat of a running job
+
+        @param job_id: Id of the job
+        """
+        with self.connect() as connection:
+            connection.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def finish(self,
+               job_id,
+               result=None,
+               error=None):
+        """
+        Saves the result (status done) or the error (status failed) of a job and removes its files
+
+        @param job_id: Id of the job
+        @param result: JSON serializable result of the job
+        @param error: JSON serializable error of the job
+        """
+        status = "failed" if error is not None else "done"
+        with self.connect() as connection:
+            connection.execute("UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                               (status, json.dumps(result) if result is not None else None,
+                                json.dumps(error) if error is not None else None, time.time(), job_id))
+        self.remove_files(job_id)
+
+    def remove_files(self,
+                     job_id):
+        """
+        Removes the uploaded files of a job
+
+        @param job_id: Id of the job
+        """
+        for file_name in os.listdir(self.files_path):
+            if file_name.startswith(job_id):
+                os.remove(os.path.join(self.files_path, file_name))
+
+    def requeue_stale(self,
+                      stale_after,
+                      max_attempts=3):
+        """
+        Puts back in queue running jobs that did not report progress for stale_after seconds (their
+        worker was restarted or crashed). Stale jobs already run max_attempts times are failed instead,
+        so that a job crashing its workers is not run forever.
+
+        @param stale_after: Number of seconds without progress after which a running job is stale
+        @param max_attempts: Maximum number of times a job is run
+        """
+        now = time.time()
+        error = {"error": "JobAttemptsExceeded", "message": f"Job stopped without result {max_attempts} times", "stack_trace": None}
+        with self.connect() as connection:
+            failed_ids = [row["id"] for row in connection.execute("SELECT id FROM jobs WHERE status = 'running' AND updated_at < ? AND attempts >= ?",
+                                                                  (now - stale_after, max_attempts))]
+            connection.execute("UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE status = 'running' AND updated_at < ? AND attempts >= ?",
+                               (json.dumps(error), now, now - stale_after, max_attempts))
+            cursor = connection.execute("UPDATE jobs SET status = 'queued', progress = '{}' WHERE status = 'running' AND updated_at < ?",
+                                        (now - stale_after,))
+        for job_id in failed_ids:
+            self.remove_files(job_id)
+        return cursor.rowcount
+
+
+class JobQueue():
+    def __init__(self,
+                 store,
+                 run_job,
+                 max_concurrent_jobs=2,
+                 poll_interval=1.0,
+                 stale_after=600,
+                 max_attempts=3):
+        """
+        Worker pool running queued jobs in background threads of the current process
+
+        @param store: JobStore where jobs are persisted
+        @param run_job: Function running a job from its input data and a progress callback, returns the job result
+        @param max_concurrent_jobs: Maximum number of jobs run at the same time by this worker
+        @param poll_interval: Number of seconds between two polls of the job store when idle
+        @param stale_after: Number of seconds without progress after which a running job is queued again
+        @param max_attempts: Maximum number of times a job is run before it is failed (when its runs stop without result)
+        """
+        self.store = store
+        self.run_job = run_job
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.wake_up_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.started_pid = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts worker threads (once per process, so that it can be called after a fork)
+        """
+        with self.lock:
+            if self.started_pid == os.getpid():
+                return
+            self.started_pid = os.getpid()
+            self.stop_event.clear()
+            self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(self.max_concurrent_jobs)]
+            for thread in self.threads:
+                thread.start()
+
+    def request_stop(self):
+        """
+        Asks worker threads to stop after their current job without waiting for them (can be called from
+        a signal handler)
+        """
+        self.stop_event.set()
+        self.wake_up_event.set()
+
+    def stop(self,
+             timeout=None):
+        """
+        Stops worker threads after their current job
+
+        @param timeout: Maximum number of seconds to wait for each worker thread
+        """
+        self.request_stop()
+        for thread in self.threads:
+            thread.join(timeout=timeout)
+
+    def submit(self,
+               tenant,
+               data,
+               pdf_file=None):
+        """
+        Queues a new job and returns its id
+
+        @param tenant: Tenant submitting the job
+        @param data: JSON serializable input data of the job
+        @param pdf_file: Uploaded pdf file or list of uploaded pdf files (if any), as bytes or paths
+        """
+        job_id = self.store.create(tenant=tenant, data=data, pdf_file=pdf_file)
+        self.wake_up_event.set()
+        return job_id
+
+    def work(self):
+        """
+        Worker thread loop: claims queued jobs and runs them until the queue is stopped
+        """
+        while not self.stop_event.is_set():
+            try:
+                self.store.requeue_stale(stale_after=self.stale_after, max_attempts=self.max_attempts)
+                job = self.store.claim_next()
+                if job is None:
+                    self.wake_up_event.wait(timeout=self.poll_interval)
+                    self.wake_up_event.clear()
+                    continue
+                self.execute(job)
+            except Exception:
+                # Keeping the worker alive when the job store fails (the job is queued again once stale)
+                print(f"Job worker error: {traceback.format_exc()}")
+                self.stop_event.wait(timeout=self.poll_interval)
+
+    def execute(self,
+                job):
+        """
+        Runs a claimed job and saves its result or error
+
+        @param job: Job claimed from the job store
+        """
+        job_id = job["jobId"]
+        print(f"Running job {job_id} of tenant {job['tenant']}")
+        # Sending heartbeats so that long steps without progress are not considered stale
+        heartbeat_stop_event = threading.Event()
+
+        def heartbeat():
+            while not heartbeat_stop_event.wait(timeout=self.stale_after / 3):
+                self.store.touch(job_id)
+
+        threading.Thread(target=heartbeat, daemon=True).start()
+        result, error = None, None
+        try:
+            result = self.run_job(job["input"], lambda progress: self.store.update_progress(job_id, progress))
+        except RAQAMException as e:
+            error = {"error": e.error, "message": e.message, "stack_trace": e.stack_trace}
+        except Exception as e:
+            error = {"error": "InternalServerError", "message": str(e), "stack_trace": traceback.format_exc()}
+        try:
+            self.store.finish(job_id, result=result, error=error)
+        finally:
+            heartbeat_stop_event.set()
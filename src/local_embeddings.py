@@ -0,0 +1,204 @@
+import os
+import sys
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.clients import LOCAL_MODEL_PREFIX
+
+
+def resolve_model_path(model):
+    """
+    Returns the directory of a local embeddings model: the model itself if it is a directory, otherwise
+    its ONNX export and tokenizer downloaded once from the Hugging Face Hub (ex: "sentence-transformers/all-MiniLM-L6-v2")
+
+    @param model: Directory or Hugging Face Hub name of the model
+    """
+    if os.path.isdir(model):
+        return model
+    from huggingface_hub import snapshot_download
+    return snapshot_download(model, allow_patterns=["onnx/model.onnx", "tokenizer.json"])
+
+def get_onnx_path(model_path):
+    """
+    Returns the path of the ONNX file of a model directory (at its root or in its onnx folder)
+
+    @param model_path: Directory of the model
+    """
+    for onnx_path in [os.path.join(model_path, "model.onnx"), os.path.join(model_path, "onnx", "model.onnx")]:
+        if os.path.exists(onnx_path):
+            return onnx_path
+    raise FileNotFoundError(f"No model.onnx file in {model_path}")
+
+def run_native(func,
+               *args):
+    """
+    Runs a function in a native thread of the gevent hub threadpool when threads are monkey-patched by
+    gevent (ex: gunicorn gevent workers), so that model runs do not block the event loop, directly otherwise
+
+    @param func: Function to run
+    @param args: Arguments of the function
+    """
+    if "gevent" in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched("threading"):
+            import gevent
+            return gevent.get_hub().threadpool.apply(func, args)
+    return func(*args)
+
+
+class LocalEmbeddings(Embeddings):
+    def __init__(self,
+                 model,
+                 max_batch_size=64,
+                 max_wait=0.005,
+                 num_threads=None,
+                 max_length=256):
+        """
+        Drop-in replacement of OpenAIEmbeddings running a sentence embeddings model (ONNX export and
+        tokenizer.json, ex: sentence-transformers/all-MiniLM-L6-v2) on CPU with ONNX Runtime. Texts of
+        concurrent requests are embedded together: a batching thread gathers them for up to max_wait
+        seconds, sorts them by length to limit padding and runs the model by batches of max_batch_size.
+        The model is loaded on first use in each process (ONNX Runtime threads do not survive a fork).
+
+        @param model: Name of the model, "local:" followed by its directory or Hugging Face Hub name
+        @param max_batch_size: Maximum number of texts per model run
+        @param max_wait: Maximum number of seconds a request waits for other requests to join its batch
+        @param num_threads: Number of threads running the model (all cores if None)
+        @param max_length: Maximum number of tokens per text (longer texts are truncated)
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.num_threads = num_threads
+        self.max_length = max_length
+        # Number of model runs and of embedded texts, reporting the effective batch size
+        self.nb_batches = 0
+        self.nb_texts = 0
+        self.session = None
+        self.tokenizer = None
+        self.requests = None
+        self.pid = None
+        self.embedding_dimension = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Loads the model and tokenizer and starts the batching thread, once per process
+        """
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            # Importing ONNX Runtime and tokenizers only when a local model is used
+            import onnxruntime
+            from tokenizers import Tokenizer
+            model_path = resolve_model_path(self.model[len(LOCAL_MODEL_PREFIX):])
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = self.num_threads or os.cpu_count()
+            options.inter_op_num_threads = 1
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.session = onnxruntime.InferenceSession(get_onnx_path(model_path), options, providers=["CPUExecutionProvider"])
+            self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+            self.output_names = [model_output.name for model_output in self.session.get_outputs()]
+            self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+            self.tokenizer.enable_truncation(max_length=self.max_length)
+            self.tokenizer.enable_padding()
+            # Warm-up run, not counted in the batches statistics
+            self.embedding_dimension = run_native(self.run_model, ["hello world"]).shape[1]
+            self.requests = queue.Queue()
+            threading.Thread(target=self.batch_requests, daemon=True).start()
+            self.pid = os.getpid()
+
+    @property
+    def dimensions(self):
+        """
+        Dimension of the vectors of the model (loads the model)
+        """
+        self.load()
+        return self.embedding_dimension
+
+    def run_model(self,
+                  texts):
+        """
+        Embeds texts in a single model run: mean pooling of the token embeddings over the attention mask
+        (unless the model outputs pooled sentence embeddings), then L2 normalization
+
+        @param texts: Texts to embed
+        """
+        encodings = self.tokenizer.encode_batch(texts)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        inputs = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": attention_mask,
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        }
+        outputs = self.session.run(None, {name: inputs[name] for name in self.input_names})
+        if "sentence_embedding" in self.output_names:
+            embeddings = outputs[self.output_names.index("sentence_embedding")]
+        else:
+            mask = attention_mask[:, :, np.newaxis].astype(np.float32)
+            embeddings = (outputs[0] * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return (embeddings / np.maximum(norms, 1e-12)).astype(np.float32)
+
+    def embed_batch(self,
+                    texts):
+        """
+        Embeds texts by batches of max_batch_size texts of similar lengths (in native threads under gevent)
+
+        @param texts: Texts to embed
+        """
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings = np.empty((len(texts), self.embedding_dimension), dtype=np.float32)
+        for start in range(0, len(order), self.max_batch_size):
+            indices = order[start:start + self.max_batch_size]
+            embeddings[indices] = run_native(self.run_model, [texts[i] for i in indices])
+            self.nb_batches += 1
+            self.nb_texts += len(indices)
+        return embeddings
+
+    def batch_requests(self):
+        """
+        Batching thread: gathers the texts of requests received within max_wait seconds (up to
+        max_batch_size texts), embeds them together and hands each request its embeddings
+        """
+        while True:
+            requests = [self.requests.get()]
+            nb_texts = len(requests[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while nb_texts < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    requests.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                nb_texts += len(requests[-1][0])
+            try:
+                embeddings = self.embed_batch([text for texts, _ in requests for text in texts])
+            except Exception as error:
+                for _, future in requests:
+                    future.set_exception(error)
+                continue
+            start = 0
+            for texts, future in requests:
+                future.set_result(embeddings[start:start + len(texts)].tolist())
+                start += len(texts)
+
+    def embed_documents(self,
+                        texts):
+        if not texts:
+            return []
+        self.load()
+        future = Future()
+        self.requests.put((list(texts), future))
+        return future.result()
+
+    def embed_query(self,
+                    text):
+        return self.embed_documents([text])[0]
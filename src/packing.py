@@ -0,0 +1,45 @@
+def pack_adjacent(sizes,
+                  max_tokens):
+    """
+    Groups adjacent items into packs whose total size stays under a token budget. An item larger than
+    the budget is packed alone. Returns the packs as lists of item indices, in item order.
+
+    @param sizes: Number of tokens of each item
+    @param max_tokens: Token budget of a pack (no packing if None or 0)
+    """
+    packs = []
+    pack_tokens = 0
+    for index, size in enumerate(sizes):
+        if packs and max_tokens and pack_tokens + size <= max_tokens:
+            packs[-1].append(index)
+            pack_tokens += size
+        else:
+            packs.append([index])
+            pack_tokens = size
+    return packs
+
+def format_packed_content(contents):
+    """
+    Joins the contents of a pack into numbered sections (numbered from 1) so that generated items can
+    refer to the section they are about
+
+    @param contents: Contents of the pack
+    """
+    return "\n\n".join(f"[Section {section}]\n{content}" for section, content in enumerate(contents, start=1))
+
+def attribute_chunks(items,
+                     chunk_indices):
+    """
+    Replaces the section number of items generated on a pack by the index of their chunk (first chunk of
+    the pack if the section is unknown) and sorts items by chunk
+
+    @param items: Generated items (questions or flashcards) having a chunk_index attribute
+    @param chunk_indices: Indices of the chunks of the pack, in section order
+    """
+    for item in items:
+        section = item.chunk_index
+        if isinstance(section, int) and 1 <= section <= len(chunk_indices):
+            item.chunk_index = chunk_indices[section - 1]
+        else:
+            item.chunk_index = chunk_indices[0]
+    items.sort(key=lambda item: item.chunk_index)
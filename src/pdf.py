@@ -1,20 +1,122 @@
+import os
+import math
+import concurrent.futures
+
 import pymupdf
 import pymupdf4llm
 
+# Document opened once in each extraction worker process
+_worker_pdf_file = None
+
+
+def open_pdf(pdf_file):
+    """
+    Opens a pdf document from its path (pages are read from the file when needed) or from its bytes
+
+    @param pdf_file: Path or bytes of the pdf file
+    """
+    if isinstance(pdf_file, (bytes, bytearray, memoryview)):
+        return pymupdf.open(stream=pdf_file, filetype="pdf")
+    return pymupdf.open(os.fspath(pdf_file), filetype="pdf")
+
+def _init_extraction_worker(pdf_file):
+    """
+    Opens the pdf document in an extraction worker process
+
+    @param pdf_file: Path or bytes of the pdf file
+    """
+    global _worker_pdf_file
+    _worker_pdf_file = open_pdf(pdf_file)
+
+def _extract_page_range(page_range):
+    """
+    Extracts the text of a range of pages in an extraction worker process
+
+    @param page_range: (start, end, markdown) tuple, markdown being whether to extract markdown or plain text
+    """
+    start, end, markdown = page_range
+    return extract_pages_text(_worker_pdf_file, range(start, end), markdown=markdown)
+
+def extract_pages_text(pdf_file,
+                       pages,
+                       markdown=True):
+    """
+    Extracts the text of each page of an opened pdf document
+
+    @param pdf_file: Opened pymupdf document
+    @param pages: Indices of the pages to extract
+    @param markdown: Whether to extract markdown with pymupdf4llm or plain text with page.get_text
+    """
+    if markdown:
+        page_chunks = pymupdf4llm.to_markdown(doc=pdf_file, pages=list(pages), page_chunks=True, show_progress=False)
+        return [page_chunk["text"] for page_chunk in page_chunks]
+    return [pdf_file[page].get_text() for page in pages]
+
+
 class PDFDocument():
 
     def __init__(self,
-                 pdf_file):
+                 pdf_file,
+                 num_workers=None,
+                 markdown=True,
+                 min_pages_per_worker=8):
         """
         PDF Document from which to extract text and generate chunks.
 
-        @param path: Path to local .pdf file        
+        @param pdf_file: Path (preferred, the file is not loaded in memory) or bytes of the .pdf file
+        @param num_workers: Number of processes used to extract pages (all cores if None)
+        @param markdown: Whether to extract markdown structure (pymupdf4llm) or fast plain text (page.get_text)
+        @param min_pages_per_worker: Minimum number of pages given to each extraction process
         """
-        # Opening pdf file
-        self.pdf_file = pymupdf.open(stream=pdf_file, filetype="pdf")
-    
+        # Opening pdf file (extraction processes open the same path instead of receiving a copy of the bytes)
+        self.pdf_source = pdf_file
+        self.pdf_file = open_pdf(pdf_file)
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.markdown = markdown
+        self.min_pages_per_worker = min_pages_per_worker
+
+    def get_page_ranges(self,
+                        num_workers):
+        """
+        Splits document pages into contiguous (start, end, markdown) ranges, several per worker to balance load
+
+        @param num_workers: Number of extraction processes
+        """
+        nb_pages = self.pdf_file.page_count
+        range_size = max(self.min_pages_per_worker // 2, math.ceil(nb_pages / (num_workers * 4)), 1)
+        return [(start, min(start + range_size, nb_pages), self.markdown) for start in range(0, nb_pages, range_size)]
+
+    def iter_pages(self):
+        """
+        Lazily extracts the text content of every page of the opened pdf file, in page order, yielding
+        each page as soon as its page range is extracted. Page ranges are extracted in a process pool
+        when the document is large enough.
+        """
+        nb_pages = self.pdf_file.page_count
+        num_workers = min(self.num_workers, nb_pages // self.min_pages_per_worker)
+        if num_workers <= 1:
+            yield from extract_pages_text(self.pdf_file, range(nb_pages), markdown=self.markdown)
+            return
+        try:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers,
+                                                              initializer=_init_extraction_worker,
+                                                              initargs=(self.pdf_source,))
+        except OSError:
+            # Process pools are not available in some sandboxes (ex: AWS Lambda without /dev/shm)
+            yield from extract_pages_text(self.pdf_file, range(nb_pages), markdown=self.markdown)
+            return
+        with executor:
+            for range_texts in executor.map(_extract_page_range, self.get_page_ranges(num_workers)):
+                yield from range_texts
+
+    def extract_pages(self):
+        """
+        Extracts the text content of every page of the opened pdf file, in page order
+        """
+        return list(self.iter_pages())
+
     def extract_text(self):
         """
-        Extracts the text content from the opened pdf file        
+        Extracts the text content from the opened pdf file
         """
-        return pymupdf4llm.to_markdown(doc=self.pdf_file)
+        return "".join(self.extract_pages())
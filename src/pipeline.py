@@ -0,0 +1,247 @@
+from src.raqam import QuizGenerator
+from src.quiz import Quiz, FlashCards
+from src.result_cache import build_result_cache_key
+from src.question_bank import build_question_bank_key, allocate_questions
+from src.instrumentation import Timings
+from src.tokens import count_tokens_many, estimate_tokens
+
+
+def build_output_data(quiz,
+                      flashcards,
+                      quiz_context):
+    """
+    Builds the response data of a quiz generation request
+
+    @param quiz: Generated quiz (None if not requested)
+    @param flashcards: Generated flashcards (None if not requested)
+    @param quiz_context: Context of the quiz generation
+    """
+    output_data = {}
+    if flashcards is not None:
+        output_data.update(flashcards.to_dict())
+    if quiz is not None:
+        output_data.update(quiz.to_dict())
+    output_data["quizContext"] = quiz_context
+    return output_data
+
+def generate_output_data(quiz_config,
+                         generate_quiz,
+                         generate_flashcards,
+                         result_cache=None,
+                         progress_callback=None):
+    """
+    Generates quiz and flashcards for a parsed request and builds the response data. When a result
+    cache is given, identical requests skip generation and only get their questions shuffled again.
+
+    @param quiz_config: QuizConfig on which input data has been parsed
+    @param generate_quiz: Whether to generate the quiz
+    @param generate_flashcards: Whether to generate the flashcards
+    @param result_cache: Result cache backend (no memoization if None)
+    @param progress_callback: Function called with the generation progress dictionnary when it changes
+    """
+    if result_cache is not None:
+        cache_key = build_result_cache_key(quiz_config, generate_quiz=generate_quiz, generate_flashcards=generate_flashcards)
+        cached_result = result_cache.get(cache_key)
+        if cached_result is not None:
+            print("Reusing cached result for identical request")
+            quiz = Quiz.parse_raw(cached_result["quiz"]) if cached_result["quiz"] is not None else None
+            flashcards = FlashCards.parse_raw(cached_result["flashcards"]) if cached_result["flashcards"] is not None else None
+            if quiz is not None:
+                quiz.randomize()
+            return build_output_data(quiz, flashcards, {**cached_result["quizContext"], "resultCacheHit": True})
+    # Parsing document and generating flashcards and quiz concurrently
+    quiz_generator = QuizGenerator(**quiz_config.__dict__, progress_callback=progress_callback)
+    quiz, flashcards = quiz_generator.generate_quiz_and_flashcards(generate_quiz=generate_quiz,
+                                                                   generate_flashcards=generate_flashcards)
+    quiz_context = quiz_generator.get_context()
+    with quiz_generator.timings.span("serialization"):
+        if result_cache is not None:
+            result_cache.set(cache_key, {
+                "quiz": quiz.json() if quiz is not None else None,
+                "flashcards": flashcards.json() if flashcards is not None else None,
+                "quizContext": quiz_context
+            })
+        output_data = build_output_data(quiz, flashcards, {**quiz_context, "resultCacheHit": False})
+    # Reporting timings again to include serialization
+    output_data["quizContext"]["timings"] = quiz_generator.timings.summary()
+    return output_data
+
+def iter_output_events(quiz_config,
+                       generate_quiz,
+                       generate_flashcards,
+                       result_cache=None):
+    """
+    Parses document of a request and returns an iterator of (event, data) pairs streaming generated
+    items: a "quizName" event, then "question" and "flashcard" events as soon as they are generated,
+    and a final "quizContext" event. The document is parsed before returning so that parsing errors
+    are raised before streaming starts.
+
+    @param quiz_config: QuizConfig on which input data has been parsed
+    @param generate_quiz: Whether to generate the quiz
+    @param generate_flashcards: Whether to generate the flashcards
+    @param result_cache: Result cache backend (no memoization if None)
+    """
+    if result_cache is not None:
+        cache_key = build_result_cache_key(quiz_config, generate_quiz=generate_quiz, generate_flashcards=generate_flashcards)
+        cached_result = result_cache.get(cache_key)
+        if cached_result is not None:
+            print("Reusing cached result for identical request")
+            return iter_cached_events(cached_result)
+    quiz_generator = QuizGenerator(**quiz_config.__dict__)
+
+    def iter_events():
+        quiz_parts, flashcards_parts = [], []
+        for kind, part in quiz_generator.iter_quiz_and_flashcards_parts(generate_quiz=generate_quiz,
+                                                                        generate_flashcards=generate_flashcards):
+            if kind == "quiz":
+                if not quiz_parts:
+                    yield "quizName", {"quizName": part.quiz_name}
+                quiz_parts.append(part)
+                for question in part.questions:
+                    question.randomize()
+                    yield "question", question.to_dict()
+            else:
+                flashcards_parts.append(part)
+                for flashcard in part.flashcards:
+                    yield "flashcard", flashcard.to_dict()
+        quiz_context = quiz_generator.get_context()
+        if result_cache is not None:
+            result_cache.set(cache_key, {
+                "quiz": Quiz.concat(quiz_parts).json() if generate_quiz else None,
+                "flashcards": FlashCards.concat(flashcards_parts).json() if generate_flashcards else None,
+                "quizContext": quiz_context
+            })
+        yield "quizContext", {**quiz_context, "resultCacheHit": False}
+
+    return iter_events()
+
+def iter_cached_events(cached_result):
+    """
+    Yields the (event, data) pairs of a cached result, questions being shuffled again
+
+    @param cached_result: Result stored in result cache
+    """
+    quiz = Quiz.parse_raw(cached_result["quiz"]) if cached_result["quiz"] is not None else None
+    flashcards = FlashCards.parse_raw(cached_result["flashcards"]) if cached_result["flashcards"] is not None else None
+    if quiz is not None:
+        quiz.randomize()
+    yield from iter_result_events(quiz, flashcards, {**cached_result["quizContext"], "resultCacheHit": True})
+
+def iter_result_events(quiz,
+                       flashcards,
+                       quiz_context):
+    """
+    Yields the (event, data) pairs of an already generated result
+
+    @param quiz: Quiz of the result (None if not requested)
+    @param flashcards: Flashcards of the result (None if not requested)
+    @param quiz_context: Context of the result
+    """
+    if quiz is not None:
+        yield "quizName", {"quizName": quiz.quiz_name}
+        for question in quiz.questions:
+            yield "question", question.to_dict()
+    if flashcards is not None:
+        for flashcard in flashcards.flashcards:
+            yield "flashcard", flashcard.to_dict()
+    yield "quizContext", quiz_context
+
+def sample_output_data(quiz_config,
+                       question_bank,
+                       generate_quiz,
+                       generate_flashcards,
+                       build_callback=None):
+    """
+    Samples the quiz of a request from the question bank of its document, without LLM call. Returns a
+    (quiz, flashcards, quiz_context) tuple, quiz_context holding the bank statistics, where quiz and
+    flashcards are None when the bank does not hold enough items yet. When the bank is empty or runs low,
+    build_callback is called to fill it in background (once per bank at a time).
+
+    @param quiz_config: QuizConfig on which input data has been parsed
+    @param question_bank: QuestionBank of the documents
+    @param generate_quiz: Whether the quiz is requested
+    @param generate_flashcards: Whether the flashcards are requested
+    @param build_callback: Function queueing the build of the bank (no build if None)
+    """
+    timings = Timings()
+    bank_key = build_question_bank_key(quiz_config)
+    with timings.span("question_bank_sampling"):
+        sample = question_bank.sample(bank_key,
+                                      num_questions=quiz_config.num_questions if generate_quiz else 0,
+                                      with_flashcards=generate_flashcards)
+        quiz, flashcards = sample.pop("quiz"), sample.pop("flashcards")
+        if quiz is not None:
+            quiz.randomize()
+    sample["buildQueued"] = False
+    if build_callback is not None and (not sample["hit"] or sample["freshQuestions"] < question_bank.low_watermark):
+        if question_bank.claim_build(bank_key):
+            try:
+                build_callback()
+            except Exception:
+                question_bank.release_build(bank_key)
+                raise
+            sample["buildQueued"] = True
+    quiz_context = {
+        "questionBank": sample,
+        "generationModelName": quiz_config.llm.model_name,
+        "embeddingModelName": quiz_config.embedding_model.model,
+        "timings": timings.summary(),
+        "tokens": {"prompts": 0, "responses": 0, "embeddings": 0, "total": 0},
+        "costs": {"prompts": "0.000000 $", "responses": "0.000000 $", "embeddings": "0.000000 $", "total": "0.000000 $"},
+        "resultCacheHit": False
+    }
+    return quiz, flashcards, quiz_context
+
+def fill_question_bank(quiz_config,
+                       question_bank,
+                       progress_callback=None):
+    """
+    Generates questions on the document of a request and adds them to its question bank, with its
+    flashcards if none were banked yet. Questions are allocated to the chunks having the fewest banked
+    questions (every chunk of the document, without retrieval) and near duplicates of banked questions
+    are dropped. Returns the build statistics and the generation context.
+
+    @param quiz_config: QuizConfig on which input data has been parsed
+    @param question_bank: QuestionBank of the documents
+    @param progress_callback: Function called with the generation progress dictionnary when it changes
+    """
+    bank_key = build_question_bank_key(quiz_config)
+    try:
+        # Every chunk gets questions, the bank does not need the retrieval vector store nor the document state
+        quiz_generator = QuizGenerator(**{**quiz_config.__dict__, "num_questions": 0, "document_state_path": None},
+                                       progress_callback=progress_callback)
+        text_chunks = quiz_generator.text_document.text_chunks
+        chunk_counts = question_bank.get_chunk_counts(bank_key)
+        allocation = allocate_questions(chunk_counts,
+                                        nb_chunks=len(text_chunks),
+                                        num_questions=question_bank.top_up_size if chunk_counts else question_bank.size)
+        chunk_indices = [index for index, num_questions in enumerate(allocation) if num_questions > 0]
+        generate_flashcards = not question_bank.has_flashcards(bank_key)
+        quiz, flashcards = quiz_generator.generate_quiz_and_flashcards(generate_quiz=True,
+                                                                       generate_flashcards=generate_flashcards,
+                                                                       question_requests=[(allocation[index], text_chunks[index]) for index in chunk_indices])
+        # Indexing questions by embedding of their text to drop near duplicates
+        texts = [question.question for question in quiz.questions]
+        with quiz_generator.timings.span("question_embedding"):
+            embeddings = quiz_config.embedding_scheduler.run(quiz_config.embedding_model.embed_documents, texts,
+                                                             nb_tokens=sum(estimate_tokens(text) for text in texts),
+                                                             priority=quiz_config.priority) if texts else []
+        with quiz_generator.tokens_lock:
+            quiz_generator.embeddings_tokens += sum(count_tokens_many(texts, quiz_generator.embedding_model_name))
+        # Question chunk indices are positions in the question requests
+        added = question_bank.add_questions(bank_key,
+                                            [(chunk_indices[question.chunk_index], question.dict(exclude={"chunk_index"})) for question in quiz.questions],
+                                            embeddings,
+                                            quiz_name=quiz.quiz_name,
+                                            nb_chunks=len(text_chunks))
+        if flashcards is not None:
+            question_bank.add_flashcards(bank_key, [(flashcard.chunk_index, flashcard.dict(exclude={"chunk_index"})) for flashcard in flashcards.flashcards])
+    finally:
+        question_bank.release_build(bank_key)
+    print(f"Added {added} questions to question bank ({len(quiz.questions) - added} near duplicates dropped)")
+    return {
+        "questionBank": {"generatedQuestions": len(quiz.questions),
+                         "addedQuestions": added,
+                         "addedFlashcards": len(flashcards.flashcards) if flashcards is not None else 0},
+        "quizContext": quiz_generator.get_context()
+    }
@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import heapq
+import random
+import sqlite3
+from contextlib import contextmanager
+
+from src.quiz import Quiz, MCQuestion, FlashCards, FlashCard
+from src.result_cache import hash_content
+
+
+def build_question_bank_key(quiz_config):
+    """
+    Builds the question bank key of a request from the document content hash and the settings the
+    generated questions depend on (not from the number of questions, sampled from the bank)
+
+    @param quiz_config: QuizConfig on which input data has been parsed
+    """
+    key_data = {
+        "text_content": hash_content(getattr(quiz_config, "text_content", None)),
+        "url": getattr(quiz_config, "url", None),
+        "pdf_file": hash_content(getattr(quiz_config, "pdf_file", None)),
+        "num_choices": quiz_config.num_choices,
+        "model_name": quiz_config.llm.model_name,
+        "embedding_model_name": quiz_config.embedding_model.model,
+        "chunk_size": quiz_config.chunk_size,
+        "chunk_overlap": quiz_config.chunk_overlap,
+        "question_prompt_template": hash_content(quiz_config.question_prompt_template),
+        "flashcards_prompt_template": hash_content(quiz_config.flashcards_prompt_template),
+        "packed_question_prompt_template": hash_content(quiz_config.packed_question_prompt_template),
+        "packed_flashcards_prompt_template": hash_content(quiz_config.packed_flashcards_prompt_template)
+    }
+    return hash_content(json.dumps(key_data, sort_keys=True))
+
+def allocate_questions(chunk_counts,
+                       nb_chunks,
+                       num_questions):
+    """
+    Distributes questions to generate among the chunks of a document, giving each question to the chunk
+    with the fewest questions (banked and already allocated), so that the bank covers the whole document
+
+    @param chunk_counts: Number of banked questions by chunk index
+    @param nb_chunks: Number of chunks of the document
+    @param num_questions: Number of questions to distribute
+    """
+    allocation = [0] * nb_chunks
+    heap = [(chunk_counts.get(index, 0), index) for index in range(nb_chunks)]
+    heapq.heapify(heap)
+    for _ in range(num_questions if nb_chunks > 0 else 0):
+        count, index = heapq.heappop(heap)
+        allocation[index] += 1
+        heapq.heappush(heap, (count + 1, index))
+    return allocation
+
+
+class QuestionBank():
+    def __init__(self,
+                 path,
+                 size=200,
+                 top_up_size=100,
+                 max_serves=20,
+                 low_watermark=50,
+                 duplicate_threshold=0.95,
+                 build_stale_after=1800):
+        """
+        Pools of questions and flashcards generated once per document and sampled by later requests
+        without LLM call, stored in a SQLite database (can be shared by several processes). Questions are
+        indexed by source chunk and by the embedding of their text, used to drop near duplicates. A bank
+        runs low when too few of its questions were served less than max_serves times, it is then topped
+        up in background.
+
+        @param path: Path of the SQLite database file
+        @param size: Number of questions generated when a bank is built
+        @param top_up_size: Number of questions generated when a bank is topped up
+        @param max_serves: Number of times a question is served before it no longer counts as fresh
+        @param low_watermark: Number of fresh questions below which a bank is topped up
+        @param duplicate_threshold: Cosine similarity above which a generated question duplicates a banked one
+        @param build_stale_after: Number of seconds after which an unfinished build no longer blocks a new one
+        """
+        self.path = path
+        self.size = size
+        self.top_up_size = top_up_size
+        self.max_serves = max_serves
+        self.low_watermark = low_watermark
+        self.duplicate_threshold = duplicate_threshold
+        self.build_stale_after = build_stale_after
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS banks (
+                    key TEXT PRIMARY KEY,
+                    quiz_name TEXT,
+                    nb_chunks INTEGER,
+                    building_since REAL,
+                    updated_at REAL
+                )
+            """)
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS questions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    bank TEXT,
+                    chunk_index INTEGER,
+                    question TEXT,
+                    embedding BLOB,
+                    serves INTEGER DEFAULT 0
+                )
+            """)
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS flashcards (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    bank TEXT,
+                    chunk_index INTEGER,
+                    flashcard TEXT
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS questions_bank ON questions (bank, chunk_index)")
+            connection.execute("CREATE INDEX IF NOT EXISTS flashcards_bank ON flashcards (bank, chunk_index)")
+
+    @contextmanager
+    def connect(self):
+        """
+        Opens a new connection to the database (one per call to stay thread-safe) and commits on exit
+        """
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            yield connection
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def sample(self,
+               key,
+               num_questions,
+               with_flashcards=False):
+        """
+        Samples questions from a bank, stratified by chunk: chunks are split in contiguous strata, one per
+        question, and each question comes from the least served chunk of its stratum, so that coverage
+        stays spread over the document. Returns a dictionnary with the sampled quiz and flashcards (None
+        when the bank does not hold enough questions or holds no flashcards) and the bank statistics.
+
+        @param key: Question bank key of the document
+        @param num_questions: Number of questions to sample
+        @param with_flashcards: Whether to return the banked flashcards
+        """
+        with self.connect() as connection:
+            bank = connection.execute("SELECT quiz_name FROM banks WHERE key = ?", (key,)).fetchone()
+            rows = connection.execute("SELECT id, chunk_index, serves FROM questions WHERE bank = ?", (key,)).fetchall()
+            nb_flashcards = connection.execute("SELECT COUNT(*) FROM flashcards WHERE bank = ?", (key,)).fetchone()[0]
+            stats = {"bankedQuestions": len(rows), "freshQuestions": sum(1 for _, _, serves in rows if serves < self.max_serves),
+                     "bankedFlashcards": nb_flashcards}
+            if len(rows) < num_questions or (with_flashcards and nb_flashcards == 0) or (num_questions == 0 and not with_flashcards):
+                return {"quiz": None, "flashcards": None, "hit": False, **stats}
+            # Least served questions of each chunk first, in random order among equally served questions
+            chunk_questions = {}
+            for question_id, chunk_index, serves in rows:
+                chunk_questions.setdefault(chunk_index, []).append((serves, random.random(), question_id))
+            for questions in chunk_questions.values():
+                questions.sort()
+            selected = []
+            while len(selected) < num_questions:
+                chunks = sorted(chunk_index for chunk_index, questions in chunk_questions.items() if questions)
+                needed = num_questions - len(selected)
+                if len(chunks) > needed:
+                    bounds = [round(i * len(chunks) / needed) for i in range(needed + 1)]
+                    chunks = [min(chunks[bounds[i]:bounds[i + 1]], key=lambda chunk_index: chunk_questions[chunk_index][0][:2])
+                              for i in range(needed)]
+                for chunk_index in chunks:
+                    serves, _, question_id = chunk_questions[chunk_index].pop(0)
+                    selected.append((question_id, chunk_index, serves))
+            quiz = None
+            if selected:
+                ids = [question_id for question_id, _, _ in selected]
+                placeholders = ",".join("?" * len(ids))
+                questions = dict(connection.execute(f"SELECT id, question FROM questions WHERE id IN ({placeholders})", ids).fetchall())
+                connection.execute(f"UPDATE questions SET serves = serves + 1 WHERE id IN ({placeholders})", ids)
+                quiz = Quiz.construct(questions=[MCQuestion(**json.loads(questions[question_id]), chunk_index=chunk_index)
+                                                 for question_id, chunk_index, _ in selected],
+                                      quiz_name=bank[0] or Quiz.__fields__["quiz_name"].default)
+                stats["freshQuestions"] -= sum(1 for _, _, serves in selected if serves == self.max_serves - 1)
+            flashcards = None
+            if with_flashcards:
+                rows = connection.execute("SELECT chunk_index, flashcard FROM flashcards WHERE bank = ? ORDER BY chunk_index, id", (key,)).fetchall()
+                flashcards = FlashCards.construct(flashcards=[FlashCard(**json.loads(flashcard), chunk_index=chunk_index)
+                                                              for chunk_index, flashcard in rows])
+        return {"quiz": quiz, "flashcards": flashcards, "hit": True, "sampledChunks": len(set(chunk_index for _, chunk_index, _ in selected)), **stats}
+
+    def get_chunk_counts(self,
+                         key):
+        """
+        Returns the number of banked questions by chunk index
+
+        @param key: Question bank key of the document
+        """
+        with self.connect() as connection:
+            rows = connection.execute("SELECT chunk_index, COUNT(*) FROM questions WHERE bank = ? GROUP BY chunk_index", (key,)).fetchall()
+        return dict(rows)
+
+    def has_flashcards(self,
+                       key):
+        """
+        Returns whether flashcards were banked for a document
+
+        @param key: Question bank key of the document
+        """
+        with self.connect() as connection:
+            return connection.execute("SELECT 1 FROM flashcards WHERE bank = ? LIMIT 1", (key,)).fetchone() is not None
+
+    def claim_build(self,
+                    key):
+        """
+        Marks a bank as being built and returns True, or returns False if another build of the bank is
+        running, so that a single build of each bank is queued at a time
+
+        @param key: Question bank key of the document
+        """
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute("INSERT OR IGNORE INTO banks (key, updated_at) VALUES (?, ?)", (key, now))
+            cursor = connection.execute("UPDATE banks SET building_since = ? WHERE key = ? AND (building_since IS NULL OR building_since < ?)",
+                                        (now, key, now - self.build_stale_after))
+        return cursor.rowcount > 0
+
+    def release_build(self,
+                      key):
+        """
+        Marks the build of a bank as finished
+
+        @param key: Question bank key of the document
+        """
+        with self.connect() as connection:
+            connection.execute("UPDATE banks SET building_since = NULL, updated_at = ? WHERE key = ?", (time.time(), key))
+
+    def add_questions(self,
+                      key,
+                      questions,
+                      embeddings,
+                      quiz_name=None,
+                      nb_chunks=None):
+        """
+        Adds generated questions to a bank, dropping the ones whose embedding is too similar to a banked
+        question or to a previous question of the batch. Returns the number of added questions.
+
+        @param key: Question bank key of the document
+        @param questions: (chunk index, question dictionnary) pairs
+        @param embeddings: Embeddings of the questions texts
+        @param quiz_name: Name of the quiz generated with the questions
+        @param nb_chunks: Number of chunks of the document
+        """
+        # Importing numpy only when questions are banked (faster cold starts)
+        import numpy as np
+        with self.connect() as connection:
+            added = []
+            if questions:
+                vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(questions), -1)
+                vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                rows = connection.execute("SELECT embedding FROM questions WHERE bank = ?", (key,)).fetchall()
+                if rows:
+                    banked = np.stack([np.frombuffer(embedding, dtype=np.float32) for embedding, in rows])
+                    max_similarities = (banked @ vectors.T).max(axis=0)
+                else:
+                    max_similarities = np.full(len(questions), -1.0)
+                kept = []
+                for i, (chunk_index, question) in enumerate(questions):
+                    if max_similarities[i] > self.duplicate_threshold or (kept and float(np.max(vectors[kept] @ vectors[i])) > self.duplicate_threshold):
+                        continue
+                    kept.append(i)
+                    added.append((key, chunk_index, json.dumps(question), vectors[i].tobytes()))
+            connection.executemany("INSERT INTO questions (bank, chunk_index, question, embedding) VALUES (?, ?, ?, ?)", added)
+            connection.execute("INSERT OR IGNORE INTO banks (key) VALUES (?)", (key,))
+            connection.execute("UPDATE banks SET quiz_name = COALESCE(quiz_name, ?), nb_chunks = COALESCE(?, nb_chunks), updated_at = ? WHERE key = ?",
+                               (quiz_name, nb_chunks, time.time(), key))
+        return len(added)
+
+    def add_flashcards(self,
+                       key,
+                       flashcards):
+        """
+        Adds generated flashcards to a bank
+
+        @param key: Question bank key of the document
+        @param flashcards: (chunk index, flashcard dictionnary) pairs
+        """
+        with self.connect() as connection:
+            connection.executemany("INSERT INTO flashcards (bank, chunk_index, flashcard) VALUES (?, ?, ?)",
+                                   [(key, chunk_index, json.dumps(flashcard)) for chunk_index, flashcard in flashcards])
+
+
+def build_question_bank(path=None,
+                        **settings):
+    """
+    Builds the question bank defined in configuration (None if no path is set)
+
+    @param path: Path of the SQLite database file
+    @param settings: Other settings of QuestionBank
+    """
+    if path is None:
+        return None
+    return QuestionBank(path=path, **settings)
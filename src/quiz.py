@@ -1,5 +1,5 @@
 from langchain_core.pydantic_v1 import BaseModel, Field
-from typing import List
+from typing import List, Optional
 import random
 
 from src.utils import shuffle_with_mapping
@@ -12,6 +12,7 @@ class MCQuestion(BaseModel):
     choices: List[str] = Field(description="List of possible choices for the question.")
     answer_index: int = Field(description="Index of the correct answer to the question.")
     explanation: str = Field(description="Explanation of the correct answer.", default="Default explanation")
+    chunk_index: Optional[int] = Field(description="Number of the content section the question is about, if the content has numbered sections.", default=None)
 
     def to_dict(self):
         return (
@@ -23,6 +24,12 @@ class MCQuestion(BaseModel):
             }
         )
 
+    def randomize(self):
+        # Randomizing order of choices and keeping track of the correct answer
+        shuffled_choices, mapping = shuffle_with_mapping(self.choices)
+        self.choices = shuffled_choices[:]
+        self.answer_index = mapping[self.answer_index]
+
 class Quiz(BaseModel):
     """
     Schema for a quiz containing multiple-choice questions
@@ -31,16 +38,31 @@ class Quiz(BaseModel):
     quiz_name: str = Field(description="Name that describes the quiz", default="Default quiz name")
 
     def __add__(self, other):
-        return Quiz(questions=self.questions + other.questions,
-                    quiz_name=self.quiz_name)
+        return Quiz.concat([self, other])
+
+    @classmethod
+    def concat(cls, quizzes):
+        """
+        Merges quizzes in a single pass without re-validating their questions. The merged quiz is named
+        after the first quiz.
+
+        @param quizzes: Iterable of quizzes to merge
+        """
+        questions = []
+        quiz_name = None
+        for quiz in quizzes:
+            if quiz_name is None:
+                quiz_name = quiz.quiz_name
+            questions.extend(quiz.questions)
+        if quiz_name is None:
+            return cls.construct(questions=questions)
+        return cls.construct(questions=questions, quiz_name=quiz_name)
     
     def to_dict(self):
         return (
             {
                 "quizName": self.quiz_name,
-                "questionCards": [
-                    question.to_dict() for question in self.questions
-                ]                
+                "questionCards": [question.to_dict() for question in self.questions]
             }
         )
     
@@ -48,10 +70,8 @@ class Quiz(BaseModel):
         # Randomizing order of questions
         random.shuffle(self.questions)
         # Randomizing order of choices for each questions
-        for i in range(len(self.questions)):
-            shuffled_choices, mapping = shuffle_with_mapping(self.questions[i].choices)
-            self.questions[i].choices = shuffled_choices[:]  
-            self.questions[i].answer_index = mapping[self.questions[i].answer_index]
+        for question in self.questions:
+            question.randomize()
 
 class FlashCard(BaseModel):
     """
@@ -59,6 +79,10 @@ class FlashCard(BaseModel):
     """
     front: str = Field(description="The front of the card. A term, a notion or a question.")
     back: str = Field(description="The back of the card. A definition, an explanation or an answer.")
+    chunk_index: Optional[int] = Field(description="Number of the content section the flashcard is about, if the content has numbered sections.", default=None)
+
+    def to_dict(self):
+        return {"front": self.front, "back": self.back}
 
 class FlashCards(BaseModel):
     """
@@ -67,11 +91,23 @@ class FlashCards(BaseModel):
     flashcards: List[FlashCard]
 
     def __add__(self, other):
-        return FlashCards(flashcards=self.flashcards + other.flashcards)
+        return FlashCards.concat([self, other])
+
+    @classmethod
+    def concat(cls, flashcards_list):
+        """
+        Merges lists of flashcards in a single pass without re-validating their flashcards
+
+        @param flashcards_list: Iterable of FlashCards to merge
+        """
+        flashcards = []
+        for other in flashcards_list:
+            flashcards.extend(other.flashcards)
+        return cls.construct(flashcards=flashcards)
     
     def to_dict(self):
         return (
             {
-                "flashcards": [flashcard.__dict__ for flashcard in self.flashcards]
+                "flashcards": [flashcard.to_dict() for flashcard in self.flashcards]
             }
         )
\ No newline at end of file
@@ -1,11 +1,23 @@
-from langchain.embeddings import OpenAIEmbeddings
-from langchain_openai import ChatOpenAI
-
+from src.clients import LOCAL_MODEL_PREFIX, get_llm, get_embedding_model
 from src.exception import InvalidInputDataException
-from src.templates import question_prompt_template, flashcards_prompt_template, retrieval_query
+from src.scheduler import get_scheduler
+from src.templates import question_prompt_template, flashcards_prompt_template, retrieval_query, retrieval_queries
+from src.templates import packed_question_prompt_template, packed_flashcards_prompt_template
 from src.utils import load_config
 
-config = load_config()
+# Configuration of input data arguments, loaded on first parsed request
+_input_config = None
+
+
+def get_input_config():
+    """
+    Returns the configuration of input data arguments, reading it on first call
+    """
+    global _input_config
+    if _input_config is None:
+        _input_config = load_config()
+    return _input_config
+
 
 class QuizConfig():
     def __init__(self,
@@ -15,7 +27,37 @@ class QuizConfig():
                  min_text_length,
                  chunk_size,
                  chunk_overlap,
-                 local_vector_store_path):
+                 local_vector_store_path,
+                 max_concurrency=8,
+                 embedding_cache_path=None,
+                 embedding_cache_max_entries=100000,
+                 pdf_extraction_workers=None,
+                 pdf_markdown=True,
+                 index_strategy="auto",
+                 index_metric="l2",
+                 hnsw_min_chunks=5000,
+                 ivfpq_min_chunks=100000,
+                 hnsw_ef_search=64,
+                 ivf_nprobe=16,
+                 retrieval_strategy="query",
+                 mmr_lambda=0.5,
+                 packing_max_tokens=0,
+                 web_connect_timeout=5,
+                 web_read_timeout=30,
+                 web_max_bytes=10000000,
+                 web_cache_path=None,
+                 rate_limits_path=None,
+                 llm_rpm=None,
+                 llm_tpm=None,
+                 embeddings_rpm=None,
+                 embeddings_tpm=None,
+                 scheduler_max_concurrency=32,
+                 scheduler_max_retries=6,
+                 document_state_path=None,
+                 local_embeddings_max_batch_size=64,
+                 local_embeddings_max_wait=0.005,
+                 local_embeddings_threads=None,
+                 local_embeddings_max_length=256):
         # Setting up configuration attrivutes
         self.embedding_batch_size = embedding_batch_size
         self.min_text_length = min_text_length
@@ -23,11 +65,49 @@ class QuizConfig():
         self.chunk_overlap = chunk_overlap
         self.question_prompt_template = question_prompt_template
         self.flashcards_prompt_template = flashcards_prompt_template
+        self.packed_question_prompt_template = packed_question_prompt_template
+        self.packed_flashcards_prompt_template = packed_flashcards_prompt_template
+        self.packing_max_tokens = packing_max_tokens
+        self.web_connect_timeout = web_connect_timeout
+        self.web_read_timeout = web_read_timeout
+        self.web_max_bytes = web_max_bytes
+        self.web_cache_path = web_cache_path
         self.retrieval_query = retrieval_query
+        self.retrieval_queries = retrieval_queries
+        self.retrieval_strategy = retrieval_strategy
+        self.mmr_lambda = mmr_lambda
         self.local_vector_store_path = local_vector_store_path
-        # Building LLM and embeddings models
-        self.llm = ChatOpenAI(model=model_name)
-        self.embedding_model = OpenAIEmbeddings(model=embdeddings_model_name)
+        self.max_concurrency = max_concurrency
+        self.embedding_cache_path = embedding_cache_path
+        self.embedding_cache_max_entries = embedding_cache_max_entries
+        self.pdf_extraction_workers = pdf_extraction_workers
+        self.pdf_markdown = pdf_markdown
+        self.index_strategy = index_strategy
+        self.index_metric = index_metric
+        self.hnsw_min_chunks = hnsw_min_chunks
+        self.ivfpq_min_chunks = ivfpq_min_chunks
+        self.hnsw_ef_search = hnsw_ef_search
+        self.ivf_nprobe = ivf_nprobe
+        # Reusing LLM and embeddings models clients (and their connection pools) across requests
+        self.llm = get_llm(model_name)
+        if embdeddings_model_name.startswith(LOCAL_MODEL_PREFIX):
+            # Local embeddings models batch concurrent requests on CPU and have no provider budgets
+            self.embedding_model = get_embedding_model(embdeddings_model_name, max_batch_size=local_embeddings_max_batch_size,
+                                                       max_wait=local_embeddings_max_wait, num_threads=local_embeddings_threads,
+                                                       max_length=local_embeddings_max_length)
+            embeddings_rpm, embeddings_tpm = None, None
+        else:
+            self.embedding_model = get_embedding_model(embdeddings_model_name)
+        # Sharing requests and tokens budgets of each model across requests (and processes using the same database)
+        self.llm_scheduler = get_scheduler(model_name, rpm=llm_rpm, tpm=llm_tpm, rate_limits_path=rate_limits_path,
+                                           max_concurrency=scheduler_max_concurrency, max_retries=scheduler_max_retries)
+        self.embedding_scheduler = get_scheduler(embdeddings_model_name, rpm=embeddings_rpm, tpm=embeddings_tpm, rate_limits_path=rate_limits_path,
+                                                 max_concurrency=scheduler_max_concurrency, max_retries=scheduler_max_retries)
+        # Requests are interactive unless queued as jobs
+        self.priority = "interactive"
+        # Revised documents are regenerated incrementally when requests give the id of the document
+        self.document_state_path = document_state_path
+        self.document_id = None
     
     def parse_input_data(self,
                          data):
@@ -36,6 +116,7 @@ class QuizConfig():
 
         @param data: Input data to parse into quiz configuration
         """
+        config = get_input_config()
         # Setting up data source arguments
         arg_values = [data.get(arg) for arg in config["query_source_arguments"]]
         if not any([arg_value is not None for arg_value in arg_values]):
@@ -57,3 +138,6 @@ class QuizConfig():
             if not arg_value >= 0:
                 raise InvalidInputDataException(message=f"Argument {arg} must be positive")
             self.__setattr__(arg, arg_value)
+        # Setting up optional id of the document, stable across its versions
+        if data.get("document_id") is not None:
+            self.document_id = str(data["document_id"])
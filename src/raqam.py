@@ -1,23 +1,50 @@
 import os
+import queue
+import itertools
+import threading
 import traceback
-from functools import reduce
+import concurrent.futures
 from tqdm import tqdm
 
-from langchain.prompts import PromptTemplate
+from langchain_core.prompts import PromptTemplate
 
 from src.exception import QuizGenerationException, FlashcardsGenerationException, InvalidInputDataException, NotImplementedException
+from src.exception import GenerationCancelledException
 from src.document import Document
-from src.web_page import WebPage
-from src.pdf import PDFDocument
-from src.vector_store import VectorStore
-from src.quiz import Quiz, FlashCards
-from src.utils import get_questions_distribution, count_tokens
+from src.quiz import Quiz, MCQuestion, FlashCards, FlashCard
+from src.utils import get_questions_distribution, get_proportional_distribution
+from src.tokens import count_tokens, count_tokens_many, estimate_tokens, get_usage_tokens
+from src.concurrency import iter_completed
+from src.clients import FAKE_MODEL_PREFIX, LOCAL_MODEL_PREFIX
+from src.packing import pack_adjacent, format_packed_content, attribute_chunks
+from src.instrumentation import Timings
+from src.scheduler import get_scheduler
 
 model_costs = {
     "gpt-4o-mini": {"input": 0.075, "output": 0.600},
     "text-embedding-3-small": {"input": 0.020}
 }
 
+def get_model_costs(model_name):
+    """
+    Returns the costs (in $ per million tokens) of a model, fake backends costing as the model they replace,
+    local models and unknown models being free
+
+    @param model_name: Name of the model
+    """
+    if model_name.startswith(LOCAL_MODEL_PREFIX):
+        return {"input": 0.0, "output": 0.0}
+    return model_costs.get(model_name[len(FAKE_MODEL_PREFIX):] if model_name.startswith(FAKE_MODEL_PREFIX) else model_name,
+                           {"input": 0.0, "output": 0.0})
+
+def is_cancellation(error):
+    """
+    Returns whether a generation error was caused by its cancellation after another generation failed
+
+    @param error: Error raised by a generation
+    """
+    return isinstance(error, GenerationCancelledException) or isinstance(error.__context__, GenerationCancelledException)
+
 class QuizGenerator():
     def __init__(self,
                  llm,
@@ -36,7 +63,34 @@ class QuizGenerator():
                  youtube_url=None,
                  pdf_file=None,
                  video_file=None,
-                 local_vector_store_path=None):
+                 local_vector_store_path=None,
+                 max_concurrency=8,
+                 embedding_cache_path=None,
+                 embedding_cache_max_entries=100000,
+                 progress_callback=None,
+                 pdf_extraction_workers=None,
+                 pdf_markdown=True,
+                 index_strategy="auto",
+                 index_metric="l2",
+                 hnsw_min_chunks=5000,
+                 ivfpq_min_chunks=100000,
+                 hnsw_ef_search=64,
+                 ivf_nprobe=16,
+                 retrieval_queries=None,
+                 retrieval_strategy="query",
+                 mmr_lambda=0.5,
+                 packed_question_prompt_template=None,
+                 packed_flashcards_prompt_template=None,
+                 packing_max_tokens=0,
+                 web_connect_timeout=5,
+                 web_read_timeout=30,
+                 web_max_bytes=10000000,
+                 web_cache_path=None,
+                 llm_scheduler=None,
+                 embedding_scheduler=None,
+                 priority="interactive",
+                 document_state_path=None,
+                 document_id=None):
         """
         Quiz generator working with retrieval on .pdf embedded content. 
         
@@ -56,11 +110,40 @@ class QuizGenerator():
         @param youtube_url: URL for a youtube video from which to extract content
         @param pdf_filepath: Filepath to .pdf file for which to extract text for quiz generation
         @param video_filepath: Filepath to video file from which to extract content
-        @param local_vector_store_path: Path where to save vector store to avoid multiplying embeddings generation
+        @param local_vector_store_path: Root directory where vector stores are persisted (one namespace per document) to avoid multiplying embeddings generation
+        @param max_concurrency: Maximum number of LLM calls in flight at the same time
+        @param embedding_cache_path: Directory of the persistent embedding cache (no cache if None)
+        @param embedding_cache_max_entries: Maximum number of embeddings kept in the embedding cache
+        @param progress_callback: Function called with the generation progress dictionnary when it changes
+        @param pdf_extraction_workers: Number of processes used to extract pdf pages (all cores if None)
+        @param pdf_markdown: Whether to extract pdf pages as markdown or as plain text (faster)
+        @param index_strategy: Type of FAISS index ("auto", "flat", "hnsw" or "ivfpq")
+        @param index_metric: Search metric of the FAISS index ("l2" or "ip" for cosine on normalized vectors)
+        @param hnsw_min_chunks: Minimum number of chunks for which "auto" index strategy uses an HNSW index
+        @param ivfpq_min_chunks: Minimum number of chunks for which "auto" index strategy uses an IVF-PQ index
+        @param hnsw_ef_search: Size of the HNSW candidates list when searching (recall/latency knob)
+        @param ivf_nprobe: Number of IVF clusters visited per search (recall/latency knob)
+        @param retrieval_queries: Queries used together to extract relevant content with "multi_query" strategy
+        @param retrieval_strategy: Selection of the chunks used for questions: "query" (retrieval query),
+            "multi_query" (retrieval queries), "mmr" or "kmeans" (chunks covering the document)
+        @param mmr_lambda: Trade-off between relevance (1) and diversity (0) of "mmr" selection
+        @param packed_question_prompt_template: Prompt template to use to generate questions on several numbered chunks
+        @param packed_flashcards_prompt_template: Prompt template to use to generate flashcards on several numbered chunks
+        @param packing_max_tokens: Token budget of the content of a LLM call packing adjacent chunks (no packing if 0)
+        @param web_connect_timeout: Number of seconds to wait for the connection to a web page server
+        @param web_read_timeout: Number of seconds to wait between two bytes received from a web page server
+        @param web_max_bytes: Maximum size of a web page in bytes
+        @param web_cache_path: Directory of the on-disk HTTP cache of web pages (no cache if None)
+        @param llm_scheduler: RequestScheduler of the LLM calls (process-wide scheduler of the model if None)
+        @param embedding_scheduler: RequestScheduler of the embedding requests (process-wide scheduler of the model if None)
+        @param priority: Priority lane of the model requests, "interactive" or "bulk" (queued jobs)
+        @param document_state_path: Root directory of the persisted document states used to regenerate revised documents incrementally (no state if None)
+        @param document_id: Id of the document stable across its versions (no document state if None)
         """
         # Setting-up class attributes
-        self.quiz_llm = llm.with_structured_output(schema=Quiz)
-        self.flaschards_llm = llm.with_structured_output(schema=FlashCards)
+        # Raw messages are kept to read the token usage reported by the provider
+        self.quiz_llm = llm.with_structured_output(schema=Quiz, include_raw=True)
+        self.flaschards_llm = llm.with_structured_output(schema=FlashCards, include_raw=True)
         self.embedding_model = embedding_model
         self.embedding_batch_size = embedding_batch_size
         self.min_text_length = min_text_length
@@ -77,61 +160,178 @@ class QuizGenerator():
         self.pdf_file = pdf_file
         self.video_file = video_file
         self.local_vector_store_path = local_vector_store_path
+        self.max_concurrency = max_concurrency
+        self.embedding_cache_path = embedding_cache_path
+        self.embedding_cache_max_entries = embedding_cache_max_entries
+        self.pdf_extraction_workers = pdf_extraction_workers
+        self.pdf_markdown = pdf_markdown
+        self.index_strategy = index_strategy
+        self.index_metric = index_metric
+        self.hnsw_min_chunks = hnsw_min_chunks
+        self.ivfpq_min_chunks = ivfpq_min_chunks
+        self.hnsw_ef_search = hnsw_ef_search
+        self.ivf_nprobe = ivf_nprobe
+        self.retrieval_queries = retrieval_queries
+        self.retrieval_strategy = retrieval_strategy
+        self.mmr_lambda = mmr_lambda
+        self.packed_question_prompt_template = packed_question_prompt_template
+        self.packed_flashcards_prompt_template = packed_flashcards_prompt_template
+        self.packing_max_tokens = packing_max_tokens if packed_question_prompt_template and packed_flashcards_prompt_template else 0
+        self.web_connect_timeout = web_connect_timeout
+        self.web_read_timeout = web_read_timeout
+        self.web_max_bytes = web_max_bytes
+        self.web_cache_path = web_cache_path
+        # Sharing rate limits, adaptive concurrency and retries of model requests with other generations
+        self.llm_scheduler = llm_scheduler if llm_scheduler is not None else get_scheduler(llm.model_name)
+        self.embedding_scheduler = embedding_scheduler
+        self.priority = priority
+        self.document_state_path = document_state_path
+        self.document_id = document_id
+        # Bounding LLM calls in flight (shared by quiz and flashcards generation) and stopping on first failure
+        self.llm_semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.stop_event = threading.Event()
+        self.tokens_lock = threading.Lock()
         # Saving generation data
         self.model_name = llm.model_name
         self.embedding_model_name = embedding_model.model
         self.prompts_tokens = 0
         self.responses_tokens = 0
         self.embeddings_tokens = 0
+        self.packing = {"chunkRequests": 0, "llmRequests": 0, "savedPromptTokens": 0}
+        self.progress_callback = progress_callback
+        self.progress = {"nbChunks": 0, "chunksEmbedded": 0, "questionsGenerated": 0, "flashcardsGenerated": 0}
+        self.timings = Timings()
         # Building text document from input sources (text content > url > pdf filepath)
-        self.build_text_document()
-        # Performing embedding on text document's text chunks if necessary (will be None if only one chunk)
+        with self.timings.span("build_text_document"):
+            self.build_text_document()
+        # Diffing chunks against the previous version of the document (if any)
+        self.document_state = self.load_document_state()
+        # Performing embedding on text document's text chunks if necessary (will be None if only one chunk),
+        # chunks being embedded while the document is still being extracted and split
         self.vector_store = self.create_vector_store()
+        self.update_progress(nbChunks=len(self.text_document.text_chunks))
+
+    def get_sources(self):
+        """
+        Returns the (content_source, name, value) tuples of every input source (a source argument being
+        a single value or a list of values), in text content > url > pdf file order. The name of a
+        source is saved in chunks metadata.
+        """
+        sources_arguments = [("text", "text_content"), ("web_page", "url"), ("youtube", "youtube_url"),
+                             ("pdf_file", "pdf_file"), ("video", "video_file")]
+        sources = []
+        for content_source, arg in sources_arguments:
+            values = getattr(self, arg)
+            values = values if isinstance(values, (list, tuple)) else [values]
+            values = [value for value in values if value is not None and (os.path.getsize(value) > 0 if isinstance(value, os.PathLike) else len(value) > 0)]
+            for i, value in enumerate(values):
+                sources.append((content_source, value if arg == "url" else f"{arg}[{i}]", value))
+        if len(sources) == 1:
+            # Keeping the content source as name of a single source
+            sources = [(content_source, content_source, value) for content_source, _, value in sources]
+        return sources
+
+    def extract_source(self,
+                       content_source,
+                       value,
+                       pdf_extraction_workers=None):
+        """
+        Returns the texts (or iterator of texts) extracted from a source
+
+        @param content_source: Type of source ("text", "web_page", "pdf_file", ...)
+        @param value: Value of the source argument (text, url, pdf file path or bytes, ...)
+        @param pdf_extraction_workers: Number of processes used to extract pdf pages (all cores if None)
+        """
+        if content_source == "text":
+            return [value]
+        if content_source == "web_page":
+            # Importing source specific dependencies only when needed (faster cold starts)
+            from src.web_page import WebPage
+            web_page = WebPage(url=value,
+                               connect_timeout=self.web_connect_timeout,
+                               read_timeout=self.web_read_timeout,
+                               max_bytes=self.web_max_bytes,
+                               cache_path=self.web_cache_path)
+            return [web_page.extract_text()]
+        if content_source == "pdf_file":
+            from src.pdf import PDFDocument
+            pdf_document = PDFDocument(pdf_file=value,
+                                       num_workers=pdf_extraction_workers,
+                                       markdown=self.pdf_markdown)
+            return pdf_document.iter_pages()
+        raise NotImplementedException()
 
     def build_text_document(self):
         """
-        Builds text document from input sources (text content > url > pdf filepath) 
+        Builds text document from input sources. A single source is chunked while it is extracted, several
+        sources are fetched and extracted concurrently (pdf pages being extracted in processes) and merged
+        in one document.
         """
-        sources_arguments = ["text_content", "url", "youtube_url", "pdf_file", "video_file"]
-        if not any([arg_value is not None for arg_value in sources_arguments]):
+        sources = self.get_sources()
+        if not sources:
             raise InvalidInputDataException(message=f"Must provide at least one data source argument")
-        if self.text_content is not None:
-            text_contents = [self.text_content]
-            self.content_source = "text"
-        elif self.url is not None:
-            web_page = WebPage(url=self.url)
-            text_contents = [web_page.extract_text()]
-            self.content_source = "web_page"
-        elif self.youtube_url is not None:
-            raise NotImplementedException()
-        elif self.pdf_file is not None:
-            pdf_document = PDFDocument(pdf_file=self.pdf_file)
-            text_contents = [pdf_document.extract_text()]
-            self.content_source = "pdf_file"
-        elif self.video_file is not None:
-            raise NotImplementedException()            
-        # Building text document from extracted text content
-        self.text_document = Document(text_data=text_contents, chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+        self.sources = [(content_source, name) for content_source, name, _ in sources]
+        content_sources = set(content_source for content_source, _, _ in sources)
+        self.content_source = content_sources.pop() if len(content_sources) == 1 else "multiple_sources"
+        if len(sources) == 1:
+            content_source, name, value = sources[0]
+            # Splitting each page on its own while next pages are still being extracted
+            text_contents = self.extract_source(content_source, value, pdf_extraction_workers=self.pdf_extraction_workers)
+        else:
+            # Sharing extraction processes among pdf files extracted at the same time
+            nb_pdf_files = sum(1 for content_source, _, _ in sources if content_source == "pdf_file")
+            pdf_extraction_workers = max(1, (self.pdf_extraction_workers or os.cpu_count() or 1) // max(1, nb_pdf_files))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(sources), self.max_concurrency)) as executor:
+                extracted_texts = list(executor.map(lambda source: list(self.extract_source(source[0], source[2], pdf_extraction_workers)), sources))
+            text_contents = [(name, text) for (_, name, _), texts in zip(sources, extracted_texts) for text in texts]
+        # Building text document from extracted text content (lazily extracted sources are extracted and split
+        # as the chunks of the document are consumed)
+        self.text_document = Document(text_data=text_contents, chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap,
+                                      source=self.content_source)
 
     
+    def update_progress(self,
+                        increment=False,
+                        **progress):
+        """
+        Updates generation progress (thread-safe) and reports it to the progress callback
+
+        @param increment: Whether to add progress values to the current ones instead of replacing them
+        @param progress: Progress values to update (nbChunks, chunksEmbedded, questionsGenerated, flashcardsGenerated)
+        """
+        with self.tokens_lock:
+            for key, value in progress.items():
+                self.progress[key] = self.progress[key] + value if increment else value
+            progress = dict(self.progress)
+        if self.progress_callback is not None:
+            self.progress_callback(progress)
+
     def get_context(self):
         """
         Builds a dictionnary containing informations about quiz generation        
         """
         # Calculating costs foe every request on api
-        self.prompts_cost = (self.prompts_tokens / 1e6) * model_costs[self.model_name]["input"]
-        self.responses_cost = (self.responses_tokens / 1e6) * model_costs[self.model_name]["output"]
-        self.embeddings_cost = (self.embeddings_tokens / 1e6) * model_costs[self.embedding_model_name]["input"]
+        self.prompts_cost = (self.prompts_tokens / 1e6) * get_model_costs(self.model_name)["input"]
+        self.responses_cost = (self.responses_tokens / 1e6) * get_model_costs(self.model_name)["output"]
+        self.embeddings_cost = (self.embeddings_tokens / 1e6) * get_model_costs(self.embedding_model_name)["input"]
         self.total_cost = self.prompts_cost + self.responses_cost + self.embeddings_cost
         return {
             "contentSource": self.content_source,
             "contentLength": self.text_document.content_length,
+            "sources": [
+                {"contentSource": content_source, "name": name, "contentLength": self.text_document.source_lengths.get(name, 0)}
+                for content_source, name in self.sources
+            ],
             "chunkSize": self.text_document.chunk_size,
             "chunkOverlap": self.text_document.chunk_overlap,
             "nbChunks": len(self.text_document.text_chunks),
             "generationModelName": self.model_name,
             "embeddingModelName": self.embedding_model_name,
             "hasEmbeddedChunks": self.vector_store is not None,
+            "embeddingCacheHits": self.vector_store.cache_hits if self.vector_store is not None else 0,
+            "packing": {**self.packing, "savedRequests": self.packing["chunkRequests"] - self.packing["llmRequests"]},
+            "incremental": dict(self.document_state.stats) if self.document_state is not None else None,
+            "timings": self.timings.summary(),
             "tokens": {
                 "prompts": self.prompts_tokens,
                 "responses": self.responses_tokens,
@@ -146,25 +346,133 @@ class QuizGenerator():
             }
         }
 
+    def load_document_state(self):
+        """
+        Loads the state of the previous version of the document and diffs the document chunks against it.
+        Returns None when document states are disabled or the request did not give the id of the document
+        (a document is only regenerated incrementally when its caller asks for it).
+        """
+        if not self.document_state_path or not self.document_id:
+            return None
+        # Importing document state dependencies only when needed (faster cold starts)
+        from src.document_state import DocumentState
+        document_state = DocumentState(path=self.document_state_path,
+                                       document_id=self.document_id,
+                                       embedding_settings={"embeddingModel": self.embedding_model_name, "indexMetric": self.index_metric},
+                                       generation_settings={"model": self.model_name,
+                                                            "numChoices": self.num_choices,
+                                                            "questionPromptTemplate": self.question_prompt_template,
+                                                            "flashcardsPromptTemplate": self.flashcards_prompt_template,
+                                                            "packedQuestionPromptTemplate": self.packed_question_prompt_template,
+                                                            "packedFlashcardsPromptTemplate": self.packed_flashcards_prompt_template})
+        self.chunk_hashes = [document_state.hash_chunk(chunk) for chunk in self.text_document.text_chunks]
+        document_state.diff(self.chunk_hashes)
+        return document_state
+
+    def save_document_state(self):
+        """
+        Saves the chunks, embeddings and generated items of this version of the document (if document states are enabled)
+        """
+        if self.document_state is not None:
+            embeddings = self.vector_store.embeddings if self.vector_store is not None else None
+            self.document_state.save(self.chunk_hashes, embeddings=embeddings)
+
     def create_vector_store(self):
         """
         Creates a vector store and performs embedding on document text chunks if necessary               
         """
-        if self.num_questions > 0 and len(self.text_document.text_chunks) > self.num_questions:
+        if self.num_questions <= 0:
+            return None
+        # Splitting the document only until it is known to have more chunks than questions
+        chunks = (chunk.text for chunk in self.text_document.stream_chunks())
+        first_chunks = list(itertools.islice(chunks, self.num_questions + 1))
+        if len(first_chunks) > self.num_questions:
+            # Importing retrieval dependencies only when a vector store is needed (faster cold starts)
+            from src.vector_store import VectorStore
+            from src.embedding_cache import get_embedding_cache
             # Defining vector store and storing text chunks using embedding
+            embedding_cache = None
+            if self.embedding_cache_path:
+                embedding_cache = get_embedding_cache(path=self.embedding_cache_path,
+                                                      model_name=self.embedding_model_name,
+                                                      max_entries=self.embedding_cache_max_entries)
             vector_store = VectorStore(embedding_model=self.embedding_model,
                                        embedding_batch_size=self.embedding_batch_size,
-                                       local_vector_store_path=self.local_vector_store_path)
-            if self.local_vector_store_path is None or not os.path.exists(self.local_vector_store_path):
+                                       local_vector_store_path=self.local_vector_store_path,
+                                       embedding_cache=embedding_cache,
+                                       chunk_size=self.chunk_size,
+                                       chunk_overlap=self.chunk_overlap,
+                                       index_strategy=self.index_strategy,
+                                       index_metric=self.index_metric,
+                                       hnsw_min_chunks=self.hnsw_min_chunks,
+                                       ivfpq_min_chunks=self.ivfpq_min_chunks,
+                                       hnsw_ef_search=self.hnsw_ef_search,
+                                       ivf_nprobe=self.ivf_nprobe,
+                                       timings=self.timings,
+                                       scheduler=self.embedding_scheduler,
+                                       priority=self.priority)
+            # Reusing the persisted vector store of the document if any (one namespace per document)
+            namespace = vector_store.get_namespace(self.text_document.text_chunks) if self.local_vector_store_path else None
+            if namespace is not None and vector_store.load_vector_store(namespace):
+                print("Loading persisted vector store of the document")
+            else:
                 print("Creating embeddings from extracted chunks and storing into vector store")
-                vector_store.add_embedded_chunks(chunks=self.text_document.text_chunks)
-                # Adding input tokens for embedding
-                self.embeddings_tokens += sum([count_tokens(chunk, self.embedding_model_name) for chunk in self.text_document.text_chunks])
-            # Saving vector store in local
-            if self.local_vector_store_path:
-                vector_store.save_vector_store(path=self.local_vector_store_path)
+                # Reusing embeddings of the chunks unchanged since the previous version of the document
+                known_embeddings = self.document_state.get_embeddings(self.chunk_hashes) if self.document_state is not None else None
+                # Embedding the chunks as they are split when the whole document is not needed beforehand
+                embedded_chunks = vector_store.add_embedded_chunks(chunks=itertools.chain(first_chunks, chunks), known_embeddings=known_embeddings)
+                # Adding input tokens for embedding (only chunks that were not found in embedding cache)
+                self.embeddings_tokens += sum(count_tokens_many(embedded_chunks, self.embedding_model_name))
+                # Saving vector store in local
+                if self.local_vector_store_path:
+                    vector_store.save_vector_store(namespace)
+            self.update_progress(chunksEmbedded=len(self.text_document.text_chunks))
             return vector_store
 
+    def invoke_llm(self,
+                   llm,
+                   prompt):
+        """
+        Invokes a LLM through the scheduler of the model while holding one of the max_concurrency slots
+        and adds the call tokens to the generation counters. Calls that start after another generation
+        failed are cancelled.
+
+        @param llm: Langchain structured output runnable to invoke (with raw message included)
+        @param prompt: Formatted prompt to send to the LLM
+        """
+        with self.llm_semaphore:
+            if self.stop_event.is_set():
+                raise GenerationCancelledException()
+            with self.timings.span("llm_call"):
+                output = self.llm_scheduler.run(llm.invoke, prompt, nb_tokens=estimate_tokens(prompt), priority=self.priority)
+        if output["parsing_error"] is not None:
+            raise output["parsing_error"]
+        # Adding generated token for input and output
+        self.add_generation_tokens(prompt=prompt, response=output["parsed"], raw_response=output["raw"])
+        return output["parsed"]
+
+    def add_generation_tokens(self,
+                              prompt,
+                              response,
+                              raw_response=None):
+        """
+        Adds prompt and response tokens of a LLM call to the generation counters (thread-safe). Uses the
+        token usage reported by the provider when available, otherwise tokenizes prompt and response.
+
+        @param prompt: Formatted prompt sent to the LLM
+        @param response: Structured response returned by the LLM
+        @param raw_response: Raw chat message returned by the LLM
+        """
+        usage_tokens = get_usage_tokens(raw_response)
+        if usage_tokens is not None:
+            prompt_tokens, response_tokens = usage_tokens
+        else:
+            prompt_tokens = count_tokens(text=prompt, model=self.model_name)
+            response_tokens = count_tokens(text=response.json(), model=self.model_name)
+        with self.tokens_lock:
+            self.prompts_tokens += prompt_tokens
+            self.responses_tokens += response_tokens
+
     def generate_question(self,
                           content,
                           num_questions=1):
@@ -178,30 +486,179 @@ class QuizGenerator():
         prompt = PromptTemplate(input_variables=["num_questions", "content"], template=self.question_prompt_template)
         formatted_prompt = prompt.format(num_questions=num_questions, content=content)        
         # Generating question using LLM
-        response = self.quiz_llm.invoke(formatted_prompt)
-        # Adding generated token for input and output
-        self.prompts_tokens += count_tokens(text=formatted_prompt, model=self.model_name)
-        self.responses_tokens += count_tokens(text=response.json(), model=self.model_name)
+        response = self.invoke_llm(self.quiz_llm, formatted_prompt)
+        self.update_progress(increment=True, questionsGenerated=len(response.questions))
         return response
 
-    def generate_quiz(self):
+    def generate_questions_on_pack(self,
+                                   pack):
+        """
+        Generates the questions of a pack of adjacent question requests in a single LLM call, each
+        question being attributed to the index of the request content it is about.
+
+        @param pack: List of (index, num_questions, content) question requests
+        """
+        if len(pack) == 1:
+            index, num_questions, content = pack[0]
+            quiz = self.generate_question(content=content, num_questions=num_questions)
+        else:
+            prompt = PromptTemplate(input_variables=["nb_sections", "num_questions", "content"], template=self.packed_question_prompt_template)
+            formatted_prompt = prompt.format(nb_sections=len(pack),
+                                             num_questions=sum(num_questions for _, num_questions, _ in pack),
+                                             content=format_packed_content([content for _, _, content in pack]))
+            quiz = self.invoke_llm(self.quiz_llm, formatted_prompt)
+            self.update_progress(increment=True, questionsGenerated=len(quiz.questions))
+        attribute_chunks(quiz.questions, [index for index, _, _ in pack])
+        if self.document_state is not None:
+            # Recording questions by chunk for the next versions of the document
+            for index, _, content in pack:
+                self.document_state.add_questions(self.document_state.hash_chunk(content),
+                                                  [question.dict(exclude={"chunk_index"}) for question in quiz.questions if question.chunk_index == index],
+                                                  quiz_name=quiz.quiz_name)
+        return quiz
+
+    def pack_requests(self,
+                      contents,
+                      prompt_template,
+                      packed_prompt_template):
+        """
+        Packs adjacent contents into LLM calls under the packing token budget, returns the packs as lists
+        of content indices and adds the prompt template tokens saved by packing to the packing statistics.
+
+        @param contents: Contents for which to generate items
+        @param prompt_template: Prompt template used for a single content
+        @param packed_prompt_template: Prompt template used for several packed contents
+        """
+        if not self.packing_max_tokens:
+            packs = [[index] for index in range(len(contents))]
+        else:
+            packs = pack_adjacent(count_tokens_many(contents, self.model_name), max_tokens=self.packing_max_tokens)
+        # Estimating template overhead saved by sending one template per pack instead of one per content
+        template_tokens, packed_template_tokens = 0, 0
+        if len(packs) < len(contents):
+            template_tokens, packed_template_tokens = count_tokens_many([prompt_template, packed_prompt_template], self.model_name)
+        nb_packed = sum(1 for pack in packs if len(pack) > 1)
+        with self.tokens_lock:
+            self.packing["chunkRequests"] += len(contents)
+            self.packing["llmRequests"] += len(packs)
+            self.packing["savedPromptTokens"] += (len(contents) - len(packs) + nb_packed) * template_tokens - nb_packed * packed_template_tokens
+        return packs
+
+    def find_relevant_chunks(self,
+                             k,
+                             rows=None):
+        """
+        Retrieves k relevant chunks from the vector store with the retrieval strategy
+
+        @param k: Number of chunks to retrieve
+        @param rows: Indices of the chunks among which to retrieve (ex: chunks of a source), all chunks if None
+        """
+        if self.retrieval_strategy in ["mmr", "kmeans"]:
+            return self.vector_store.select_covering_chunks(k=k, strategy=self.retrieval_strategy, mmr_lambda=self.mmr_lambda, rows=rows)
+        if self.retrieval_strategy == "multi_query" and self.retrieval_queries:
+            return self.vector_store.find_relevant_chunks_multi(queries=self.retrieval_queries, k=k, rows=rows)
+        if rows is not None:
+            return self.vector_store.find_relevant_chunks_multi(queries=[self.retrieval_query], k=k, rows=rows)
+        return self.vector_store.find_relevant_chunks(query=self.retrieval_query, k=k)
+
+    def get_source_question_requests(self,
+                                     num_questions,
+                                     chunk_indices=None):
+        """
+        Returns the (num_questions, content) requests generating questions on the chunks of a source
+
+        @param num_questions: Number of questions to generate on the source
+        @param chunk_indices: Indices of the chunks of the source, all chunks if None
+        """
+        if self.vector_store:
+            # Performing retrieval on source chunks to find relevant content for questions
+            k = num_questions if chunk_indices is None else min(num_questions, len(chunk_indices))
+            with self.timings.span("find_relevant_chunks"):
+                relevant_content = [content.page_content for content in self.find_relevant_chunks(k=k, rows=chunk_indices)]
+        elif chunk_indices is None:
+            relevant_content = self.text_document.text_chunks
+        else:
+            relevant_content = [self.text_document.text_chunks[index] for index in chunk_indices]
+        questions_distribution = get_questions_distribution(nb_text_chunks=len(relevant_content), num_questions=num_questions)
+        return [(questions_distribution[i], content) for i, content in enumerate(relevant_content) if questions_distribution[i] > 0]
+
+    def get_question_requests(self):
+        """
+        Returns the (num_questions, content) requests to send to the LLM to generate the quiz. Questions
+        are allocated to sources proportionally to their content length.
+        """
+        if self.vector_store:
+            print(f"Extracting relevant chunks from embedded document ({self.retrieval_strategy} strategy)")
+        source_chunk_indices = self.text_document.get_source_chunk_indices()
+        if len(source_chunk_indices) <= 1:
+            question_requests = self.get_source_question_requests(num_questions=self.num_questions)
+        else:
+            sizes = [self.text_document.source_lengths.get(source, 0) for source in source_chunk_indices]
+            questions_distribution = get_proportional_distribution(sizes=sizes, total=self.num_questions)
+            question_requests = [request
+                                 for chunk_indices, num_questions in zip(source_chunk_indices.values(), questions_distribution) if num_questions > 0
+                                 for request in self.get_source_question_requests(num_questions=num_questions, chunk_indices=chunk_indices)]
+        if self.vector_store and self.vector_store.embedded_queries:
+            # Adding input tokens for queries embedding
+            with self.tokens_lock:
+                self.embeddings_tokens += sum(count_tokens_many(self.vector_store.embedded_queries, self.embedding_model_name))
+            self.vector_store.embedded_queries = []
+        return question_requests
+
+    def iter_quiz_parts(self,
+                        question_requests=None):
+        """
+        Yields (index, Quiz) pairs as soon as each LLM call generating questions completes, index
+        being the position in the question requests of the first content of the pack of adjacent
+        contents. Questions stored for contents unchanged since the previous version of the document
+        are yielded first, without LLM call.
+
+        @param question_requests: (num_questions, content) requests to generate questions on (retrieved with num_questions if None)
+        """
+        if question_requests is None:
+            question_requests = self.get_question_requests()
+        generated_indices = []
+        for index, (num_questions, content) in enumerate(question_requests):
+            questions = self.document_state.get_questions(self.document_state.hash_chunk(content), num_questions) if self.document_state is not None else None
+            if questions is None:
+                generated_indices.append(index)
+                continue
+            quiz = Quiz(questions=[MCQuestion(**question, chunk_index=index) for question in questions],
+                        quiz_name=self.document_state.quiz_name or Quiz.__fields__["quiz_name"].default)
+            self.update_progress(increment=True, questionsGenerated=len(quiz.questions))
+            yield index, quiz
+        packs = self.pack_requests([question_requests[index][1] for index in generated_indices],
+                                   prompt_template=self.question_prompt_template,
+                                   packed_prompt_template=self.packed_question_prompt_template)
+        packs = [[generated_indices[position] for position in pack] for pack in packs]
+        print(f"Generating questions from relevant content in {len(packs)} LLM calls")
+        for position, quiz in tqdm(iter_completed(lambda pack: self.generate_questions_on_pack([(index, *question_requests[index]) for index in pack]),
+                                                  packs, max_concurrency=self.max_concurrency),
+                                   total=len(packs), desc="Generating questions"):
+            yield packs[position][0], quiz
+
+    def iter_quiz(self):
+        """
+        Yields generated multiple choice questions (with shuffled choices) as soon as they are generated
+        """
+        try:
+            for _, quiz in self.iter_quiz_parts():
+                for question in quiz.questions:
+                    question.randomize()
+                    yield question
+        except Exception as e:
+            raise QuizGenerationException(stack_trace=traceback.format_exc())
+
+    def generate_quiz(self,
+                      question_requests=None):
         """
         Generates a quiz on the stored document with prompt template using langchain retrieval chain.
+
+        @param question_requests: (num_questions, content) requests to generate questions on (retrieved with num_questions if None)
         """
-        # Performing retrieval on full document to find relevant content for questions
         try:
-            if self.vector_store:
-                print("Extracting relevant chunks from embedded document")
-                relevant_content = self.vector_store.find_relevant_chunks(query=self.retrieval_query,
-                                                                          k=self.num_questions)
-                # Generating question for each content that has been found
-                print("Generating questions from relevant content")
-                quiz = [self.generate_question(content=content.page_content) for content in tqdm(relevant_content, desc="Generating questions")]
-            else:
-                relevant_content = self.text_document.text_chunks  
-                questions_distribution = get_questions_distribution(nb_text_chunks=len(relevant_content), num_questions=self.num_questions) 
-                quiz = [self.generate_question(num_questions=questions_distribution[i], content=content) for i, content in tqdm(enumerate(relevant_content), desc="Generating questions") if questions_distribution[i] > 0]          
-            quiz = reduce(lambda x, y: x+y, quiz) 
+            # Merging questions in the order of the relevant content
+            quiz = Quiz.concat(quiz for _, quiz in sorted(self.iter_quiz_parts(question_requests), key=lambda part: part[0]))
             # Randomizing questions and choices questions in order to avoid redondancy
             quiz.randomize()
             return quiz       
@@ -218,20 +675,152 @@ class QuizGenerator():
         # Building prompt using prompt template and content
         prompt = PromptTemplate(input_variables=["content"], template=self.flashcards_prompt_template)
         formatted_prompt = prompt.format(content=content)        
-        # Generating question using LLM
-        response = self.flaschards_llm.invoke(formatted_prompt)
-        # Adding generated token for input and output
-        self.prompts_tokens += count_tokens(text=formatted_prompt, model=self.model_name)
-        self.responses_tokens += count_tokens(text=response.json(), model=self.model_name)
+        # Generating flashcards using LLM
+        response = self.invoke_llm(self.flaschards_llm, formatted_prompt)
+        self.update_progress(increment=True, flashcardsGenerated=len(response.flashcards))
         return response        
 
+    def generate_flashcards_on_pack(self,
+                                    pack):
+        """
+        Generates the flashcards of a pack of adjacent chunks in a single LLM call, each flashcard being
+        attributed to the index of the chunk it is about.
+
+        @param pack: Indices of the document chunks of the pack
+        """
+        contents = [self.text_document.text_chunks[index] for index in pack]
+        if len(pack) == 1:
+            flashcards = self.generate_flashcards_on_content(content=contents[0])
+        else:
+            prompt = PromptTemplate(input_variables=["nb_sections", "num_flashcards", "content"], template=self.packed_flashcards_prompt_template)
+            formatted_prompt = prompt.format(nb_sections=len(pack), num_flashcards=4 * len(pack), content=format_packed_content(contents))
+            flashcards = self.invoke_llm(self.flaschards_llm, formatted_prompt)
+            self.update_progress(increment=True, flashcardsGenerated=len(flashcards.flashcards))
+        attribute_chunks(flashcards.flashcards, pack)
+        if self.document_state is not None:
+            # Recording flashcards by chunk for the next versions of the document
+            for index in pack:
+                self.document_state.add_flashcards(self.chunk_hashes[index],
+                                                   [flashcard.dict(exclude={"chunk_index"}) for flashcard in flashcards.flashcards if flashcard.chunk_index == index])
+        return flashcards
+
+    def iter_flashcards_parts(self):
+        """
+        Yields (index, FlashCards) pairs as soon as each LLM call generating flashcards completes, index
+        being the index of the first chunk of the pack of adjacent chunks. Flashcards stored for chunks
+        unchanged since the previous version of the document are yielded first, without LLM call.
+        """
+        generated_indices = []
+        for index in range(len(self.text_document.text_chunks)):
+            stored_flashcards = self.document_state.get_flashcards(self.chunk_hashes[index]) if self.document_state is not None else None
+            if stored_flashcards is None:
+                generated_indices.append(index)
+                continue
+            flashcards = FlashCards(flashcards=[FlashCard(**flashcard, chunk_index=index) for flashcard in stored_flashcards])
+            self.update_progress(increment=True, flashcardsGenerated=len(flashcards.flashcards))
+            yield index, flashcards
+        packs = self.pack_requests([self.text_document.text_chunks[index] for index in generated_indices],
+                                   prompt_template=self.flashcards_prompt_template,
+                                   packed_prompt_template=self.packed_flashcards_prompt_template)
+        packs = [[generated_indices[position] for position in pack] for pack in packs]
+        for position, flashcards in tqdm(iter_completed(self.generate_flashcards_on_pack, packs, max_concurrency=self.max_concurrency),
+                                         total=len(packs), desc="Generating flashcards on content"):
+            yield packs[position][0], flashcards
+
+    def iter_flashcards(self):
+        """
+        Yields generated flashcards as soon as they are generated
+        """
+        try:
+            for _, flashcards in self.iter_flashcards_parts():
+                yield from flashcards.flashcards
+        except Exception as e:
+            raise FlashcardsGenerationException(stack_trace=traceback.format_exc())
+
     def generate_flashcards(self):
         """
         Generates flashcards on the stored document with prompt template.        
         """
         try:
-            flashcards = [self.generate_flashcards_on_content(content=chunk) for chunk in tqdm(self.text_document.text_chunks, desc="Generating flashcards on content")]
-            flashcards = reduce(lambda x,y: x+y, flashcards)
+            # Merging flashcards in the order of the document chunks
+            flashcards = FlashCards.concat(flashcards for _, flashcards in sorted(self.iter_flashcards_parts(), key=lambda part: part[0]))
             return flashcards
         except Exception as e:
-            raise FlashcardsGenerationException(stack_trace=traceback.format_exc())        
+            raise FlashcardsGenerationException(stack_trace=traceback.format_exc())
+
+    def generate_quiz_and_flashcards(self,
+                                     generate_quiz=True,
+                                     generate_flashcards=True,
+                                     question_requests=None):
+        """
+        Generates quiz and flashcards at the same time, LLM calls of both sharing the max_concurrency
+        slots. Returns a (quiz, flashcards) tuple where a non requested output is None.
+
+        @param generate_quiz: Whether to generate the quiz
+        @param generate_flashcards: Whether to generate the flashcards
+        @param question_requests: (num_questions, content) requests to generate questions on (retrieved with num_questions if None)
+        """
+        tasks = {}
+        if generate_quiz:
+            tasks["quiz"] = lambda: self.generate_quiz(question_requests)
+        if generate_flashcards:
+            tasks["flashcards"] = self.generate_flashcards
+        errors = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(tasks))) as executor:
+            futures = {name: executor.submit(task) for name, task in tasks.items()}
+            for future in concurrent.futures.as_completed(futures.values()):
+                if future.exception() is not None:
+                    # Stopping the other generation as soon as one of them failed
+                    self.stop_event.set()
+                    errors.append(future.exception())
+        # Raising the error of the first generation that failed rather than the cancellation of the other one
+        errors = [error for error in errors if not is_cancellation(error)] or errors
+        if errors:
+            raise errors[0]
+        results = {name: future.result() for name, future in futures.items()}
+        self.save_document_state()
+        return results.get("quiz"), results.get("flashcards")
+
+    def iter_quiz_and_flashcards_parts(self,
+                                       generate_quiz=True,
+                                       generate_flashcards=True):
+        """
+        Generates quiz and flashcards at the same time and yields ("quiz", Quiz) and ("flashcards", FlashCards)
+        pairs as soon as each LLM call completes. Generation stops on the first failure.
+
+        @param generate_quiz: Whether to generate the quiz
+        @param generate_flashcards: Whether to generate the flashcards
+        """
+        producers = []
+        if generate_flashcards:
+            producers.append(("flashcards", self.iter_flashcards_parts, FlashcardsGenerationException))
+        if generate_quiz:
+            producers.append(("quiz", self.iter_quiz_parts, QuizGenerationException))
+        parts = queue.Queue()
+        end_of_parts = object()
+
+        def produce(kind, iter_parts, exception_class):
+            try:
+                for _, part in iter_parts():
+                    parts.put((kind, part))
+                parts.put((kind, end_of_parts))
+            except Exception as e:
+                parts.put((kind, exception_class(stack_trace=traceback.format_exc())))
+
+        for producer in producers:
+            threading.Thread(target=produce, args=producer, daemon=True).start()
+        remaining_producers = len(producers)
+        try:
+            while remaining_producers > 0:
+                kind, part = parts.get()
+                if part is end_of_parts:
+                    remaining_producers -= 1
+                elif isinstance(part, Exception):
+                    raise part
+                else:
+                    yield kind, part
+            self.save_document_state()
+        finally:
+            if remaining_producers > 0:
+                # Stopping the other generation after a failure or when the consumer stopped early
+                self.stop_event.set()
@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def hash_content(content):
+    """
+    Returns the sha256 hex digest of a text or bytes content, or of a list of contents (None if no content).
+    Files given by path (uploads spooled to disk) are hashed block by block.
+
+    @param content: Text, bytes or file path content (or list of contents) to hash
+    """
+    if content is None:
+        return None
+    if isinstance(content, os.PathLike):
+        digest = hashlib.sha256()
+        with open(content, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    if isinstance(content, (list, tuple)):
+        content = json.dumps([hash_content(item) for item in content])
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+def build_result_cache_key(quiz_config,
+                           generate_quiz,
+                           generate_flashcards):
+    """
+    Builds the result cache key of a request from the document content hash, the quiz settings,
+    the model names and the prompt templates hashes.
+
+    @param quiz_config: QuizConfig on which input data has been parsed
+    @param generate_quiz: Whether the quiz is requested
+    @param generate_flashcards: Whether the flashcards are requested
+    """
+    key_data = {
+        "text_content": hash_content(getattr(quiz_config, "text_content", None)),
+        "url": getattr(quiz_config, "url", None),
+        "pdf_file": hash_content(getattr(quiz_config, "pdf_file", None)),
+        "num_questions": quiz_config.num_questions,
+        "num_choices": quiz_config.num_choices,
+        "generate_quiz": generate_quiz,
+        "generate_flashcards": generate_flashcards,
+        "model_name": quiz_config.llm.model_name,
+        "embedding_model_name": quiz_config.embedding_model.model,
+        "chunk_size": quiz_config.chunk_size,
+        "chunk_overlap": quiz_config.chunk_overlap,
+        "question_prompt_template": hash_content(quiz_config.question_prompt_template),
+        "flashcards_prompt_template": hash_content(quiz_config.flashcards_prompt_template),
+        "packed_question_prompt_template": hash_content(quiz_config.packed_question_prompt_template),
+        "packed_flashcards_prompt_template": hash_content(quiz_config.packed_flashcards_prompt_template),
+        "packing_max_tokens": quiz_config.packing_max_tokens,
+        "retrieval_query": hash_content(quiz_config.retrieval_query),
+        "retrieval_queries": hash_content(json.dumps(quiz_config.retrieval_queries)),
+        "retrieval_strategy": quiz_config.retrieval_strategy,
+        "mmr_lambda": quiz_config.mmr_lambda
+    }
+    return hash_content(json.dumps(key_data, sort_keys=True))
+
+
+class MemoryResultCache():
+    def __init__(self,
+                 ttl,
+                 max_entries=256):
+        """
+        In-process LRU result cache
+
+        @param ttl: Time to live of cached results in seconds
+        @param max_entries: Maximum number of results kept in cache
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self,
+            key):
+        """
+        Returns the cached result for key, None if missing or expired
+
+        @param key: Result cache key
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return json.loads(value)
+
+    def set(self,
+            key,
+            value):
+        """
+        Stores a result in cache, evicting the least recently used result if the cache is full
+
+        @param key: Result cache key
+        @param value: JSON serializable result to store
+        """
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, json.dumps(value))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class SQLiteResultCache():
+    def __init__(self,
+                 ttl,
+                 path):
+        """
+        On-disk result cache stored in a SQLite database (can be shared by several processes)
+
+        @param ttl: Time to live of cached results in seconds
+        @param path: Path of the SQLite database file
+        """
+        self.ttl = ttl
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, expires_at REAL, value TEXT)")
+
+    @contextmanager
+    def connect(self):
+        """
+        Opens a new connection to the database (one per call to stay thread-safe) and commits on exit
+        """
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self,
+            key):
+        """
+        Returns the cached result for key, None if missing or expired
+
+        @param key: Result cache key
+        """
+        with self.connect() as connection:
+            row = connection.execute("SELECT value FROM results WHERE key = ? AND expires_at >= ?", (key, time.time())).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self,
+            key,
+            value):
+        """
+        Stores a result in cache and purges expired results
+
+        @param key: Result cache key
+        @param value: JSON serializable result to store
+        """
+        with self.connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO results (key, expires_at, value) VALUES (?, ?, ?)",
+                               (key, time.time() + self.ttl, json.dumps(value)))
+            connection.execute("DELETE FROM results WHERE expires_at < ?", (time.time(),))
+
+
+class RedisResultCache():
+    def __init__(self,
+                 ttl,
+                 redis_url):
+        """
+        Result cache stored in a Redis-compatible server (requires the redis package)
+
+        @param ttl: Time to live of cached results in seconds
+        @param redis_url: URL of the Redis-compatible server
+        """
+        import redis
+        self.ttl = ttl
+        self.client = redis.Redis.from_url(redis_url)
+
+    def get(self,
+            key):
+        """
+        Returns the cached result for key, None if missing or expired
+
+        @param key: Result cache key
+        """
+        value = self.client.get(f"raqam:result:{key}")
+        return json.loads(value) if value is not None else None
+
+    def set(self,
+            key,
+            value):
+        """
+        Stores a result in cache with the cache TTL
+
+        @param key: Result cache key
+        @param value: JSON serializable result to store
+        """
+        self.client.set(f"raqam:result:{key}", json.dumps(value), ex=int(self.ttl))
+
+
+def build_result_cache(backend=None,
+                       ttl=86400,
+                       max_entries=256,
+                       path=None,
+                       redis_url=None):
+    """
+    Builds the result cache defined in configuration (None if no backend is set)
+
+    @param backend: Result cache backend (None, "memory", "sqlite" or "redis")
+    @param ttl: Time to live of cached results in seconds
+    @param max_entries: Maximum number of results kept by the memory backend
+    @param path: Path of the database file for the sqlite backend
+    @param redis_url: URL of the server for the redis backend
+    """
+    if backend is None:
+        return None
+    if backend == "memory":
+        return MemoryResultCache(ttl=ttl, max_entries=max_entries)
+    if backend == "sqlite":
+        return SQLiteResultCache(ttl=ttl, path=path)
+    if backend == "redis":
+        return RedisResultCache(ttl=ttl, redis_url=redis_url)
+    raise ValueError(f"Unknown result cache backend {backend}")
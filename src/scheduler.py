@@ -0,0 +1,412 @@
+import os
+import time
+import heapq
+import random
+import sqlite3
+import itertools
+import threading
+from functools import lru_cache
+from contextlib import contextmanager
+
+from src.instrumentation import RETRYABLE_STATUS_CODES
+
+# Rank of the priority lanes, interactive requests being served before bulk jobs
+PRIORITIES = {"interactive": 0, "bulk": 1}
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name,
+                  **settings):
+    """
+    Returns the process-wide scheduler of a model, building it on first use. Calls without settings share
+    the scheduler configured for the model (with default settings until it is configured), calls with other
+    settings than the last ones reconfigure it in place (ex: budgets changed by a custom configuration).
+
+    @param name: Name of the model whose requests are scheduled
+    @param settings: Settings of the scheduler (see RequestScheduler)
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(name)
+        if scheduler is None:
+            scheduler = _schedulers[name] = RequestScheduler(name=name, **settings)
+            scheduler.settings = settings
+        elif settings and settings != scheduler.settings:
+            scheduler.configure(**settings)
+            scheduler.settings = settings
+        return scheduler
+
+@lru_cache(maxsize=None)
+def get_connection_errors():
+    """
+    Returns the errors raised before a response is received (connection failures and timeouts) that are
+    retried, importing the HTTP and OpenAI clients on first failed request only
+    """
+    import httpx
+    try:
+        from openai import APIConnectionError
+    except ImportError:
+        # Fake backends run without the OpenAI client
+        APIConnectionError = ConnectionError
+    return (ConnectionError, TimeoutError, httpx.TransportError, APIConnectionError)
+
+def get_status_code(error):
+    """
+    Returns the HTTP status code of an error raised by a model client (None if the error has no response)
+
+    @param error: Error raised by the model client
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code
+
+def get_retry_after(error):
+    """
+    Returns the number of seconds to wait requested by the Retry-After header of an error response (None if absent)
+
+    @param error: Error raised by the model client
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket():
+    def __init__(self,
+                 name,
+                 rpm=None,
+                 tpm=None,
+                 path=None,
+                 burst_seconds=1.0):
+        """
+        Requests per minute and tokens per minute budgets of a model, refilled continuously. The budgets
+        are stored in a SQLite database when a path is given, so that every process using the same
+        database shares them, otherwise they are kept in the process.
+
+        @param name: Name of the model of the budgets
+        @param rpm: Maximum number of requests per minute (unlimited if None)
+        @param tpm: Maximum number of tokens per minute (unlimited if None)
+        @param path: Path of the SQLite database of the budgets (process-local budgets if None)
+        @param burst_seconds: Number of seconds of budget that can be spent at once (providers enforce
+            per minute limits over shorter periods)
+        """
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.path = path
+        self.max_requests = max(1.0, rpm * burst_seconds / 60) if rpm else None
+        self.max_tokens = max(1.0, tpm * burst_seconds / 60) if tpm else None
+        self.lock = threading.Lock()
+        self.state = {"requests": self.max_requests or 0.0, "tokens": self.max_tokens or 0.0, "updated_at": time.time(), "blocked_until": 0.0}
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self.transaction():
+                pass
+
+    @contextmanager
+    def transaction(self):
+        """
+        Yields the budgets state of the model, written back on exit, while holding the process lock or an
+        exclusive SQLite transaction
+        """
+        if self.path is None:
+            with self.lock:
+                yield self.state
+            return
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, requests REAL, tokens REAL, updated_at REAL, blocked_until REAL)")
+            row = connection.execute("SELECT requests, tokens, updated_at, blocked_until FROM buckets WHERE name = ?", (self.name,)).fetchone()
+            state = dict(zip(["requests", "tokens", "updated_at", "blocked_until"], row)) if row is not None else dict(self.state)
+            yield state
+            connection.execute("INSERT OR REPLACE INTO buckets (name, requests, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?, ?)",
+                               (self.name, state["requests"], state["tokens"], state["updated_at"], state["blocked_until"]))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def try_acquire(self,
+                    nb_tokens):
+        """
+        Takes one request and nb_tokens tokens from the budgets if both are available. Returns 0 when
+        they were taken, otherwise the number of seconds to wait before they are.
+
+        @param nb_tokens: Estimated number of tokens of the request
+        """
+        # A request larger than the tokens burst waits for a full burst
+        nb_tokens = min(nb_tokens, self.max_tokens) if self.tpm else nb_tokens
+        with self.transaction() as state:
+            now = time.time()
+            elapsed = max(0.0, now - state["updated_at"])
+            state["updated_at"] = now
+            if self.rpm:
+                state["requests"] = min(self.max_requests, state["requests"] + elapsed * self.rpm / 60)
+            if self.tpm:
+                state["tokens"] = min(self.max_tokens, state["tokens"] + elapsed * self.tpm / 60)
+            wait = state["blocked_until"] - now
+            if self.rpm and state["requests"] < 1:
+                wait = max(wait, (1 - state["requests"]) * 60 / self.rpm)
+            if self.tpm and state["tokens"] < nb_tokens:
+                wait = max(wait, (nb_tokens - state["tokens"]) * 60 / self.tpm)
+            if wait > 0:
+                return wait
+            if self.rpm:
+                state["requests"] -= 1
+            if self.tpm:
+                state["tokens"] -= nb_tokens
+            return 0
+
+    def block(self,
+              seconds):
+        """
+        Blocks every request of the model for a number of seconds (ex: after a 429 response), in every
+        process sharing the budgets
+
+        @param seconds: Number of seconds during which requests are blocked
+        """
+        with self.transaction() as state:
+            state["blocked_until"] = max(state["blocked_until"], time.time() + seconds)
+
+
+class RequestScheduler():
+    def __init__(self,
+                 name,
+                 rpm=None,
+                 tpm=None,
+                 rate_limits_path=None,
+                 max_concurrency=32,
+                 min_concurrency=1,
+                 latency_target=60.0,
+                 max_retries=6,
+                 base_delay=1.0,
+                 max_delay=60.0):
+        """
+        Schedules the requests of a model: requests wait for the requests and tokens per minute budgets,
+        run within a concurrency limit adapted AIMD-style (additive increase on fast successes, halved on
+        429 responses, lowered when latency exceeds the target) and are retried with jittered exponential
+        backoff on rate limits, server errors and connection failures. Waiting interactive requests are
+        admitted before bulk ones.
+
+        @param name: Name of the model whose requests are scheduled
+        @param rpm: Maximum number of requests per minute (unlimited if None)
+        @param tpm: Maximum number of tokens per minute (unlimited if None)
+        @param rate_limits_path: Path of the SQLite database sharing budgets across processes (process-local if None)
+        @param max_concurrency: Maximum number of requests in flight in the process
+        @param min_concurrency: Minimum number of requests in flight the adaptive limit can go down to
+        @param latency_target: Latency in seconds above which the concurrency limit is lowered
+        @param max_retries: Maximum number of retries of a request
+        @param base_delay: Backoff delay of the first retry in seconds (doubled at each retry)
+        @param max_delay: Maximum backoff delay in seconds
+        """
+        self.name = name
+        # Settings given to get_scheduler (empty for a scheduler with default settings)
+        self.settings = {}
+        # Requests in flight and waiting requests (heap of (priority, sequence))
+        self.in_flight = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.stats = {"requests": 0, "retries": 0, "rateLimited": 0, "throttledSeconds": 0.0}
+        self.configure(rpm=rpm, tpm=tpm, rate_limits_path=rate_limits_path, max_concurrency=max_concurrency, min_concurrency=min_concurrency,
+                       latency_target=latency_target, max_retries=max_retries, base_delay=base_delay, max_delay=max_delay)
+
+    def configure(self,
+                  rpm=None,
+                  tpm=None,
+                  rate_limits_path=None,
+                  max_concurrency=32,
+                  min_concurrency=1,
+                  latency_target=60.0,
+                  max_retries=6,
+                  base_delay=1.0,
+                  max_delay=60.0):
+        """
+        Sets the budgets, concurrency and retry settings of the scheduler (see __init__), resetting its
+        adaptive concurrency limit
+
+        @param rpm: Maximum number of requests per minute (unlimited if None)
+        @param tpm: Maximum number of tokens per minute (unlimited if None)
+        @param rate_limits_path: Path of the SQLite database sharing budgets across processes (process-local if None)
+        @param max_concurrency: Maximum number of requests in flight in the process
+        @param min_concurrency: Minimum number of requests in flight the adaptive limit can go down to
+        @param latency_target: Latency in seconds above which the concurrency limit is lowered
+        @param max_retries: Maximum number of retries of a request
+        @param base_delay: Backoff delay of the first retry in seconds (doubled at each retry)
+        @param max_delay: Maximum backoff delay in seconds
+        """
+        with self.condition:
+            self.bucket = TokenBucket(name=self.name, rpm=rpm, tpm=tpm, path=rate_limits_path) if rpm or tpm else None
+            # Integer settings may be posted as floats by a custom configuration
+            self.max_concurrency = int(max_concurrency)
+            self.min_concurrency = int(min_concurrency)
+            self.latency_target = latency_target
+            self.max_retries = int(max_retries)
+            self.base_delay = base_delay
+            self.max_delay = max_delay
+            # Adaptive concurrency limit
+            self.limit = float(self.max_concurrency)
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self,
+             priority,
+             nb_tokens=0):
+        """
+        Holds one of the concurrency slots once the budgets allow the request. Waiting requests are
+        admitted by priority then arrival order, only the first one waiting for the budgets. The budgets
+        are polled outside of the condition, so that a contended budgets database does not block the
+        requests releasing their slot.
+
+        @param priority: Priority lane of the request ("interactive" or "bulk")
+        @param nb_tokens: Estimated number of tokens of the request (taken from the tokens budget)
+        """
+        ticket = (PRIORITIES.get(priority, 0), next(self.sequence))
+        with self.condition:
+            heapq.heappush(self.waiting, ticket)
+        acquired = False
+        try:
+            while True:
+                with self.condition:
+                    while self.waiting[0] != ticket or self.in_flight >= max(self.min_concurrency, int(self.limit)):
+                        self.condition.wait()
+                    bucket = self.bucket
+                    if acquired or bucket is None:
+                        heapq.heappop(self.waiting)
+                        self.in_flight += 1
+                        # Next waiting request may fit in the limit too
+                        self.condition.notify_all()
+                        break
+                wait = bucket.try_acquire(nb_tokens)
+                if wait <= 0:
+                    # Taking the slot once it is still free (the limit may have been lowered meanwhile)
+                    acquired = True
+                    continue
+                # Polling the shared budgets again at least every second
+                with self.condition:
+                    start = time.perf_counter()
+                    self.condition.wait(min(wait, 1.0))
+                    self.stats["throttledSeconds"] += time.perf_counter() - start
+        except BaseException:
+            # Removing the ticket so that the next waiting requests are not blocked behind it
+            with self.condition:
+                if ticket in self.waiting:
+                    self.waiting.remove(ticket)
+                    heapq.heapify(self.waiting)
+                self.condition.notify_all()
+            raise
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def adapt_limit(self,
+                    latency=None,
+                    rate_limited=False):
+        """
+        Adapts the concurrency limit to the outcome of a request
+
+        @param latency: Latency of a successful request in seconds
+        @param rate_limited: Whether the request was answered 429
+        """
+        with self.condition:
+            if rate_limited:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+            elif latency is not None and latency > self.latency_target:
+                self.limit = max(self.min_concurrency, self.limit * 0.9)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def get_backoff_delay(self,
+                          attempt,
+                          retry_after=None):
+        """
+        Returns the delay before a retry: full jitter exponential backoff, at least the Retry-After delay
+
+        @param attempt: Number of the failed attempt (0 for the first one)
+        @param retry_after: Delay requested by the server in seconds (None if not requested)
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    def is_retryable(self,
+                     error):
+        """
+        Returns whether a failed request is retried
+
+        @param error: Error raised by the request
+        """
+        return get_status_code(error) in RETRYABLE_STATUS_CODES or isinstance(error, get_connection_errors())
+
+    def run(self,
+            func,
+            *args,
+            nb_tokens=0,
+            priority="interactive"):
+        """
+        Runs a model request within the budgets and the concurrency limit, retrying it on retryable errors
+
+        @param func: Function sending the request
+        @param args: Arguments of the function
+        @param nb_tokens: Estimated number of tokens of the request (taken from the tokens budget)
+        @param priority: Priority lane of the request ("interactive" or "bulk")
+        """
+        for attempt in range(self.max_retries + 1):
+            with self.slot(priority, nb_tokens=nb_tokens):
+                start = time.perf_counter()
+                try:
+                    result = func(*args)
+                except Exception as error:
+                    rate_limited = get_status_code(error) == 429
+                    if rate_limited:
+                        self.adapt_limit(rate_limited=True)
+                    if not self.is_retryable(error) or attempt == self.max_retries:
+                        raise
+                    retry_after = get_retry_after(error)
+                    delay = self.get_backoff_delay(attempt, retry_after)
+                    if rate_limited and self.bucket is not None:
+                        # Other requests and processes back off too
+                        self.bucket.block(retry_after if retry_after is not None else self.base_delay)
+                    with self.condition:
+                        self.stats["retries"] += 1
+                        self.stats["rateLimited"] += int(rate_limited)
+                else:
+                    self.adapt_limit(latency=time.perf_counter() - start)
+                    with self.condition:
+                        self.stats["requests"] += 1
+                    return result
+            # Waiting outside of the slot so that other requests can run meanwhile
+            time.sleep(delay)
+
+
+def render_metrics():
+    """
+    Returns the state of the process schedulers in Prometheus text exposition format
+    """
+    with _schedulers_lock:
+        schedulers = list(_schedulers.values())
+    lines = []
+    for metric_name, metric_type, description, get_value in [
+            ("raqam_scheduler_concurrency_limit", "gauge", "Adaptive concurrency limit of model requests", lambda scheduler: scheduler.limit),
+            ("raqam_scheduler_in_flight", "gauge", "Model requests in flight", lambda scheduler: scheduler.in_flight),
+            ("raqam_scheduler_requests_total", "counter", "Successful model requests", lambda scheduler: scheduler.stats["requests"]),
+            ("raqam_scheduler_retries_total", "counter", "Retried model requests", lambda scheduler: scheduler.stats["retries"]),
+            ("raqam_scheduler_rate_limited_total", "counter", "Model requests answered 429", lambda scheduler: scheduler.stats["rateLimited"]),
+            ("raqam_scheduler_throttled_seconds_total", "counter", "Time waited for requests and tokens budgets", lambda scheduler: scheduler.stats["throttledSeconds"])]:
+        lines.append(f"# HELP {metric_name} {description}")
+        lines.append(f"# TYPE {metric_name} {metric_type}")
+        for scheduler in schedulers:
+            with scheduler.condition:
+                lines.append(f'{metric_name}{{model="{scheduler.name}"}} {get_value(scheduler)}')
+    return "\n".join(lines) + "\n"
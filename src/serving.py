@@ -0,0 +1,88 @@
+import threading
+
+from src.exception import ServiceUnavailableException
+
+
+def load_dependencies(base_quiz_config):
+    """
+    Loads lazily imported dependencies, model clients and tokenizers ahead of the first request (ex: in
+    the serving master process before workers are forked, or during Lambda initialization)
+
+    @param base_quiz_config: Base quiz configuration
+    """
+    import src.pdf
+    import src.web_page
+    import src.vector_store
+    from src.quiz_config import QuizConfig
+    from src.clients import FAKE_MODEL_PREFIX
+    from src.tokens import get_encoding
+    quiz_config = QuizConfig(**base_quiz_config)
+    # Tokens of fake models are estimated without tokenizer
+    for model_name in [quiz_config.llm.model_name, quiz_config.embedding_model.model]:
+        if not model_name.startswith(FAKE_MODEL_PREFIX):
+            get_encoding(model_name)
+
+
+class ConcurrencyLimiter():
+    def __init__(self,
+                 max_concurrent_requests=64,
+                 retry_after=5):
+        """
+        Bounds the number of generation requests in progress in a serving process. Requests above the
+        limit, or received while the process drains before shutdown, are rejected at once with a 503
+        error telling clients when to retry, instead of queueing behind slow generations.
+
+        @param max_concurrent_requests: Maximum number of requests in progress in the process
+        @param retry_after: Number of seconds after which rejected clients should retry
+        """
+        self.max_concurrent_requests = max_concurrent_requests
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.rejected = 0
+        self.draining = False
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a request slot, raises ServiceUnavailableException if none is free or if the process drains
+        """
+        with self.lock:
+            if self.draining or self.in_flight >= self.max_concurrent_requests:
+                self.rejected += 1
+                raise ServiceUnavailableException(retry_after=self.retry_after, draining=self.draining)
+            self.in_flight += 1
+
+    def release(self):
+        """
+        Frees a request slot
+        """
+        with self.lock:
+            self.in_flight -= 1
+
+    def drain(self):
+        """
+        Rejects new requests, requests in progress being completed before the process exits (does not
+        take the lock, so that it can be called from a signal handler)
+        """
+        self.draining = True
+
+    def render(self):
+        """
+        Returns the limiter metrics in Prometheus text exposition format
+        """
+        with self.lock:
+            in_flight, rejected, draining = self.in_flight, self.rejected, self.draining
+        return "\n".join([
+            "# HELP raqam_requests_in_flight Generation requests in progress in the serving process",
+            "# TYPE raqam_requests_in_flight gauge",
+            f"raqam_requests_in_flight {in_flight}",
+            "# HELP raqam_requests_max_concurrent Maximum generation requests in progress in the serving process",
+            "# TYPE raqam_requests_max_concurrent gauge",
+            f"raqam_requests_max_concurrent {self.max_concurrent_requests}",
+            "# HELP raqam_requests_rejected_total Generation requests rejected with a 503 error",
+            "# TYPE raqam_requests_rejected_total counter",
+            f"raqam_requests_rejected_total {rejected}",
+            "# HELP raqam_draining Whether the serving process drains before shutdown",
+            "# TYPE raqam_draining gauge",
+            f"raqam_draining {int(draining)}"
+        ]) + "\n"
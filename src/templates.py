@@ -28,4 +28,43 @@ For each flashcard, include :
 
 retrieval_query = """
 Extract detailed and specific content from the document to generate questions.
+"""
+
+retrieval_queries = [
+    "Definitions of the key terms and concepts introduced in the document.",
+    "Important facts, figures, dates and names mentioned in the document.",
+    "Processes, methods and steps described in the document.",
+    "Causes, consequences and relationships between ideas of the document.",
+    "Examples, applications and case studies presented in the document."
+]
+
+packed_question_prompt_template = """
+You are a helpful assistant. Based on the following content made of {nb_sections} numbered sections, generate {num_questions} detailed multiple-choice questions that tests understanding of the material. 
+Spread the questions evenly over the sections.
+
+Content:
+{content}
+
+Make the questions specific and ensure each one relates directly to a single section of the provided material. Include:
+- A question
+- Four choices (one correct and three plausible distractors)
+- The correct answer
+- An explanation
+- The number of the section the question is about
+
+Provide a general quiz name about this content
+"""
+
+packed_flashcards_prompt_template = """
+You are a helpful assistant. Based on the following content made of {nb_sections} numbered sections, generate flashcards to summarize the main subjects of each section. 
+A flashcard can be either a term with its definition or an important notion with an explanation.
+You can generate up to 4 flashcards per section, {num_flashcards} flashcards in total.
+
+Content:
+{content}
+
+For each flashcard, include :
+- The front of the card : the term, the notion or the question
+- The back of the card : the definition, the explanation or the answer
+- The number of the section the flashcard is about
 """
\ No newline at end of file
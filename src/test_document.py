@@ -0,0 +1,58 @@
+import threading
+
+import pytest
+
+from src.document import Document
+from src.exception import DocumentParsingException
+from src.fakes import FakeEmbeddings
+from src.vector_store import VectorStore
+
+PAGES = [" ".join(f"page{page} word{word}." for word in range(200)) for page in range(20)]
+
+
+class RecordingEmbeddings(FakeEmbeddings):
+    def __init__(self, events):
+        super().__init__(model="fake:recording", dimensions=32)
+        self.events = events
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self.lock:
+            self.events.append("embed")
+        return super().embed_documents(texts)
+
+
+def iter_pages(events):
+    for page in PAGES:
+        events.append("page")
+        yield page
+
+def test_chunks_are_split_lazily():
+    events = []
+    document = Document(text_data=iter_pages(events), chunk_size=500, chunk_overlap=50)
+    assert events == []
+    first_chunk = next(document.stream_chunks())
+    assert events == ["page"] and first_chunk.page == 1
+    eager_document = Document(text_data=PAGES, chunk_size=500, chunk_overlap=50)
+    assert document.chunks == eager_document.chunks
+    assert document.text_chunks == [PAGES[chunk.page - 1][chunk.start:chunk.end] for chunk in document.chunks]
+    assert document.content_length == sum(len(page) for page in PAGES)
+
+def test_extraction_errors_are_parsing_errors():
+    def failing_pages():
+        yield PAGES[0]
+        raise ValueError("corrupted page")
+    document = Document(text_data=failing_pages(), chunk_size=500, chunk_overlap=50)
+    for _ in range(2):
+        with pytest.raises(DocumentParsingException):
+            document.text_chunks
+
+def test_chunks_are_embedded_while_extracted():
+    events = []
+    document = Document(text_data=iter_pages(events), chunk_size=500, chunk_overlap=50)
+    vector_store = VectorStore(embedding_model=RecordingEmbeddings(events), embedding_batch_size=4)
+    vector_store.add_embedded_chunks(chunk.text for chunk in document.stream_chunks())
+    # Batches are embedded before the last pages are extracted
+    assert events.index("embed") < len(events) - events[::-1].index("page") - 1
+    assert vector_store.embeddings.shape == (len(document.text_chunks), 32)
+    assert vector_store.get_chunks([0])[0].page_content == document.text_chunks[0]
@@ -0,0 +1,97 @@
+import os
+import threading
+
+import numpy as np
+
+from benchmarks.bench_chunking import generate_pages
+from src.document_state import DocumentState
+from src.fakes import FakeChatModel, FakeEmbeddings
+from src.raqam import QuizGenerator
+from src.templates import question_prompt_template, flashcards_prompt_template, retrieval_query
+
+EMBEDDING_SETTINGS = {"embeddingModel": "fake:embeddings"}
+GENERATION_SETTINGS = {"model": "fake:llm"}
+
+
+def open_state(path, embedding_settings=EMBEDDING_SETTINGS, generation_settings=GENERATION_SETTINGS):
+    return DocumentState(path=str(path), document_id="course", embedding_settings=embedding_settings,
+                         generation_settings=generation_settings)
+
+def save_version(path, chunks):
+    state = open_state(path)
+    hashes = [state.hash_chunk(chunk) for chunk in chunks]
+    for chunk_hash, chunk in zip(hashes, chunks):
+        state.add_questions(chunk_hash, [{"question": f"On {chunk}?"}])
+        state.add_flashcards(chunk_hash, [{"front": chunk}])
+    state.save(hashes, embeddings=np.arange(len(chunks) * 4, dtype=np.float32).reshape(len(chunks), 4))
+    return hashes
+
+def vectors_files(state):
+    return [file_name for file_name in os.listdir(state.path) if file_name.startswith("vectors-")]
+
+def test_revised_chunks_are_diffed_against_the_previous_version(tmp_path):
+    save_version(tmp_path, ["a", "b", "c"])
+    state = open_state(tmp_path)
+    hashes = [state.hash_chunk(chunk) for chunk in ["a", "c", "d"]]
+    assert state.diff(hashes) == {"chunks": 3, "unchangedChunks": 2, "addedChunks": 1, "removedChunks": 1,
+                                  "reusedEmbeddings": 0, "reusedQuestions": 0, "reusedFlashcards": 0}
+    embeddings = state.get_embeddings(hashes)
+    assert sorted(embeddings) == [0, 1]
+    assert embeddings[1].tolist() == [8, 9, 10, 11]
+    assert state.get_questions(hashes[1], 1) == [{"question": "On c?"}]
+    assert state.get_questions(hashes[1], 2) is None
+    assert state.get_flashcards(hashes[2]) is None
+    assert state.stats["reusedEmbeddings"] == 2 and state.stats["reusedQuestions"] == 1
+
+def test_changed_settings_invalidate_stored_items(tmp_path):
+    hashes = save_version(tmp_path, ["a", "b"])
+    state = open_state(tmp_path, embedding_settings={"embeddingModel": "other"})
+    assert state.get_embeddings(hashes) == {} and state.get_questions(hashes[0], 1) is not None
+    state = open_state(tmp_path, generation_settings={"model": "other"})
+    assert state.get_questions(hashes[0], 1) is None and len(state.get_embeddings(hashes)) == 2
+
+def test_removed_vectors_file_means_no_stored_embeddings(tmp_path):
+    hashes = save_version(tmp_path, ["a", "b"])
+    state = open_state(tmp_path)
+    os.remove(os.path.join(state.path, vectors_files(state)[0]))
+    state = open_state(tmp_path)
+    assert state.embeddings is None and state.get_embeddings(hashes) == {}
+    assert state.get_questions(hashes[0], 1) == [{"question": "On a?"}]
+
+def test_concurrent_saves_keep_the_vectors_of_the_saved_state(tmp_path):
+    threads = [threading.Thread(target=save_version, args=(tmp_path, [f"chunk {i}", "shared"])) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    state = open_state(tmp_path)
+    assert len(vectors_files(state)) == 1
+    assert state.embeddings is not None and state.embeddings.shape == (2, 4)
+
+def generate(tmp_path, pages, document_id=None):
+    quiz_generator = QuizGenerator(llm=FakeChatModel(model_name="fake:llm"),
+                                   embedding_model=FakeEmbeddings(model="fake:embeddings", dimensions=64),
+                                   embedding_batch_size=16,
+                                   min_text_length=0,
+                                   chunk_size=1000,
+                                   chunk_overlap=100,
+                                   question_prompt_template=question_prompt_template,
+                                   flashcards_prompt_template=flashcards_prompt_template,
+                                   retrieval_query=retrieval_query,
+                                   num_questions=4,
+                                   num_choices=4,
+                                   text_content="\n\n".join(pages),
+                                   document_state_path=str(tmp_path),
+                                   document_id=document_id)
+    quiz_generator.generate_quiz_and_flashcards()
+    return quiz_generator.get_context()
+
+def test_documents_are_regenerated_incrementally_only_with_an_explicit_id(tmp_path):
+    pages = generate_pages(10, 2000)
+    assert generate(tmp_path, pages)["incremental"] is None
+    assert not os.listdir(tmp_path)
+    first = generate(tmp_path, pages, document_id="course")
+    second = generate(tmp_path, pages, document_id="course")
+    assert first["incremental"]["unchangedChunks"] == 0
+    assert second["incremental"]["unchangedChunks"] == second["incremental"]["chunks"]
+    assert second["packing"]["llmRequests"] == 0
@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+
+from src.embedding_cache import EmbeddingCache
+
+
+def vector(value):
+    return np.full(4, value, dtype=np.float32)
+
+def journal_files(cache):
+    return [file_name for file_name in os.listdir(cache.path) if file_name.startswith("journal-")]
+
+def test_processes_share_journaled_updates(tmp_path):
+    first = EmbeddingCache(path=str(tmp_path), model_name="model", max_entries=3)
+    second = EmbeddingCache(path=str(tmp_path), model_name="model", max_entries=3)
+    first.put_many(["a", "b"], [vector(1), vector(2)])
+    index_mtime = first.index_mtime
+    second.put_many(["c"], [vector(3)])
+    # The second store is appended to the journal, the index file is not rewritten
+    assert second.index_mtime == index_mtime and len(journal_files(first)) == 1
+    assert [found[0] for found in first.get_many(["c", "a"])] == [3, 1]
+    # Hits of the first cache are written with its next store: "b" is the least recently used and evicted
+    first.put_many(["d"], [vector(4)])
+    second.load()
+    assert list(second.entries) == ["c", "a", "d"]
+    assert second.get_many(["b"]) == [None]
+    assert second.get_many(["d"])[0][0] == 4
+
+def test_journal_is_compacted(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path), model_name="model", max_entries=5000)
+    cache.put_many(["warmup"], [vector(0)])
+    index_mtime = cache.index_mtime
+    for i in range(1030):
+        cache.put_many([f"key-{i}"], [vector(i)])
+    # Compacted once the journal outgrows the index
+    assert cache.index_mtime != index_mtime
+    assert len(journal_files(cache)) == 1
+    reopened = EmbeddingCache(path=str(tmp_path), model_name="model", max_entries=5000)
+    assert list(reopened.entries) == list(cache.entries)
+    assert reopened.get_many(["key-1029"])[0][0] == 1029
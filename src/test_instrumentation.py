@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+
+from src.fakes import FakeEmbeddings
+from src.instrumentation import Metrics, Timings, record_retryable_response
+from src.vector_store import VectorStore
+
+
+class RetriedEmbeddings(FakeEmbeddings):
+    def embed_documents(self, texts):
+        # Response retried by the HTTP client before the successful one
+        record_retryable_response(SimpleNamespace(status_code=429))
+        return super().embed_documents(texts)
+
+
+def test_embedding_retries_are_added_to_the_embedding_span():
+    metrics = Metrics()
+    timings = Timings(metrics=metrics)
+    vector_store = VectorStore(embedding_model=RetriedEmbeddings(model="fake:retried", dimensions=16),
+                               embedding_batch_size=2, timings=timings)
+    vector_store.add_embedded_chunks([f"chunk {i}" for i in range(10)])
+    assert timings.summary()["generate_embeddings"]["retries"] == 5
+    assert metrics.retries["generate_embeddings"] == 5
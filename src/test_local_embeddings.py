@@ -0,0 +1,98 @@
+import os
+import sys
+import subprocess
+import threading
+
+import numpy as np
+import pytest
+
+from src.local_embeddings import LocalEmbeddings
+
+onnx = pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+tokenizers = pytest.importorskip("tokenizers")
+
+WORDS = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+
+# Runs in a gevent-patched interpreter: a greenlet ticking every 5 ms must keep running while model runs
+# (slowed down by a native sleep that does not yield to the event loop) embed concurrent requests
+GEVENT_SCRIPT = """
+from gevent import monkey; monkey.patch_all()
+import sys, time, gevent
+from src.local_embeddings import LocalEmbeddings
+
+native_sleep = monkey.get_original("time", "sleep")
+
+class SlowEmbeddings(LocalEmbeddings):
+    def run_model(self, texts):
+        native_sleep(0.2)
+        return super().run_model(texts)
+
+model = SlowEmbeddings("local:" + sys.argv[1], max_batch_size=4)
+model.load()
+gaps = []
+def tick():
+    last = time.perf_counter()
+    while True:
+        gevent.sleep(0.005)
+        now = time.perf_counter()
+        gaps.append(now - last)
+        last = now
+ticker = gevent.spawn(tick)
+requests = [gevent.spawn(model.embed_documents, ["alpha beta", "gamma", "delta epsilon", "zeta"]) for _ in range(3)]
+gevent.joinall(requests, raise_error=True)
+ticker.kill()
+assert all(len(request.value) == 4 for request in requests)
+print(len(gaps), max(gaps))
+"""
+
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    from onnx import helper, TensorProto
+    path = tmp_path_factory.mktemp("model")
+    vocab = {"[UNK]": 0, "[PAD]": 1, **{word: i + 2 for i, word in enumerate(WORDS)}}
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer.save(str(path / "tokenizer.json"))
+    # Token embeddings looked up in a random table (mean pooled by LocalEmbeddings)
+    table = np.random.default_rng(0).standard_normal((len(vocab), 8)).astype(np.float32)
+    graph = helper.make_graph([helper.make_node("Gather", ["table", "input_ids"], ["last_hidden_state"])], "lookup",
+                              [helper.make_tensor_value_info("input_ids", TensorProto.INT64, ["batch", "tokens"])],
+                              [helper.make_tensor_value_info("last_hidden_state", TensorProto.FLOAT, ["batch", "tokens", 8])],
+                              [helper.make_tensor("table", TensorProto.FLOAT, table.shape, table.flatten())])
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)], ir_version=8), str(path / "model.onnx"))
+    return str(path)
+
+def test_embeddings_are_normalized_and_independent_of_batching(model_path):
+    model = LocalEmbeddings("local:" + model_path, max_batch_size=2)
+    embeddings = np.array(model.embed_documents(["alpha beta", "gamma", "alpha beta gamma delta", "theta"]))
+    assert embeddings.shape == (4, 8) and model.dimensions == 8
+    assert np.allclose(np.linalg.norm(embeddings, axis=1), 1, atol=1e-5)
+    # Padding of the longer texts of a batch does not change the embeddings of shorter texts
+    assert np.allclose(embeddings[0], model.embed_query("alpha beta"), atol=1e-5)
+
+def test_concurrent_requests_are_batched_and_warm_up_is_not_counted(model_path):
+    model = LocalEmbeddings("local:" + model_path, max_batch_size=64, max_wait=0.05)
+    model.load()
+    assert model.nb_batches == 0 and model.nb_texts == 0
+    barrier = threading.Barrier(8)
+    def request():
+        barrier.wait()
+        model.embed_documents(["alpha beta", "gamma delta"])
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert model.nb_texts == 16
+    assert model.nb_batches < 8
+
+def test_model_runs_do_not_block_the_gevent_event_loop(model_path):
+    pytest.importorskip("gevent")
+    output = subprocess.run([sys.executable, "-c", GEVENT_SCRIPT, model_path], capture_output=True, text=True, timeout=120,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert output.returncode == 0, output.stderr
+    nb_ticks, max_gap = output.stdout.split()
+    # 3 batches of 4 texts run for 0.2 second each
+    assert int(nb_ticks) > 50 and float(max_gap) < 0.1
@@ -0,0 +1,68 @@
+import numpy as np
+
+from src.question_bank import QuestionBank, allocate_questions
+
+
+def question(text):
+    return {"question": text, "choices": ["a", "b", "c", "d"], "answer_index": 0, "explanation": "Because"}
+
+def one_hot(index, dimension=64):
+    vector = np.zeros(dimension, dtype=np.float32)
+    vector[index] = 1.0
+    return vector
+
+def build_bank(tmp_path, nb_chunks=10, questions_per_chunk=3, **settings):
+    bank = QuestionBank(path=str(tmp_path / "bank.sqlite"), **settings)
+    questions = [(chunk_index, question(f"Question {n} on chunk {chunk_index}"))
+                 for chunk_index in range(nb_chunks) for n in range(questions_per_chunk)]
+    embeddings = [one_hot(i) for i in range(len(questions))]
+    assert bank.add_questions("doc", questions, embeddings, quiz_name="Course", nb_chunks=nb_chunks) == len(questions)
+    bank.add_flashcards("doc", [(chunk_index, {"front": f"Term {chunk_index}", "back": "Definition"}) for chunk_index in range(nb_chunks)])
+    return bank
+
+def test_allocation_covers_the_least_banked_chunks_first():
+    assert allocate_questions({}, nb_chunks=4, num_questions=6) == [2, 2, 1, 1]
+    assert allocate_questions({0: 3, 1: 1}, nb_chunks=3, num_questions=3) == [0, 1, 2]
+    assert allocate_questions({}, nb_chunks=0, num_questions=3) == []
+
+def test_near_duplicate_questions_are_dropped(tmp_path):
+    bank = QuestionBank(path=str(tmp_path / "bank.sqlite"), duplicate_threshold=0.95)
+    assert bank.add_questions("doc", [(0, question("First")), (0, question("Second"))], [one_hot(0), one_hot(1)]) == 2
+    near_first = one_hot(0) + 0.1 * one_hot(2)
+    # Duplicate of a banked question, then duplicate of a previous question of the batch
+    added = bank.add_questions("doc", [(1, question("First again")), (1, question("Third")), (1, question("Third again"))],
+                               [near_first, one_hot(3), one_hot(3)])
+    assert added == 1
+    assert bank.get_chunk_counts("doc") == {0: 2, 1: 1}
+
+def test_sampling_is_stratified_by_chunk(tmp_path):
+    bank = build_bank(tmp_path)
+    result = bank.sample("doc", 5, with_flashcards=True)
+    assert result["hit"] and result["bankedQuestions"] == 30 and result["sampledChunks"] == 5
+    chunk_indices = sorted(question.chunk_index for question in result["quiz"].questions)
+    # One question from each fifth of the document
+    assert [chunk_index // 2 for chunk_index in chunk_indices] == [0, 1, 2, 3, 4]
+    assert result["quiz"].quiz_name == "Course"
+    assert len(result["flashcards"].flashcards) == 10
+
+def test_sampling_serves_least_served_questions_first(tmp_path):
+    bank = build_bank(tmp_path, nb_chunks=2, questions_per_chunk=3, max_serves=1)
+    served = []
+    for _ in range(3):
+        result = bank.sample("doc", 2)
+        served.extend(question.question for question in result["quiz"].questions)
+    # Every banked question is served once before any is served again
+    assert len(set(served)) == 6
+    assert bank.sample("doc", 2)["freshQuestions"] == 0
+
+def test_sampling_misses_when_the_bank_is_too_small(tmp_path):
+    bank = build_bank(tmp_path, nb_chunks=2, questions_per_chunk=1)
+    assert not bank.sample("doc", 3)["hit"]
+    assert not bank.sample("other", 1)["hit"]
+
+def test_a_single_build_is_claimed_at_a_time(tmp_path):
+    bank = QuestionBank(path=str(tmp_path / "bank.sqlite"), build_stale_after=60)
+    assert bank.claim_build("doc")
+    assert not bank.claim_build("doc")
+    bank.release_build("doc")
+    assert bank.claim_build("doc")
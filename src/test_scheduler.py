@@ -0,0 +1,143 @@
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from src.quiz_config import QuizConfig
+from src.scheduler import RequestScheduler, get_scheduler
+from src.utils import load_config
+
+
+def build_quiz_config(**settings):
+    quiz_config = {**load_config()["base_quiz_config"],
+                   "model_name": "fake:budgets-llm",
+                   "embdeddings_model_name": "fake:budgets-embeddings",
+                   "embedding_cache_path": None,
+                   "web_cache_path": None,
+                   "document_state_path": None,
+                   **settings}
+    return QuizConfig(**quiz_config)
+
+def test_quiz_configs_with_other_budgets_reconfigure_the_scheduler(tmp_path):
+    rate_limits_path = str(tmp_path / "rate_limits.sqlite")
+    first = build_quiz_config(llm_rpm=100, llm_tpm=10000, rate_limits_path=rate_limits_path, scheduler_max_concurrency=4)
+    assert first.llm_scheduler.bucket.rpm == 100 and first.llm_scheduler.max_concurrency == 4
+    # Custom configuration changing the budgets (numbers posted as floats by the sandbox UI)
+    second = build_quiz_config(llm_rpm=200.0, llm_tpm=None, rate_limits_path=None, scheduler_max_concurrency=8.0)
+    assert second.llm_scheduler is first.llm_scheduler
+    assert second.llm_scheduler.bucket.rpm == 200 and second.llm_scheduler.bucket.tpm is None
+    assert second.llm_scheduler.max_concurrency == 8
+    # Default calls share the configured scheduler
+    assert get_scheduler("fake:budgets-llm") is second.llm_scheduler
+    assert get_scheduler("fake:budgets-llm").max_concurrency == 8
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code,
+                                        headers={"retry-after": str(retry_after)} if retry_after is not None else {})
+
+def failing(errors, result="ok"):
+    calls = []
+    def func():
+        calls.append(time.perf_counter())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return func, calls
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+def test_rate_limited_requests_are_retried_after_retry_after():
+    scheduler = RequestScheduler(name="test-429", max_concurrency=8, base_delay=0.001, max_delay=0.002)
+    func, calls = failing([ProviderError(429, retry_after=0.05), ProviderError(503)])
+    assert scheduler.run(func) == "ok"
+    assert len(calls) == 3
+    # The Retry-After delay is a floor of the backoff delay
+    assert calls[1] - calls[0] >= 0.05
+    assert scheduler.stats["retries"] == 2 and scheduler.stats["rateLimited"] == 1 and scheduler.stats["requests"] == 1
+    # Halved by the 429 response, then increased additively by the success
+    assert scheduler.limit == pytest.approx(4 + 1 / 4)
+
+def test_non_retryable_and_exhausted_requests_raise():
+    scheduler = RequestScheduler(name="test-errors", max_retries=2, base_delay=0.001, max_delay=0.002)
+    func, calls = failing([ProviderError(400)])
+    with pytest.raises(ProviderError):
+        scheduler.run(func)
+    assert len(calls) == 1
+    func, calls = failing([ProviderError(500)] * 3)
+    with pytest.raises(ProviderError):
+        scheduler.run(func)
+    assert len(calls) == 3 and scheduler.stats["retries"] == 2
+
+def test_backoff_delay_is_jittered_exponential_and_bounded():
+    scheduler = RequestScheduler(name="test-backoff", base_delay=1.0, max_delay=8.0)
+    for attempt in range(6):
+        delays = [scheduler.get_backoff_delay(attempt) for _ in range(200)]
+        assert 0 <= min(delays) and max(delays) <= min(8.0, 2 ** attempt)
+    assert scheduler.get_backoff_delay(0, retry_after=30) == 30
+
+def test_interactive_requests_are_admitted_before_bulk_ones():
+    scheduler = RequestScheduler(name="test-lanes", max_concurrency=1, min_concurrency=1)
+    order = []
+    def request(priority):
+        with scheduler.slot(priority):
+            order.append(priority)
+    with scheduler.slot("interactive"):
+        threads = []
+        for priority in ["bulk", "bulk", "interactive"]:
+            threads.append(threading.Thread(target=request, args=(priority,)))
+            threads[-1].start()
+            wait_for(lambda: len(scheduler.waiting) == len(threads))
+    for thread in threads:
+        thread.join()
+    assert order == ["interactive", "bulk", "bulk"]
+    assert scheduler.in_flight == 0 and scheduler.waiting == []
+
+def test_concurrency_limit_adapts_aimd():
+    scheduler = RequestScheduler(name="test-aimd", max_concurrency=8, min_concurrency=2, latency_target=1.0)
+    scheduler.adapt_limit(rate_limited=True)
+    assert scheduler.limit == 4
+    scheduler.adapt_limit(rate_limited=True)
+    scheduler.adapt_limit(rate_limited=True)
+    assert scheduler.limit == 2
+    scheduler.adapt_limit(latency=0.1)
+    assert scheduler.limit == 2.5
+    scheduler.adapt_limit(latency=5.0)
+    assert scheduler.limit == pytest.approx(2.25)
+    for _ in range(200):
+        scheduler.adapt_limit(latency=0.1)
+    assert scheduler.limit == 8
+
+def test_requests_in_flight_stay_within_the_limit():
+    scheduler = RequestScheduler(name="test-in-flight", max_concurrency=3, min_concurrency=1)
+    in_flight, peak, lock = [0], [0], threading.Lock()
+    def request():
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+    threads = [threading.Thread(target=scheduler.run, args=(request,)) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 3
+
+def test_requests_wait_for_the_requests_budget(tmp_path):
+    scheduler = RequestScheduler(name="test-budget", rpm=600, rate_limits_path=str(tmp_path / "rate_limits.sqlite"))
+    start = time.perf_counter()
+    for _ in range(12):
+        scheduler.run(lambda: None)
+    # A burst of 10 requests (1 second of budget), then one request every 0.1 second
+    assert time.perf_counter() - start >= 0.15
+    assert scheduler.stats["throttledSeconds"] > 0
@@ -0,0 +1,84 @@
+import io
+import json
+
+import pytest
+
+from src.exception import ServiceUnavailableException
+from src.serving import ConcurrencyLimiter
+
+
+def test_requests_above_the_limit_are_rejected():
+    limiter = ConcurrencyLimiter(max_concurrent_requests=2, retry_after=7)
+    limiter.acquire()
+    limiter.acquire()
+    with pytest.raises(ServiceUnavailableException) as error:
+        limiter.acquire()
+    assert error.value.status_code == 503 and error.value.retry_after == 7
+    limiter.release()
+    limiter.acquire()
+    assert limiter.in_flight == 2 and limiter.rejected == 1
+    assert "raqam_requests_rejected_total 1" in limiter.render()
+
+def test_draining_rejects_new_requests_and_completes_requests_in_progress():
+    limiter = ConcurrencyLimiter(max_concurrent_requests=2)
+    limiter.acquire()
+    limiter.drain()
+    with pytest.raises(ServiceUnavailableException, match="shutting down"):
+        limiter.acquire()
+    limiter.release()
+    assert limiter.in_flight == 0
+    assert "raqam_draining 1" in limiter.render()
+
+
+@pytest.fixture
+def api(monkeypatch):
+    import api.api as api_module
+    # Job workers are not started by the test requests
+    monkeypatch.setattr(api_module.job_queue, "start", lambda: None)
+    monkeypatch.setattr(api_module.job_queue, "request_stop", lambda: None)
+    monkeypatch.setattr(api_module, "limiter", ConcurrencyLimiter(max_concurrent_requests=1, retry_after=2.5))
+    monkeypatch.setitem(api_module.config, "base_quiz_config",
+                        {**api_module.config["base_quiz_config"],
+                         "model_name": "fake:serving-llm",
+                         "embdeddings_model_name": "fake:serving-embeddings",
+                         "embedding_cache_path": None,
+                         "web_cache_path": None,
+                         "min_text_length": 0})
+    monkeypatch.setattr(api_module, "result_cache", None)
+    return api_module
+
+def post_quiz(client, data):
+    return client.post("/generate-quiz", data={"data": (io.BytesIO(json.dumps(data).encode("utf-8")), "data.json")},
+                       content_type="multipart/form-data")
+
+QUIZ_DATA = {"text_content": "Photosynthesis converts light into chemical energy. " * 20, "num_questions": 1,
+             "num_choices": 4, "generate_flashcards": False}
+
+def test_generation_slots_are_released(api):
+    client = api.app.test_client()
+    response = post_quiz(client, QUIZ_DATA)
+    assert response.status_code == 200
+    response.close()
+    assert api.limiter.in_flight == 0
+    # Failed requests release their slot too
+    response = post_quiz(client, {})
+    assert response.status_code >= 400
+    response.close()
+    assert api.limiter.in_flight == 0
+
+def test_busy_process_answers_503_with_retry_after(api):
+    client = api.app.test_client()
+    api.limiter.acquire()
+    response = post_quiz(client, QUIZ_DATA)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    assert response.get_json()["error"] == "ServiceUnavailableException"
+    # Other endpoints are not limited
+    assert client.get("/health").status_code == 200
+
+def test_draining_process_fails_health_checks_and_rejects_generations(api):
+    client = api.app.test_client()
+    api.drain()
+    assert client.get("/health").status_code == 503
+    response = post_quiz(client, QUIZ_DATA)
+    assert response.status_code == 503 and "Retry-After" in response.headers
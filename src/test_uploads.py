@@ -0,0 +1,57 @@
+import os
+import base64
+import tracemalloc
+
+import pytest
+
+from src.uploads import SPOOL_CHUNK_SIZE, spool_base64, spool_stream, remove_files
+
+# Size of the large upload, an order of magnitude above the memory allowed to spool it
+UPLOAD_SIZE = 64 * 1024 * 1024
+
+
+def measure_peak(func, *args):
+    """
+    Runs a function and returns its result and the peak of python allocations it made above their size
+    at its start, in bytes
+    """
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak - start
+
+@pytest.fixture(scope="module")
+def content():
+    return os.urandom(UPLOAD_SIZE)
+
+def read_spooled(path):
+    try:
+        with open(path, "rb") as file:
+            return file.read()
+    finally:
+        remove_files([path])
+
+def test_spool_stream_peak_memory(tmp_path, content):
+    upload_path = tmp_path / "upload.pdf"
+    upload_path.write_bytes(content)
+    with open(upload_path, "rb") as stream:
+        path, peak = measure_peak(spool_stream, stream, str(tmp_path))
+    assert peak < 4 * SPOOL_CHUNK_SIZE
+    assert read_spooled(path) == content
+
+@pytest.mark.parametrize("line_length", [None, 76])
+def test_spool_base64_peak_memory(tmp_path, content, line_length):
+    encoded = base64.b64encode(content).decode("ascii")
+    if line_length is not None:
+        # Base64 bodies split in lines (MIME style), line breaks are ignored
+        encoded = "\n".join(encoded[i:i + line_length] for i in range(0, len(encoded), line_length))
+    path, peak = measure_peak(spool_base64, encoded, str(tmp_path))
+    del encoded
+    # A few encoded and decoded blocks are held at once, never a whole decoded copy of the upload
+    assert peak < 6 * 4 * SPOOL_CHUNK_SIZE
+    assert read_spooled(path) == content
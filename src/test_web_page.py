@@ -0,0 +1,107 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from bs4 import BeautifulSoup
+
+from src.exception import WebPageException
+from src.web_page import WebPage, find_largest_text_block
+
+PAGE = b"<html><body><div>Lorem ipsum dolor sit amet</div></body></html>"
+ETAG = '"page-v1"'
+LAST_MODIFIED = "Wed, 21 Oct 2026 07:28:00 GMT"
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path == "/slow":
+            time.sleep(1)
+            self.send_full_response(PAGE)
+        elif self.path == "/large":
+            self.send_full_response(b"x" * 2000)
+        elif self.path == "/large-chunked":
+            # Body sent without Content-Length, the size limit applies while streaming
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"x" * 2000)
+            self.close_connection = True
+        elif self.path == "/etag":
+            if self.headers.get("If-None-Match") == ETAG:
+                self.send_not_modified()
+            else:
+                self.send_full_response(PAGE, {"ETag": ETAG})
+        elif self.path == "/last-modified":
+            if self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+                self.send_not_modified()
+            else:
+                self.send_full_response(PAGE, {"Last-Modified": LAST_MODIFIED})
+        elif self.path == "/no-store":
+            self.send_full_response(PAGE, {"ETag": ETAG, "Cache-Control": "no-store"})
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def send_full_response(self, body, headers=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_not_modified(self):
+        self.send_response(304)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def full_responses(server, path):
+    return [headers for request_path, headers in server.requests if request_path == path]
+
+def test_read_timeout(server):
+    with pytest.raises(WebPageException):
+        WebPage(url=server.url + "/slow", read_timeout=0.2).fetch()
+
+def test_max_bytes_with_content_length(server):
+    with pytest.raises(WebPageException, match="larger than 1000 bytes"):
+        WebPage(url=server.url + "/large", max_bytes=1000).fetch()
+
+def test_max_bytes_while_streaming(server):
+    with pytest.raises(WebPageException, match="larger than 1000 bytes"):
+        WebPage(url=server.url + "/large-chunked", max_bytes=1000).fetch()
+    assert len(WebPage(url=server.url + "/large-chunked", max_bytes=5000).fetch()) == 2000
+
+@pytest.mark.parametrize("path, validator", [("/etag", "If-None-Match"), ("/last-modified", "If-Modified-Since")])
+def test_revalidation(server, tmp_path, path, validator):
+    assert WebPage(url=server.url + path, cache_path=str(tmp_path)).fetch() == PAGE
+    assert WebPage(url=server.url + path, cache_path=str(tmp_path)).fetch() == PAGE
+    first_request, second_request = full_responses(server, path)
+    assert validator not in first_request
+    assert validator in second_request
+
+def test_no_store_is_not_cached(server, tmp_path):
+    for _ in range(2):
+        assert WebPage(url=server.url + "/no-store", cache_path=str(tmp_path)).fetch() == PAGE
+    assert all("If-None-Match" not in headers for headers in full_responses(server, "/no-store"))
+    assert not list(tmp_path.iterdir())
+
+def test_largest_text_block_ties_keep_document_order():
+    soup = BeautifulSoup("<!DOCTYPE html><div>a</div><div>b</div><div><!-- comment --></div>", "html.parser")
+    assert find_largest_text_block(soup).get_text() == "a"
+    soup = BeautifulSoup("<div><div>ab</div></div>", "html.parser")
+    assert find_largest_text_block(soup) is soup.div
@@ -0,0 +1,70 @@
+from functools import lru_cache
+
+from src.clients import FAKE_MODEL_PREFIX
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """
+    Returns the tiktoken encoding of a model, loaded once per model and process. Models unknown to
+    tiktoken fall back to the cl100k_base encoding.
+
+    @param model: Name of the model
+    """
+    # Importing tiktoken only when tokens must be counted (token usage is usually reported by the provider)
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens of a text (4 characters per token) without loading a tokenizer
+
+    @param text: Text for which to estimate tokens
+    """
+    return max(1, len(text) // 4)
+
+def count_tokens(text,
+                 model):
+    """
+    Counts the tokens of a text for a model, estimated for fake models so that offline runs never download
+    a tokenizer
+
+    @param text: Text for which to count tokens
+    @param model: Name of the model
+    """
+    if model.startswith(FAKE_MODEL_PREFIX):
+        return estimate_tokens(text)
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+def count_tokens_many(texts,
+                      model,
+                      num_threads=8):
+    """
+    Counts the tokens of several texts for a model, encoding them in batch across threads (estimated for
+    fake models)
+
+    @param texts: Texts for which to count tokens
+    @param model: Name of the model
+    @param num_threads: Number of threads used by tiktoken to encode the batch
+    """
+    if not texts:
+        return []
+    if model.startswith(FAKE_MODEL_PREFIX):
+        return [estimate_tokens(text) for text in texts]
+    encoded_texts = get_encoding(model).encode_batch(list(texts), num_threads=num_threads, disallowed_special=())
+    return [len(tokens) for tokens in encoded_texts]
+
+def get_usage_tokens(message):
+    """
+    Returns the (input, output) tokens reported by the provider in a chat message usage metadata,
+    None if the provider did not report them
+
+    @param message: Raw chat message returned by the LLM
+    """
+    usage_metadata = getattr(message, "usage_metadata", None)
+    if not usage_metadata:
+        return None
+    return usage_metadata["input_tokens"], usage_metadata["output_tokens"]
@@ -0,0 +1,96 @@
+import os
+import base64
+import shutil
+import tempfile
+from pathlib import Path
+
+# Size of the blocks copied or decoded at once when spooling uploads
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+def create_spool_file(directory=None,
+                      suffix=".pdf"):
+    """
+    Creates an empty temporary file for an upload and returns its opened file object and path
+
+    @param directory: Directory of the temporary file (system temporary directory if None)
+    @param suffix: Suffix of the temporary file name
+    """
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix="raqam_upload_", dir=directory)
+    return os.fdopen(fd, "wb"), Path(path)
+
+def spool_stream(stream,
+                 directory=None,
+                 suffix=".pdf"):
+    """
+    Copies an uploaded file stream block by block into a temporary file and returns its path, so that
+    the upload is never held whole in memory
+
+    @param stream: Readable binary file object of the upload
+    @param directory: Directory of the temporary file (system temporary directory if None)
+    @param suffix: Suffix of the temporary file name
+    """
+    file, path = create_spool_file(directory=directory, suffix=suffix)
+    try:
+        with file:
+            shutil.copyfileobj(stream, file, SPOOL_CHUNK_SIZE)
+    except Exception:
+        remove_files([path])
+        raise
+    return path
+
+def spool_base64(encoded,
+                 directory=None,
+                 suffix=".pdf"):
+    """
+    Decodes a base64 string block by block into a temporary file and returns its path, so that the
+    decoded content is never held whole in memory next to the encoded string
+
+    @param encoded: Base64 encoded content (whitespaces and line breaks are ignored)
+    @param directory: Directory of the temporary file (system temporary directory if None)
+    @param suffix: Suffix of the temporary file name
+    """
+    file, path = create_spool_file(directory=directory, suffix=suffix)
+    try:
+        with file:
+            remainder = ""
+            # Blocks are a multiple of 4 characters, undecoded characters are carried over to the next block
+            for start in range(0, len(encoded), 4 * SPOOL_CHUNK_SIZE):
+                block = remainder + "".join(encoded[start:start + 4 * SPOOL_CHUNK_SIZE].split())
+                end = len(block) - len(block) % 4
+                file.write(base64.b64decode(block[:end]))
+                remainder = block[end:]
+            if remainder:
+                file.write(base64.b64decode(remainder + "=" * (-len(remainder) % 4)))
+    except Exception:
+        remove_files([path])
+        raise
+    return path
+
+def spool_copy(path,
+               directory=None,
+               suffix=".pdf"):
+    """
+    Copies a spooled upload file block by block into a new temporary file and returns its path (ex: to
+    queue a job on an upload that the current request still reads)
+
+    @param path: Path of the spooled file
+    @param directory: Directory of the temporary file (system temporary directory if None)
+    @param suffix: Suffix of the temporary file name
+    """
+    with open(path, "rb") as stream:
+        return spool_stream(stream, directory=directory, suffix=suffix)
+
+def remove_files(paths):
+    """
+    Removes spooled upload files, ignoring files that were already moved or removed
+
+    @param paths: Paths of the files to remove
+    """
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
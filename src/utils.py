@@ -1,6 +1,5 @@
 import re
 import os
-import tiktoken
 import yaml
 import random
 
@@ -57,9 +56,28 @@ def get_questions_distribution(nb_text_chunks, num_questions):
         index = (index + 1) % nb_text_chunks
     return questions_distribution
 
+def get_proportional_distribution(sizes, total):
+    """
+    Distributes a total number of items proportionally to sizes with the largest remainder method
+
+    @param sizes: Sizes of the parts among which to distribute items
+    @param total: Number of items to distribute
+    """
+    sum_sizes = sum(sizes)
+    if sum_sizes == 0:
+        return get_questions_distribution(nb_text_chunks=len(sizes), num_questions=total) if sizes else []
+    quotas = [size * total / sum_sizes for size in sizes]
+    distribution = [int(quota) for quota in quotas]
+    # Giving remaining items to the parts with the largest fractional parts
+    remainders = sorted(range(len(sizes)), key=lambda i: quotas[i] - distribution[i], reverse=True)
+    for i in remainders[:total - sum(distribution)]:
+        distribution[i] += 1
+    return distribution
+
 def count_tokens(text, model):
-    encoding = tiktoken.encoding_for_model(model)
-    return len(encoding.encode(text))
+    # Kept for backward compatibility, encodings are cached in src.tokens
+    from src.tokens import count_tokens as count_model_tokens
+    return count_model_tokens(text=text, model=model)
 
 def read_yaml(path):
     with open(path, 'r') as file:
@@ -70,6 +88,9 @@ def save_yaml(dictionnary, path):
         yaml.dump(dictionnary, file, default_flow_style=False, sort_keys=False)
 
 def load_config():
+    # Configuration file set by the environment (ex: serving deployments, load tests)
+    if os.environ.get('RAQAM_CONFIG'):
+        return read_yaml(os.environ['RAQAM_CONFIG'])
     if os.path.exists('config/custom_config.yaml'):
         return read_yaml('config/custom_config.yaml')
     else:
@@ -1,71 +1,278 @@
 import os
+import json
+import math
+import shutil
+import hashlib
+import itertools
+import threading
 import numpy as np
 
 import faiss
 from langchain.vectorstores import FAISS
 from langchain_community.docstore.in_memory import InMemoryDocstore
-
-import concurrent.futures
+from langchain_community.vectorstores.utils import DistanceStrategy
 
 from tqdm import tqdm
 
+from src.chunk_store import ChunkStore
+from src.clients import get_embedding_dimension
+from src.concurrency import iter_completed
+from src.instrumentation import span, with_current_spans
+from src.scheduler import get_scheduler
+from src.tokens import estimate_tokens
+
 
 class VectorStore():
     def __init__(self,
                  embedding_model,
                  embedding_batch_size,
-                 local_vector_store_path=None):
+                 local_vector_store_path=None,
+                 embedding_cache=None,
+                 chunk_size=None,
+                 chunk_overlap=None,
+                 index_strategy="auto",
+                 index_metric="l2",
+                 hnsw_min_chunks=5000,
+                 ivfpq_min_chunks=100000,
+                 hnsw_m=32,
+                 hnsw_ef_construction=64,
+                 hnsw_ef_search=64,
+                 ivf_nlist=None,
+                 ivf_nprobe=16,
+                 pq_m=64,
+                 pq_nbits=8,
+                 timings=None,
+                 scheduler=None,
+                 priority="interactive"):
         """
-        FAISS Vectors Store with specific embeddings model
+        FAISS Vectors Store with specific embeddings model. The FAISS index is built when chunks are added,
+        its type being chosen from the number of chunks when index_strategy is "auto": exact flat index
+        for small documents, HNSW graph then IVF-PQ (trained product quantization) for large ones.
 
         @param embedding_model: Model for embeddings to use for this vector store 
         @param embedding_batch_size: Size of batch for which to calculate embeddings      
-        @param local_vector_store_path: Path to use to load vector store
+        @param local_vector_store_path: Root directory of persisted vector stores (one namespace per document)
+        @param embedding_cache: EmbeddingCache to reuse embeddings of already embedded chunks
+        @param chunk_size: Size of chunk used to split the document (part of embedding cache keys)
+        @param chunk_overlap: Number of characters for chunk overlap (part of embedding cache keys)
+        @param index_strategy: Type of FAISS index ("auto", "flat", "hnsw" or "ivfpq")
+        @param index_metric: Search metric, "l2" or "ip" (inner product on normalized vectors, i.e. cosine)
+        @param hnsw_min_chunks: Minimum number of chunks for which "auto" strategy uses an HNSW index
+        @param ivfpq_min_chunks: Minimum number of chunks for which "auto" strategy uses an IVF-PQ index
+        @param hnsw_m: Number of neighbors per node of the HNSW graph
+        @param hnsw_ef_construction: Size of the candidates list when building the HNSW graph
+        @param hnsw_ef_search: Size of the candidates list when searching the HNSW graph (recall/latency knob)
+        @param ivf_nlist: Number of IVF clusters (4 * sqrt(number of chunks) if None)
+        @param ivf_nprobe: Number of IVF clusters visited per search (recall/latency knob)
+        @param pq_m: Number of product quantization sub-vectors (lowered to a divisor of the dimension)
+        @param pq_nbits: Number of bits per product quantization code
+        @param timings: Timings recording the embedding, indexing and search stages (not recorded if None)
+        @param scheduler: RequestScheduler of the embedding requests (process-wide scheduler of the model if None)
+        @param priority: Priority lane of the embedding requests ("interactive" or "bulk")
         """
         self.embedding_model = embedding_model
         self.embedding_batch_size = embedding_batch_size
-        if local_vector_store_path is None or not os.path.exists(local_vector_store_path):
-            # Creating index with faiss
-            index = faiss.IndexFlatL2(len(self.embedding_model.embed_query("hello world")))
-            # Creating vector store with corresponding embedding function and index
-            self.vector_store = FAISS(
-                embedding_function=self.embedding_model,
-                index=index,
-                docstore=InMemoryDocstore(),
-                index_to_docstore_id={},
-            ) 
+        self.embedding_cache = embedding_cache
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.cache_hits = 0
+        self.lock = threading.Lock()
+        # Embeddings matrix of the stored chunks (in index order) used for coverage selection
+        self.embeddings = None
+        # Embeddings of retrieval queries, reused across searches, and queries sent to the embedding model
+        self.query_embeddings = {}
+        self.embedded_queries = []
+        self.index_strategy = index_strategy
+        self.index_metric = index_metric
+        self.hnsw_min_chunks = hnsw_min_chunks
+        self.ivfpq_min_chunks = ivfpq_min_chunks
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+        self.ivf_nlist = ivf_nlist
+        self.ivf_nprobe = ivf_nprobe
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.timings = timings
+        self.scheduler = scheduler if scheduler is not None else get_scheduler(getattr(embedding_model, "model", None))
+        self.priority = priority
+        self.local_vector_store_path = local_vector_store_path
+        # Index is created when chunks are added (once their number and dimension are known) or loaded
+        self.vector_store = None
+
+    def select_index_strategy(self,
+                              nb_vectors):
+        """
+        Returns the type of FAISS index to use for a number of vectors
+
+        @param nb_vectors: Number of vectors to index
+        """
+        if self.index_strategy != "auto":
+            return self.index_strategy
+        if nb_vectors >= self.ivfpq_min_chunks:
+            return "ivfpq"
+        if nb_vectors >= self.hnsw_min_chunks:
+            return "hnsw"
+        return "flat"
+
+    def build_index(self,
+                    embeddings):
+        """
+        Builds (and trains if needed) an empty FAISS index suited to the embeddings to store
+
+        @param embeddings: Float32 matrix of the embeddings that will be added to the index
+        """
+        metric = faiss.METRIC_INNER_PRODUCT if self.index_metric == "ip" else faiss.METRIC_L2
+        if len(embeddings) == 0:
+            # Empty flat index with the dimension of the embeddings model
+            return faiss.IndexFlat(get_embedding_dimension(self.embedding_model), metric)
+        nb_vectors, dimension = embeddings.shape
+        strategy = self.select_index_strategy(nb_vectors)
+        nlist = self.ivf_nlist or max(1, int(4 * math.sqrt(nb_vectors)))
+        if strategy == "ivfpq" and nb_vectors < max(39 * nlist, 2 ** self.pq_nbits):
+            # Not enough vectors to train IVF clusters and PQ codebooks
+            strategy = "hnsw"
+        print(f"Building {strategy} FAISS index for {nb_vectors} vectors")
+        if strategy == "hnsw":
+            index = faiss.IndexHNSWFlat(dimension, self.hnsw_m, metric)
+            index.hnsw.efConstruction = self.hnsw_ef_construction
+            index.hnsw.efSearch = self.hnsw_ef_search
+        elif strategy == "ivfpq":
+            quantizer = faiss.IndexFlat(dimension, metric)
+            pq_m = max(m for m in range(1, min(self.pq_m, dimension) + 1) if dimension % m == 0)
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, self.pq_nbits, metric)
+            index.train(embeddings)
+            index.nprobe = self.ivf_nprobe
         else:
-            self.vector_store = FAISS.load_local(local_vector_store_path, self.embedding_model, allow_dangerous_deserialization=True)
+            index = faiss.IndexFlat(dimension, metric)
+        return index
     
     def generate_embeddings(self,
-                            chunks):
+                            chunks,
+                            known_embeddings=None):
+        """
+        Generates text embeddings for chunks, only sending to the embedding model the chunks whose
+        embedding is not already known nor found in the embedding cache. Returns the chunks, their
+        embeddings and the chunks that were embedded.
+
+        @param chunks: Text chunks (or iterator of text chunks) for which to generate embeddings
+        @param known_embeddings: Already known embeddings as a {chunk position: embedding} dictionnary (ex: unchanged chunks of a revised document)
+        """
+        if known_embeddings:
+            chunks = list(chunks)
+            missing_indices = [i for i in range(len(chunks)) if i not in known_embeddings]
+            embeddings = np.empty((len(chunks), len(next(iter(known_embeddings.values())))), dtype=np.float32)
+            for i, embedding in known_embeddings.items():
+                embeddings[i] = embedding
+            embedded_chunks = []
+            if missing_indices:
+                _, missing_embeddings, embedded_chunks = self.generate_embeddings([chunks[i] for i in missing_indices])
+                embeddings[missing_indices] = missing_embeddings
+            return chunks, embeddings, embedded_chunks
+        all_chunks, embeddings, embedded_chunks = [], [], []
+        for batch, batch_embeddings, embedded_batch in self.iter_embedded_batches(chunks):
+            all_chunks.extend(batch)
+            embeddings.append(batch_embeddings)
+            embedded_chunks.extend(embedded_batch)
+        return all_chunks, np.concatenate(embeddings) if embeddings else np.array([], dtype=np.float32), embedded_chunks
+
+    def embed_documents(self,
+                        texts):
+        """
+        Embeds texts in one request sent through the scheduler of the embedding model
+
+        @param texts: Texts to embed
+        """
+        return self.scheduler.run(self.embedding_model.embed_documents, texts,
+                                  nb_tokens=sum(estimate_tokens(text) for text in texts), priority=self.priority)
+
+    def embed_batch(self,
+                    chunks):
+        """
+        Embeds a batch of chunks, taking the embeddings of the chunks found in the embedding cache from
+        the cache and storing the other ones in it. Returns the batch, its embeddings and the chunks that
+        were embedded.
+
+        @param chunks: Text chunks of the batch
+        """
+        if self.embedding_cache is None:
+            return chunks, np.array(self.embed_documents(chunks), dtype=np.float32), chunks
+        # Looking up chunks in embedding cache
+        keys = [self.embedding_cache.make_key(chunk, self.chunk_size, self.chunk_overlap) for chunk in chunks]
+        embeddings = self.embedding_cache.get_many(keys)
+        missing_indices = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        with self.lock:
+            self.cache_hits += len(chunks) - len(missing_indices)
+        # Embedding cache misses and storing them in cache
+        missing_chunks = [chunks[i] for i in missing_indices]
+        if missing_chunks:
+            missing_embeddings = np.array(self.embed_documents(missing_chunks), dtype=np.float32)
+            self.embedding_cache.put_many([keys[i] for i in missing_indices], missing_embeddings)
+            for i, embedding in zip(missing_indices, missing_embeddings):
+                embeddings[i] = embedding
+        return chunks, np.array(embeddings, dtype=np.float32), missing_chunks
+
+    def iter_embedded_batches(self,
+                              chunks):
+        """
+        Generates text embeddings for chunks by batch and with parallelization, batches in flight being
+        bounded by the scheduler of the embedding model. Chunks may be an iterator (ex: chunks of a document
+        still being extracted), each batch being embedded as soon as its chunks are produced. Yields the
+        (batch, embeddings, embedded chunks) of each batch in chunk order.
+
+        @param chunks: Text chunks (or iterator of text chunks) for which to generate embeddings
+        """
+        chunks = iter(chunks)
+        batches = iter(lambda: list(itertools.islice(chunks, self.embedding_batch_size)), [])
+        results = {}
+        next_index = 0
+        # Create a tqdm progress bar for monitoring (retries of the batches being added to the current span)
+        for index, result in tqdm(iter_completed(with_current_spans(self.embed_batch), batches, max_concurrency=self.scheduler.max_concurrency),
+                                  desc="Generating embeddings"):
+            results[index] = result
+            while next_index in results:
+                yield results.pop(next_index)
+                next_index += 1
+
+    def embed_chunks(self,
+                     chunks):
         """
-        Generates text embeddings for chunks by batch and with parallelization
+        Generates text embeddings for chunks by batch and with parallelization (see iter_embedded_batches)
 
-        @param chunks: Text chunks for which to generate embeddings
+        @param chunks: Text chunks (or iterator of text chunks) for which to generate embeddings
         """
-        embeddings = []
-        # Split chunks into batches for parallel processing
-        batches = [chunks[i:i + self.embedding_batch_size] for i in range(0, len(chunks), self.embedding_batch_size)]        
-        # Create a tqdm progress bar for monitoring
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            # Use tqdm to wrap the list of batches being processed
-            batch_embeddings = list(tqdm(executor.map(self.embedding_model.embed_documents, batches), total=len(batches), desc="Generating embeddings"))        
-        # Flatten the list of batches
-        for batch in batch_embeddings:
-            embeddings.extend(batch)
-        return np.array(embeddings)
+        return self.generate_embeddings(chunks)[1]
 
     def add_embedded_chunks(self,
-                            chunks):
+                            chunks,
+                            known_embeddings=None):
         """
-        Creates the vector stores with corresponding embeddings model and loads the text chunks
+        Creates the vector stores with corresponding embeddings model and loads the text chunks.
+        Returns the chunks that were sent to the embedding model (cache misses).
 
-        @param chunks: Text chunks for which to generate embeddings and to store in vector store
+        @param chunks: Text chunks (or iterator of text chunks) for which to generate embeddings and to store in vector store
+        @param known_embeddings: Already known embeddings as a {chunk position: embedding} dictionnary
         """
         # Generating embeddings 
-        embeddings = self.generate_embeddings(chunks)
-        self.vector_store.add_embeddings(text_embeddings=zip(chunks, embeddings))
+        with span(self.timings, "generate_embeddings"):
+            chunks, embeddings, embedded_chunks = self.generate_embeddings(chunks, known_embeddings=known_embeddings)
+        with span(self.timings, "build_index"):
+            if self.index_metric == "ip":
+                # Normalizing embeddings so that inner product is cosine similarity (no-op on unit-norm embeddings)
+                faiss.normalize_L2(embeddings)
+            if self.vector_store is None:
+                # Creating vector store with corresponding embedding function and index
+                self.vector_store = FAISS(
+                    embedding_function=self.embedding_model,
+                    index=self.build_index(embeddings),
+                    docstore=InMemoryDocstore(),
+                    index_to_docstore_id={},
+                    distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT if self.index_metric == "ip" else DistanceStrategy.EUCLIDEAN_DISTANCE,
+                    normalize_L2=self.index_metric == "ip"
+                )
+            self.vector_store.add_embeddings(text_embeddings=zip(chunks, embeddings))
+        self.embeddings = embeddings if self.embeddings is None else np.vstack([self.embeddings, embeddings])
+        return embedded_chunks
 
     def find_relevant_chunks(self,
                              query,
@@ -76,14 +283,237 @@ class VectorStore():
         @param query: Query to use to retrieve document
         @param k: Number of results to retrieve from query        
         """
-        results = self.vector_store.similarity_search(query, k=k)
+        results = self.vector_store.similarity_search_by_vector(self.embed_queries([query])[0].tolist(), k=k)
         return results
+
+    def embed_queries(self,
+                      queries):
+        """
+        Returns the float32 embeddings matrix of queries, embedded in a single request the first time they are used
+
+        @param queries: Queries to embed
+        """
+        key = tuple(queries)
+        if key not in self.query_embeddings:
+            query_embeddings = np.array(self.embed_documents(list(queries)), dtype=np.float32)
+            if self.index_metric == "ip":
+                faiss.normalize_L2(query_embeddings)
+            self.query_embeddings[key] = query_embeddings
+            self.embedded_queries.extend(queries)
+        return self.query_embeddings[key]
+
+    def find_relevant_chunks_multi(self,
+                                   queries,
+                                   k=5,
+                                   rows=None):
+        """
+        Retrieves relevant content chunks for several queries, embedded in a single request and searched
+        together in the index. Results of the queries are interleaved by rank without duplicates.
+
+        @param queries: Queries to use to retrieve document
+        @param k: Total number of results to retrieve
+        @param rows: Rows of the chunks among which to search (exact search on the embeddings matrix), all chunks if None
+        """
+        query_embeddings = self.embed_queries(queries)
+        if rows is None:
+            index = self.vector_store.index
+            _, results = index.search(query_embeddings, min(k, index.ntotal))
+        else:
+            rows = np.asarray(rows, dtype=np.int64)
+            embeddings = self.get_embeddings_matrix()[rows]
+            scores = query_embeddings @ embeddings.T
+            if self.index_metric != "ip":
+                # Ranking by L2 distance: |q - e|^2 = |q|^2 - 2 q.e + |e|^2 (|q|^2 being constant for a query)
+                scores = 2 * scores - (embeddings ** 2).sum(axis=1)
+            results = rows[np.argsort(-scores, axis=1)[:, :k]]
+        # Taking the best result of each query, then the second ones, etc. (dict keeps insertion order)
+        selected_rows = {}
+        for row in results.T.flatten():
+            if row >= 0:
+                selected_rows.setdefault(int(row))
+        return self.get_chunks(list(selected_rows)[:k])
+
+    def select_covering_chunks(self,
+                               k=5,
+                               strategy="mmr",
+                               mmr_lambda=0.5,
+                               rows=None):
+        """
+        Selects k chunks covering the whole document from the stored embeddings (no embedding request),
+        returned in document order. "mmr" selects chunks close to the document centroid while penalizing
+        similarity to already selected chunks, "kmeans" selects the medoid of each of k clusters.
+
+        @param k: Number of chunks to select
+        @param strategy: Selection strategy ("mmr" or "kmeans")
+        @param mmr_lambda: Trade-off between relevance (1) and diversity (0) of MMR selection
+        @param rows: Rows of the chunks among which to select (ex: chunks of a source), all chunks if None
+        """
+        embeddings = self.get_embeddings_matrix()
+        rows = np.arange(len(embeddings)) if rows is None else np.asarray(rows, dtype=np.int64)
+        # Cosine similarities are computed on a normalized copy of the embeddings
+        embeddings = np.array(embeddings[rows], dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+        if k >= len(embeddings):
+            return self.get_chunks(rows.tolist())
+        if strategy == "kmeans":
+            selected_rows = self.select_kmeans_medoids(embeddings, k)
+        else:
+            selected_rows = self.select_mmr(embeddings, k, mmr_lambda)
+        return self.get_chunks(sorted(rows[selected_rows].tolist()))
+
+    def select_mmr(self,
+                   embeddings,
+                   k,
+                   mmr_lambda):
+        """
+        Returns the rows of k embeddings selected by maximal marginal relevance to the document centroid
+
+        @param embeddings: Normalized float32 embeddings matrix
+        @param k: Number of rows to select
+        @param mmr_lambda: Trade-off between relevance (1) and diversity (0)
+        """
+        centroid = embeddings.mean(axis=0)
+        relevance = embeddings @ (centroid / max(np.linalg.norm(centroid), 1e-12))
+        max_similarity = np.zeros(len(embeddings), dtype=np.float32)
+        available = np.ones(len(embeddings), dtype=bool)
+        rows = []
+        for _ in range(k):
+            scores = relevance if not rows else mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+            row = int(np.argmax(np.where(available, scores, -np.inf)))
+            rows.append(row)
+            available[row] = False
+            max_similarity = np.maximum(max_similarity, embeddings @ embeddings[row])
+        return rows
+
+    def select_kmeans_medoids(self,
+                              embeddings,
+                              k):
+        """
+        Returns the rows of the embeddings closest to the centroids of a k-means clustering in k clusters
+
+        @param embeddings: Normalized float32 embeddings matrix
+        @param k: Number of rows to select
+        """
+        kmeans = faiss.Kmeans(embeddings.shape[1], k, niter=20, seed=1234, spherical=True)
+        kmeans.train(embeddings)
+        similarities = embeddings @ kmeans.centroids.T
+        rows = []
+        for cluster in range(k):
+            # Closest chunk to the cluster centroid that is not already selected
+            similarities[rows, cluster] = -np.inf
+            rows.append(int(np.argmax(similarities[:, cluster])))
+        return rows
+
+    def get_embeddings_matrix(self):
+        """
+        Returns the float32 matrix of the stored embeddings (one row per chunk, in index order),
+        reconstructing it from the FAISS index when the vector store was loaded from a local file
+        """
+        index = self.vector_store.index
+        if self.embeddings is None or len(self.embeddings) != index.ntotal:
+            if isinstance(index, faiss.IndexIVF):
+                # IVF indexes need a direct map to reconstruct vectors (approximate for IVF-PQ)
+                index.make_direct_map()
+            self.embeddings = index.reconstruct_n(0, index.ntotal)
+        return self.embeddings
+
+    def get_chunks(self,
+                   rows):
+        """
+        Returns the langchain documents of the chunks stored at rows of the index
+
+        @param rows: Rows of the chunks in the index
+        """
+        return [self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[row]) for row in rows]
     
+    def get_namespace(self,
+                      chunks):
+        """
+        Returns the namespace of the vector store of a document: hash of its chunks, of the embedding model
+        and of the settings of the index
+
+        @param chunks: Text chunks of the document
+        """
+        settings = [getattr(self.embedding_model, "model", None), self.chunk_size, self.chunk_overlap, self.index_strategy,
+                    self.index_metric, self.hnsw_min_chunks, self.ivfpq_min_chunks, self.hnsw_m, self.ivf_nlist, self.pq_m, self.pq_nbits]
+        document_hash = hashlib.sha256(json.dumps(settings).encode("utf-8"))
+        for chunk in chunks:
+            document_hash.update(chunk.encode("utf-8"))
+            document_hash.update(b"\0")
+        return document_hash.hexdigest()
+
+    def get_namespace_path(self,
+                           namespace):
+        """
+        Returns the directory of the persisted vector store of a namespace
+
+        @param namespace: Namespace of the vector store
+        """
+        return os.path.join(self.local_vector_store_path, namespace)
+
+    def load_vector_store(self,
+                          namespace):
+        """
+        Opens the persisted vector store of a namespace read-only, without deserialization: the FAISS index
+        and the embeddings matrix are memory-mapped as well as the chunk store. Returns whether the vector
+        store was found.
+
+        @param namespace: Namespace of the vector store
+        """
+        if self.local_vector_store_path is None:
+            return False
+        path = self.get_namespace_path(namespace)
+        if not os.path.exists(os.path.join(path, "metadata.json")):
+            return False
+        with open(os.path.join(path, "metadata.json"), "r") as file:
+            metadata = json.load(file)
+        index_path = os.path.join(path, "index.faiss")
+        try:
+            # Memory-mapping the codes of flat indexes (available in recent faiss versions)
+            index = faiss.read_index(index_path, faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0))
+        except RuntimeError:
+            index = faiss.read_index(index_path)
+        if isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = self.hnsw_ef_search
+        elif isinstance(index, faiss.IndexIVF):
+            index.nprobe = self.ivf_nprobe
+        chunk_store = ChunkStore(path, read_only=True)
+        self.index_metric = metadata["indexMetric"]
+        self.embeddings = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        # Chunks are identified by their row in the index and in the chunk store
+        self.vector_store = FAISS(
+            embedding_function=self.embedding_model,
+            index=index,
+            docstore=chunk_store,
+            index_to_docstore_id=range(len(chunk_store)),
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT if self.index_metric == "ip" else DistanceStrategy.EUCLIDEAN_DISTANCE,
+            normalize_L2=self.index_metric == "ip"
+        )
+        return True
+
     def save_vector_store(self,
-                          path):
+                          namespace):
         """
-        Saves the generated vector store to a local file
+        Persists the vector store in the directory of its namespace: native FAISS index file, float32
+        embeddings matrix and append-only chunk store. The directory is written aside and renamed, so
+        that readers never see a partially written vector store.
 
-        @param: Path where to save local vector store        
+        @param namespace: Namespace of the vector store
         """
-        self.vector_store.save_local(path)
\ No newline at end of file
+        path = self.get_namespace_path(namespace)
+        if os.path.exists(path):
+            return
+        index = self.vector_store.index
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        chunk_store = ChunkStore(temporary_path, read_only=False)
+        chunk_store.append([chunk.page_content for chunk in self.get_chunks(range(index.ntotal))])
+        faiss.write_index(index, os.path.join(temporary_path, "index.faiss"))
+        np.save(os.path.join(temporary_path, "vectors.npy"), np.ascontiguousarray(self.get_embeddings_matrix(), dtype=np.float32))
+        with open(os.path.join(temporary_path, "metadata.json"), "w") as file:
+            json.dump({"nbChunks": index.ntotal, "indexMetric": self.index_metric,
+                       "embeddingModel": getattr(self.embedding_model, "model", None)}, file)
+        try:
+            os.rename(temporary_path, path)
+        except OSError:
+            # Vector store saved by another process in the meantime
+            shutil.rmtree(temporary_path, ignore_errors=True)
\ No newline at end of file
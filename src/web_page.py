@@ -1,28 +1,201 @@
+import os
+import json
+import hashlib
+import threading
+
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.element import CData
 
 from src.exception import WebPageException
 
+# Parsing html with the C based lxml parser when it is installed
+try:
+    import lxml
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the process-wide HTTP session, keeping connections alive so that they are reused across requests
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+def find_largest_text_block(root,
+                            name="div"):
+    """
+    Returns the element with a tag name that has the longest text in a single post-order pass over the
+    html tree (the text length of an element being the sum of the text lengths of its children)
+
+    @param root: Root element of the html tree
+    @param name: Tag name of the elements to compare
+    """
+    text_lengths = {}
+    largest_element, largest_length, largest_position = None, -1, None
+    position = 0
+    stack = [(root, False, None)]
+    while stack:
+        element, children_visited, element_position = stack.pop()
+        children = [child for child in element.children if isinstance(child, Tag)]
+        if not children_visited:
+            # Position of the element in document order, ancestors coming before their descendants
+            stack.append((element, True, position))
+            position += 1
+            stack.extend((child, False, None) for child in reversed(children))
+            continue
+        # Counting the same strings as get_text (comments, doctypes and declarations are excluded)
+        text_length = sum(len(child) for child in element.children if type(child) in (NavigableString, CData))
+        text_length += sum(text_lengths.pop(id(child)) for child in children)
+        text_lengths[id(element)] = text_length
+        # Ties are won by the first element in document order (same as max over find_all)
+        if element.name == name and (text_length > largest_length or (text_length == largest_length and element_position < largest_position)):
+            largest_element, largest_length, largest_position = element, text_length, element_position
+    return largest_element
+
+
+class HTTPCache():
+    def __init__(self,
+                 path):
+        """
+        On-disk cache of web pages revalidated with conditional requests (ETag / Last-Modified)
+
+        @param path: Directory where cached pages are stored
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def get_paths(self,
+                  url):
+        """
+        Returns the (metadata, body) file paths of a cached url
+
+        @param url: URL of the web page
+        """
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, f"{key}.json"), os.path.join(self.path, f"{key}.body")
+
+    def get(self,
+            url):
+        """
+        Returns the (metadata, body) of a cached url, None if it is not cached
+
+        @param url: URL of the web page
+        """
+        metadata_path, body_path = self.get_paths(url)
+        try:
+            with open(metadata_path, "r") as file:
+                metadata = json.load(file)
+            with open(body_path, "rb") as file:
+                body = file.read()
+        except (OSError, ValueError):
+            return None
+        if metadata.get("url") != url:
+            return None
+        return metadata, body
+
+    def set(self,
+            url,
+            body,
+            etag=None,
+            last_modified=None):
+        """
+        Caches the body of a web page with its validators (written atomically)
+
+        @param url: URL of the web page
+        @param body: Bytes of the web page
+        @param etag: ETag header of the response
+        @param last_modified: Last-Modified header of the response
+        """
+        metadata_path, body_path = self.get_paths(url)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(body_path + suffix, "wb") as file:
+            file.write(body)
+        os.replace(body_path + suffix, body_path)
+        with open(metadata_path + suffix, "w") as file:
+            json.dump({"url": url, "etag": etag, "last_modified": last_modified}, file)
+        os.replace(metadata_path + suffix, metadata_path)
+
+
 class WebPage():
     def __init__(self,
-                 url):
+                 url,
+                 connect_timeout=5,
+                 read_timeout=30,
+                 max_bytes=10000000,
+                 cache_path=None):
         """
-        Web page for which to extract text content         
+        Web page for which to extract text content
+
+        @param url: URL of the web page
+        @param connect_timeout: Number of seconds to wait for the connection to the server
+        @param read_timeout: Number of seconds to wait between two bytes received from the server
+        @param max_bytes: Maximum size of the web page in bytes
+        @param cache_path: Directory of the on-disk HTTP cache (no cache if None)
         """
         self.url = url
         self.headers = {"User-Agent": "Mozilla/5.0"}
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_bytes = max_bytes
+        self.cache = HTTPCache(cache_path) if cache_path else None
+
+    def fetch(self):
+        """
+        Downloads the web page content (bytes), streaming the body up to max_bytes. Cached pages are
+        revalidated with a conditional request and reused when the server answers 304 Not Modified.
+        """
+        headers = dict(self.headers)
+        cached = self.cache.get(self.url) if self.cache is not None else None
+        if cached is not None:
+            metadata, _ = cached
+            if metadata.get("etag"):
+                headers["If-None-Match"] = metadata["etag"]
+            if metadata.get("last_modified"):
+                headers["If-Modified-Since"] = metadata["last_modified"]
+        try:
+            with get_session().get(self.url, headers=headers, timeout=self.timeout, stream=True) as r:
+                if r.status_code == 304 and cached is not None:
+                    return cached[1]
+                if r.status_code != 200:
+                    raise WebPageException(message=f"Failed to extract web content with status code {r.status_code}")
+                content_length = r.headers.get("Content-Length")
+                if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+                    raise WebPageException(message=f"Web page is larger than {self.max_bytes} bytes")
+                body = bytearray()
+                for data in r.iter_content(chunk_size=65536):
+                    body.extend(data)
+                    if len(body) > self.max_bytes:
+                        raise WebPageException(message=f"Web page is larger than {self.max_bytes} bytes")
+                etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+                no_store = "no-store" in r.headers.get("Cache-Control", "")
+        except requests.RequestException as e:
+            raise WebPageException(message=f"Failed to extract web content: {e}")
+        body = bytes(body)
+        if self.cache is not None and (etag or last_modified) and not no_store:
+            self.cache.set(self.url, body, etag=etag, last_modified=last_modified)
+        return body
 
     def extract_text(self):
         """
         Extracts the text from a web page by scraping page and parsing html
-        content to get relevant text        
+        content to get relevant text
         """
         # Extracting html content from web page
-        r = requests.get(self.url, headers=self.headers)
-        if r.status_code != 200:
-            raise WebPageException(message=f"Failed to extract web content with status code {r.status_code}")
+        content = self.fetch()
         # Parsing content from webpage
-        soup = BeautifulSoup(r.content, "html.parser")
+        soup = BeautifulSoup(content, HTML_PARSER)
         # Remove unwanted elements
         for tag in ["script", "style", "header", "nav", "footer", "aside", "form", "noscript"]:
             for element in soup.find_all(tag):
@@ -33,8 +206,6 @@ class WebPage():
             text = main_content.get_text(separator="\n", strip=True)
         else:
             # Fallback: Get the largest text-heavy div
-            divs = soup.find_all("div")
-            main_content = max(divs, key=lambda d: len(d.get_text()), default=None)
+            main_content = find_largest_text_block(soup, name="div")
             text = main_content.get_text(separator="\n", strip=True) if main_content else ""
         return text
-